@@ -0,0 +1,157 @@
+"""Collision-free account number allocation.
+
+Account numbers are issued from a counter instead of random draws. Each
+counter value is mapped through a keyed permutation of the 9-digit space
+(a Feistel network over 10**4 x 10**5), so consecutive accounts get
+unrelated-looking numbers. A Luhn check digit is appended to make the
+10-digit number. A permutation never maps two counters to the same
+number, so allocation is O(1) with no collision checks or retries, and
+mistyped numbers are caught by `is_valid`.
+
+The counter is persisted as a high-water mark. The allocator reserves
+counters in blocks, and a bank with a ledger journals each block's end
+before issuing from it. After a restart allocation resumes past the
+block, so no number is ever issued twice.
+"""
+import hashlib
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+BODY_SPACE = 10 ** 9  # 9-digit bodies; the 10th digit is the check digit
+HALVES = (10 ** 4, 10 ** 5)  # Feistel halves, alternating each round
+ROUNDS = 8
+MASK64 = (1 << 64) - 1
+
+
+def _chunk_sums(double_first):
+    """Luhn digit sums of every 3-digit chunk, by whether its last digit is doubled"""
+    sums = []
+    for chunk in range(1000):
+        total = 0
+        for position, digit in enumerate(map(int, reversed(f"{chunk:03d}"))):
+            if (position % 2 == 0) == double_first:
+                digit = digit * 2 - 9 if digit > 4 else digit * 2
+            total += digit
+        sums.append(total)
+    return sums
+
+
+_DOUBLED_FIRST = _chunk_sums(True)
+_PLAIN_FIRST = _chunk_sums(False)
+
+
+def luhn_digit(body):
+    """Return the Luhn check digit of a 9-digit body"""
+    high, low = divmod(body, 1000000)
+    middle, low = divmod(low, 1000)
+    # The body's last digit is doubled, since the check digit follows it
+    total = _DOUBLED_FIRST[low] + _PLAIN_FIRST[middle] + _DOUBLED_FIRST[high]
+    return -total % 10
+
+
+def is_valid(acc_num):
+    """Check the format and check digit of an allocated account number"""
+    return (len(acc_num) == 10 and acc_num.isdigit()
+            and luhn_digit(int(acc_num[:9])) == int(acc_num[9]))
+
+
+def _mix(value):
+    """64-bit integer hash (splitmix64 finalizer)"""
+    value = (value * 0x9E3779B97F4A7C15) & MASK64
+    value ^= value >> 29
+    value = (value * 0xBF58476D1CE4E5B9) & MASK64
+    return value ^ (value >> 32)
+
+
+class AccountNumberAllocator:
+    """Issue unique 10-digit account numbers from a keyed counter permutation"""
+
+    def __init__(self, key=None, next_counter=0, block_size=1000, on_reserve=None):
+        self.key = key if key is not None else os.urandom(16).hex()
+        digest = hashlib.blake2b(bytes.fromhex(self.key), digest_size=8 * ROUNDS).digest()
+        self.round_keys = [int.from_bytes(digest[i:i + 8], 'little') for i in range(0, len(digest), 8)]
+        self._rounds = [(round_key, HALVES[r % 2]) for r, round_key in enumerate(self.round_keys)]
+        self.next_counter = next_counter
+        self.reserved_until = next_counter  # Counters below this are journaled
+        self.block_size = block_size
+        self.on_reserve = on_reserve  # Called with the new high-water mark
+        self._lock = threading.Lock()
+
+    def permute(self, counter):
+        """Map a counter in [0, 10**9) to a 9-digit body"""
+        left, right = divmod(counter, HALVES[1])
+        for round_key, size in self._rounds:
+            # _mix inlined; size is the domain of the half being replaced
+            value = ((right ^ round_key) * 0x9E3779B97F4A7C15) & MASK64
+            value ^= value >> 29
+            value = (value * 0xBF58476D1CE4E5B9) & MASK64
+            left, right = right, (left + (value ^ (value >> 32))) % size
+        return left * HALVES[1] + right
+
+    def invert(self, body):
+        """Map a 9-digit body back to its counter"""
+        left, right = divmod(body, HALVES[1])
+        for r in range(ROUNDS - 1, -1, -1):
+            size = HALVES[r % 2]
+            left, right = (right - _mix(left ^ self.round_keys[r])) % size, left
+        return left * HALVES[1] + right
+
+    def number(self, counter):
+        """Return the account number issued for a counter value"""
+        body = self.permute(counter)
+        return f"{body:09d}{luhn_digit(body)}"
+
+    def _permute_many(self, first, count):
+        """Vectorized permute of the counters first..first + count - 1"""
+        left, right = np.divmod(np.arange(first, first + count, dtype=np.uint64),
+                                np.uint64(HALVES[1]))
+        with np.errstate(over='ignore'):
+            # uint64 arithmetic wraps modulo 2**64, matching the & MASK64
+            for round_key, size in self._rounds:
+                value = (right ^ np.uint64(round_key)) * np.uint64(0x9E3779B97F4A7C15)
+                value ^= value >> np.uint64(29)
+                value *= np.uint64(0xBF58476D1CE4E5B9)
+                value ^= value >> np.uint64(32)
+                # left < size, so reducing value first keeps the sum exact
+                left, right = right, (left + value % np.uint64(size)) % np.uint64(size)
+        return left * np.uint64(HALVES[1]) + right
+
+    def _take(self, count):
+        """Advance the counter by count, reserving a new block if needed"""
+        with self._lock:
+            first = self.next_counter
+            end = first + count
+            if end > BODY_SPACE:
+                raise OverflowError("Account number space exhausted")
+            if end > self.reserved_until:
+                self.reserved_until = min(BODY_SPACE, max(end, first + self.block_size))
+                if self.on_reserve is not None:
+                    self.on_reserve(self.reserved_until)
+            self.next_counter = end
+        return first
+
+    def allocate(self):
+        """Issue the next account number"""
+        return self.number(self._take(1))
+
+    def reserve(self, count):
+        """Issue a block of count consecutive account numbers at once"""
+        first = self._take(count)
+        if np is None or count < 1000:
+            return [self.number(counter) for counter in range(first, first + count)]
+        bodies = self._permute_many(first, count)
+        high, low = np.divmod(bodies, np.uint64(1000000))
+        middle, low = np.divmod(low, np.uint64(1000))
+        total = (np.take(_DOUBLED_FIRST, low) + np.take(_PLAIN_FIRST, middle)
+                 + np.take(_DOUBLED_FIRST, high))
+        numbers = bodies * np.uint64(10) + ((10 - total % 10) % 10).astype(np.uint64)
+        return [f"{number:010d}" for number in numbers.tolist()]
+
+    def state(self):
+        """Return the persistent state: the key and the high-water mark"""
+        return {'key': self.key, 'next_counter': self.reserved_until}
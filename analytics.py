@@ -0,0 +1,281 @@
+"""Transaction analytics for SmartBankr.
+
+`AccountStats` keeps running per-account aggregates that are updated in
+O(1) on every posting, so rendering analytics costs the same for an account
+with five transactions or five million.
+
+`bank_report` computes bank-wide metrics over every account at once from a
+columnar export of all histories. It is vectorized with NumPy when that is
+installed and falls back to a single pure-Python pass otherwise.
+"""
+from array import array
+from collections import deque
+
+from store import TRANSACTION_TYPES, TransactionStore, days_to_date
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+LARGE_TRANSACTION = 100000  # Cents; the analytics tab flags amounts over $1000
+RECENT_DATES = 5  # Number of recent transaction dates kept per account
+
+
+class AccountStats:
+    """Running analytics aggregates for one account's history"""
+
+    __slots__ = ('count', 'type_counts', 'total_deposits', 'total_withdrawals',
+                 'max_amount', 'recent_dates')
+
+    def __init__(self, transactions=()):
+        self.count = 0
+        self.type_counts = {}
+        self.total_deposits = 0
+        self.total_withdrawals = 0
+        self.max_amount = None
+        self.recent_dates = deque(maxlen=RECENT_DATES)
+        for transaction in transactions:
+            self.add(transaction)
+
+    def add(self, transaction):
+        """Fold one (date, type, amount, description, balance) posting in"""
+        date_str, t_type, amount = transaction[0], transaction[1], transaction[2]
+        self.count += 1
+        self.type_counts[t_type] = self.type_counts.get(t_type, 0) + 1
+        if t_type == 'Deposit':
+            self.total_deposits += amount
+        elif t_type == 'Withdrawal':
+            self.total_withdrawals += abs(amount)
+        if self.max_amount is None or amount > self.max_amount:
+            self.max_amount = amount
+        self.recent_dates.append(date_str)
+
+    def add_batch(self, date_str, t_type, amounts):
+        """Fold several postings of one date and type in at once"""
+        if not amounts:
+            return
+        self.count += len(amounts)
+        self.type_counts[t_type] = self.type_counts.get(t_type, 0) + len(amounts)
+        if t_type == 'Deposit':
+            self.total_deposits += sum(amounts)
+        elif t_type == 'Withdrawal':
+            self.total_withdrawals += sum(abs(amount) for amount in amounts)
+        largest = max(amounts)
+        if self.max_amount is None or largest > self.max_amount:
+            self.max_amount = largest
+        self.recent_dates.extend([date_str] * min(len(amounts), RECENT_DATES))
+
+    @classmethod
+    def from_totals(cls, count, type_counts, total_deposits, total_withdrawals, max_amount,
+                    recent_dates):
+        """Build aggregates computed elsewhere, e.g. vectorized over many histories"""
+        stats = cls()
+        stats.count = count
+        stats.type_counts = dict(type_counts)
+        stats.total_deposits = total_deposits
+        stats.total_withdrawals = total_withdrawals
+        stats.max_amount = max_amount
+        stats.recent_dates.extend(recent_dates)
+        return stats
+
+    @property
+    def has_large_transactions(self):
+        return self.max_amount is not None and self.max_amount > LARGE_TRANSACTION
+
+    def summary(self):
+        """Return the same dictionary as BankingModule.analyze_transactions"""
+        if not self.count:
+            return {}
+        return {
+            'total_transactions': self.count,
+            'transaction_types': set(self.type_counts),
+            'type_stats': dict(self.type_counts),
+            'total_deposits': self.total_deposits,
+            'total_withdrawals': self.total_withdrawals,
+            'net_flow': self.total_deposits - self.total_withdrawals
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, AccountStats):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+def export_columns(transactions):
+    """Concatenate every account's history into flat columns
+
+    Returns a dict with the account numbers and, per row, the index of its
+    account ('accounts'), epoch-day dates, type codes, and cent amounts and
+    balances. Rows of one account are contiguous and in posting order.
+    """
+    columns = {
+        'account_numbers': [],
+        'offsets': array('q', [0]),
+        'accounts': array('I'),
+        'dates': array('q'),
+        'types': array('B'),
+        'amounts': array('q'),
+        'balances': array('q'),
+    }
+    for index, (acc_num, history) in enumerate(transactions.items()):
+        if not isinstance(history, TransactionStore):
+            history = TransactionStore(rows=history)
+        columns['account_numbers'].append(acc_num)
+        columns['offsets'].append(columns['offsets'][-1] + len(history))
+        columns['accounts'].extend(array('I', [index]) * len(history))
+        columns['dates'].extend(history.dates)
+        columns['types'].extend(history.types)
+        columns['amounts'].extend(history.amounts)
+        columns['balances'].extend(history.balances)
+    return columns
+
+
+def bank_report(transactions=None, columns=None, large=LARGE_TRANSACTION):
+    """Compute bank-wide analytics with per-account and per-date rollups
+
+    Pass either the bank's transactions mapping or a columnar export from
+    `export_columns`; columns may carry 'type_names' when its type codes
+    were assigned by another process. The top-level keys match
+    analyze_transactions for the union of all histories, plus
+    'large_transactions' (amount > large), 'by_account' and 'by_date' rollups.
+    """
+    if columns is None:
+        columns = export_columns(transactions)
+    if not len(columns['amounts']):
+        return {}
+    if np is not None:
+        return _bank_report_numpy(columns, large)
+    return _bank_report_python(columns, large)
+
+
+def _summary(type_counts, total_deposits, total_withdrawals, large_count):
+    """Assemble the top-level report dictionary"""
+    return {
+        'total_transactions': sum(type_counts.values()),
+        'transaction_types': set(type_counts),
+        'type_stats': type_counts,
+        'total_deposits': total_deposits,
+        'total_withdrawals': total_withdrawals,
+        'net_flow': total_deposits - total_withdrawals,
+        'large_transactions': large_count,
+    }
+
+
+def _bank_report_numpy(columns, large):
+    """Vectorized bank_report over zero-copy NumPy views of the columns"""
+    types = np.frombuffer(columns['types'], dtype=np.uint8)
+    amounts = np.frombuffer(columns['amounts'], dtype=np.int64)
+    dates = np.frombuffer(columns['dates'], dtype=np.int64)
+    offsets = np.frombuffer(columns['offsets'], dtype=np.int64)
+
+    names = columns.get('type_names', TRANSACTION_TYPES)
+    counts = np.bincount(types, minlength=len(names))
+    type_counts = {names[code]: int(count) for code, count in enumerate(counts) if count}
+    deposits = np.where(types == names.index('Deposit'), amounts, 0)
+    withdrawals = np.where(types == names.index('Withdrawal'), np.abs(amounts), 0)
+    is_large = amounts > large
+    report = _summary(type_counts, int(deposits.sum()), int(withdrawals.sum()),
+                      int(is_large.sum()))
+
+    # Rows of an account are contiguous, so per-account sums are segment
+    # reductions; empty accounts are skipped because reduceat needs
+    # non-empty segments.
+    sizes = np.diff(offsets)
+    present = np.flatnonzero(sizes)
+    starts = offsets[:-1][present]
+    by_account = {}
+    if len(present):
+        account_deposits = np.add.reduceat(deposits, starts)
+        account_withdrawals = np.add.reduceat(withdrawals, starts)
+        account_large = np.add.reduceat(is_large.astype(np.int64), starts)
+        account_numbers = columns['account_numbers']
+        for i, index in enumerate(present.tolist()):
+            dep, wd = int(account_deposits[i]), int(account_withdrawals[i])
+            by_account[account_numbers[index]] = {
+                'total_transactions': int(sizes[index]),
+                'total_deposits': dep,
+                'total_withdrawals': wd,
+                'net_flow': dep - wd,
+                'large_transactions': int(account_large[i]),
+            }
+    report['by_account'] = by_account
+
+    # Dates span a small range of days, so group-by-date is a bincount; the
+    # float weights are exact while a day's volume stays below 2**53 cents
+    first_day = int(dates.min())
+    day_index = dates - first_day
+    day_counts = np.bincount(day_index)
+    day_volume = np.bincount(day_index, weights=np.abs(amounts))
+    day_net = np.bincount(day_index, weights=amounts)
+    report['by_date'] = {
+        days_to_date(first_day + day): {
+            'count': int(day_counts[day]),
+            'volume': int(round(day_volume[day])),
+            'net': int(round(day_net[day])),
+        }
+        for day in np.flatnonzero(day_counts).tolist()
+    }
+    return report
+
+
+def _bank_report_python(columns, large):
+    """Single-pass pure-Python bank_report used when NumPy is missing"""
+    names = columns.get('type_names', TRANSACTION_TYPES)
+    deposit_code = names.index('Deposit')
+    withdrawal_code = names.index('Withdrawal')
+    counts = [0] * len(names)
+    by_account = {}
+    by_day = {}
+    total_deposits = total_withdrawals = large_count = 0
+
+    account_numbers = columns['account_numbers']
+    offsets = columns['offsets']
+    types, amounts, dates = columns['types'], columns['amounts'], columns['dates']
+    for index, acc_num in enumerate(account_numbers):
+        start, end = offsets[index], offsets[index + 1]
+        if start == end:
+            continue
+        dep = wd = big = 0
+        for code, amount, day in zip(types[start:end], amounts[start:end], dates[start:end]):
+            counts[code] += 1
+            if code == deposit_code:
+                dep += amount
+            elif code == withdrawal_code:
+                wd += abs(amount)
+            if amount > large:
+                big += 1
+            day_stats = by_day.get(day)
+            if day_stats is None:
+                day_stats = by_day[day] = [0, 0, 0]
+            day_stats[0] += 1
+            day_stats[1] += abs(amount)
+            day_stats[2] += amount
+        by_account[acc_num] = {
+            'total_transactions': end - start,
+            'total_deposits': dep,
+            'total_withdrawals': wd,
+            'net_flow': dep - wd,
+            'large_transactions': big,
+        }
+        total_deposits += dep
+        total_withdrawals += wd
+        large_count += big
+
+    type_counts = {names[code]: count for code, count in enumerate(counts) if count}
+    report = _summary(type_counts, total_deposits, total_withdrawals, large_count)
+    report['by_account'] = by_account
+    report['by_date'] = {
+        days_to_date(day): {'count': count, 'volume': volume, 'net': net}
+        for day, (count, volume, net) in sorted(by_day.items())
+    }
+    return report
@@ -0,0 +1,483 @@
+"""Read-only memory-mapped ledger archives for statements and audits.
+
+An archive is one binary file holding a frozen copy of every account and
+transaction history. It is opened with mmap and read in place: opening
+costs a header parse, finding an account is a binary search over the
+mapped index, and a history is a zero-copy view over the mapped columns, so
+a statement for any account opens in milliseconds however large the
+archive is, and nothing is loaded that is not read.
+
+File layout (little-endian, every section 8-byte aligned):
+
+    magic       b'SBKARCH1'
+    header_len  uint64, then a JSON header with counts, transaction type
+                names and the (offset, size) of each section below
+
+    accounts    uint64  account numbers in row order
+    offsets     int64   n + 1 row offsets; account i owns rows
+                        offsets[i]:offsets[i + 1]
+    index_keys  uint64  account numbers, sorted
+    index_pos   uint64  position in accounts of each sorted key
+    dates       int64   days since 1970-01-01, one per row
+    amounts     int64   cents
+    balances    int64   cents
+    descs       uint32  description ids
+    types       uint8   index into the header's type names
+    str_offsets uint64  n + 1 offsets of each description in str_data
+    str_data    bytes   UTF-8 descriptions
+    meta_offsets uint64 n + 1 offsets of each account's JSON in meta_data
+    meta_data   bytes   account dicts as JSON, without credentials, in row order
+
+Every transaction field is a fixed-width column, the same layout as
+`store.TransactionStore`, so `bank_report` runs over the mapped columns
+directly, vectorized with NumPy when it is installed.
+
+Run ``python archive.py --help`` for the command line.
+"""
+import argparse
+import bisect
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from functools import lru_cache
+from itertools import groupby
+
+from analytics import AccountStats, bank_report
+from banking import Bank, banking_module
+from money import format_money
+from store import TRANSACTION_TYPES, StringTable, date_to_days, days_to_date, type_code
+
+MAGIC = b'SBKARCH1'
+VERSION = 1
+CREDENTIAL_FIELDS = frozenset({'pin'})  # Account fields never written to an archive
+
+# Column sections: name -> array typecode
+COLUMNS = {
+    'dates': 'q',
+    'amounts': 'q',
+    'balances': 'q',
+    'descs': 'I',
+    'types': 'B',
+}
+SECTIONS = ('accounts', 'offsets', 'index_keys', 'index_pos', *COLUMNS,
+            'str_offsets', 'str_data', 'meta_offsets', 'meta_data')
+
+
+class ArchiveWriter:
+    """Write an archive one account history at a time
+
+    Column data is spooled to temporary files next to the archive, so
+    memory use stays bounded by the largest single history.
+    """
+
+    def __init__(self, path, strings=None):
+        self.path = path
+        self.strings = strings if strings is not None else StringTable()
+        directory = os.path.dirname(os.path.abspath(path))
+        self._spool = {name: tempfile.TemporaryFile(dir=directory)
+                       for name in (*COLUMNS, 'meta_data')}
+        self.accounts = array('Q')
+        self.offsets = array('q', [0])
+        self.meta_offsets = array('Q', [0])
+
+    def add_account(self, account, history=()):
+        """Append an account dict and its history
+
+        history is a TransactionStore or an iterable of transaction tuples,
+        oldest first.
+        """
+        acc_num = account['acc_num']
+        if getattr(history, 'strings', None) is self.strings:
+            # Same description table: copy the columns as they are
+            columns = {name: getattr(history, name) for name in COLUMNS}
+        else:
+            columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+            intern = self.strings.intern
+            for date_str, t_type, amount, description, balance in history:
+                columns['dates'].append(date_to_days(date_str))
+                columns['types'].append(type_code(t_type))
+                columns['amounts'].append(amount)
+                columns['balances'].append(balance)
+                columns['descs'].append(intern(description))
+
+        for name, column in columns.items():
+            column.tofile(self._spool[name])
+        meta = json.dumps({key: value for key, value in account.items()
+                           if key not in CREDENTIAL_FIELDS}, separators=(',', ':')).encode()
+        self._spool['meta_data'].write(meta)
+
+        self.accounts.append(int(acc_num))
+        self.offsets.append(self.offsets[-1] + len(columns['dates']))
+        self.meta_offsets.append(self.meta_offsets[-1] + len(meta))
+
+    def close(self):
+        """Write the header, index and spooled columns to the archive file"""
+        order = sorted(range(len(self.accounts)), key=self.accounts.__getitem__)
+        index_keys = array('Q', (self.accounts[i] for i in order))
+        if any(a == b for a, b in zip(index_keys, index_keys[1:])):
+            raise ValueError("Duplicate account number in archive")
+
+        encoded = [text.encode() for text in self.strings.strings]
+        str_offsets = array('Q', [0])
+        for data in encoded:
+            str_offsets.append(str_offsets[-1] + len(data))
+
+        in_memory = {
+            'accounts': self.accounts,
+            'offsets': self.offsets,
+            'index_keys': index_keys,
+            'index_pos': array('Q', order),
+            'str_offsets': str_offsets,
+            'meta_offsets': self.meta_offsets,
+        }
+        sizes = {name: len(column) * column.itemsize for name, column in in_memory.items()}
+        for name, spool in self._spool.items():
+            sizes[name] = spool.seek(0, os.SEEK_END)
+        sizes['str_data'] = str_offsets[-1]
+
+        # Lay the sections out after a header padded to a fixed size
+        header = {
+            'version': VERSION,
+            'account_count': len(self.accounts),
+            'row_count': self.offsets[-1],
+            'string_count': len(encoded),
+            'types': list(TRANSACTION_TYPES),
+            'created_at': time.time(),
+            'sections': {},
+        }
+        header_len = 4096
+        while True:
+            position = _align(len(MAGIC) + 8 + header_len)
+            for name in SECTIONS:
+                header['sections'][name] = [position, sizes[name]]
+                position = _align(position + sizes[name])
+            header_bytes = json.dumps(header).encode()
+            if len(header_bytes) <= header_len:
+                break
+            header_len = _align(len(header_bytes))
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', header_len))
+            f.write(header_bytes.ljust(header_len))
+            for name in SECTIONS:
+                f.seek(header['sections'][name][0])
+                if name in in_memory:
+                    in_memory[name].tofile(f)
+                elif name == 'str_data':
+                    for data in encoded:
+                        f.write(data)
+                else:
+                    spool = self._spool[name]
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, f, 1 << 20)
+            f.truncate(position)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        for spool in self._spool.values():
+            spool.close()
+        return header
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for spool in self._spool.values():
+                spool.close()
+
+
+def _align(position):
+    """Round a file position up to the next multiple of 8"""
+    return (position + 7) & ~7
+
+
+def archive_bank(bank, path):
+    """Write every account and history of a bank to an archive file"""
+    with ArchiveWriter(path, bank.descriptions) as writer:
+        for acc_num, account in bank.accounts.items():
+            writer.add_account(account, bank.transactions.get(acc_num, ()))
+    return path
+
+
+def archive_files(accounts_path, transactions_path, path):
+    """Write an archive from migrate.py export files in constant memory
+
+    The transactions file must keep each account's rows together, as
+    `migrate.py export` writes them.
+    """
+    import migrate
+
+    accounts = {}
+    for account in map(migrate.parse_account,
+                       migrate.read_rows(accounts_path, migrate.ACCOUNT_FIELDS)):
+        accounts[account['acc_num']] = account
+    transactions = map(migrate.parse_transaction,
+                       migrate.read_rows(transactions_path, migrate.TRANSACTION_FIELDS))
+
+    with ArchiveWriter(path) as writer:
+        for acc_num, rows in groupby(transactions, key=lambda pair: pair[0]):
+            account = accounts.pop(acc_num, None)
+            if account is None:
+                raise ValueError(f"Rows of account {acc_num} are missing from the "
+                                 f"accounts file or not contiguous")
+            writer.add_account(account, (entry[1] for entry in rows))
+        for account in accounts.values():
+            writer.add_account(account)
+    return path
+
+
+class LedgerArchive:
+    """Read-only, memory-mapped view of an archive file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self._mmap)
+        if data[:len(MAGIC)] != MAGIC:
+            data.release()
+            self._mmap.close()
+            raise ValueError(f"{path} is not a SmartBankr ledger archive")
+        header_len, = struct.unpack_from('<Q', data, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(bytes(data[start:start + header_len]))
+        if self.header['version'] != VERSION:
+            raise ValueError(f"Unsupported archive version {self.header['version']}")
+        self.type_names = self.header['types']
+
+        views = {}
+        for name, (offset, size) in self.header['sections'].items():
+            views[name] = data[offset:offset + size]
+        self._views = views
+        self.accounts = views['accounts'].cast('Q')
+        self.offsets = views['offsets'].cast('q')
+        self.index_keys = views['index_keys'].cast('Q')
+        self.index_pos = views['index_pos'].cast('Q')
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, views[name].cast(typecode))
+        self.str_offsets = views['str_offsets'].cast('Q')
+        self.meta_offsets = views['meta_offsets'].cast('Q')
+        self.string = lru_cache(maxsize=65536)(self._decode_string)
+        self._data = data
+
+    def _decode_string(self, string_id):
+        data = self._views['str_data']
+        return str(data[self.str_offsets[string_id]:self.str_offsets[string_id + 1]], 'utf-8')
+
+    def _position(self, acc_num):
+        """Return the row-order position of an account, or None"""
+        try:
+            key = int(acc_num)
+        except (TypeError, ValueError):
+            return None
+        i = bisect.bisect_left(self.index_keys, key)
+        if i < len(self.index_keys) and self.index_keys[i] == key:
+            return self.index_pos[i]
+        return None
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __contains__(self, acc_num):
+        return self._position(acc_num) is not None
+
+    def account_numbers(self):
+        """Return every account number, in row order"""
+        return [f"{key:010d}" for key in self.accounts]
+
+    def account(self, acc_num):
+        """Return the archived account dict"""
+        position = self._position(acc_num)
+        if position is None:
+            raise KeyError(acc_num)
+        data = self._views['meta_data']
+        return json.loads(bytes(data[self.meta_offsets[position]:self.meta_offsets[position + 1]]))
+
+    def history(self, acc_num):
+        """Return an account's history as a zero-copy sequence of tuples"""
+        position = self._position(acc_num)
+        if position is None:
+            return ArchivedHistory(self, 0, 0)
+        return ArchivedHistory(self, self.offsets[position], self.offsets[position + 1])
+
+    def statement(self, acc_num, num_transactions=5):
+        """Return the most recent transactions of an account"""
+        return banking_module.generate_account_statement(self.history(acc_num), num_transactions)
+
+    def analytics(self, acc_num):
+        """Return the transaction analytics of an account in one pass"""
+        return AccountStats(self.history(acc_num)).summary()
+
+    def columns(self):
+        """Return the archive as zero-copy columns for bank_report"""
+        return {
+            'account_numbers': self.account_numbers(),
+            'offsets': self.offsets,
+            'dates': self.dates,
+            'types': self.types,
+            'type_names': self.type_names,
+            'amounts': self.amounts,
+            'balances': self.balances,
+        }
+
+    def report(self):
+        """Return bank-wide analytics over the whole archive"""
+        return bank_report(columns=self.columns())
+
+    def close(self):
+        """Release the memory views and unmap the file"""
+        if self._mmap.closed:
+            return
+        self.string.cache_clear()
+        for name in ('accounts', 'offsets', 'index_keys', 'index_pos', *COLUMNS,
+                     'str_offsets', 'meta_offsets'):
+            getattr(self, name).release()
+        for view in self._views.values():
+            view.release()
+        self._data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Views still held by callers keep the mapping alive until collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ArchivedHistory:
+    """Read-only slice of an archive's rows that reads like a history list"""
+
+    __slots__ = ('archive', 'start', 'stop')
+
+    def __init__(self, archive, start, stop):
+        self.archive = archive
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def row(self, index):
+        """Materialize the transaction tuple at an absolute row index"""
+        archive = self.archive
+        return (
+            days_to_date(archive.dates[index]),
+            archive.type_names[archive.types[index]],
+            archive.amounts[index],
+            archive.string(archive.descs[index]),
+            archive.balances[index]
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                # Slices are views too, so a statement never copies rows
+                return ArchivedHistory(self.archive, self.start + start,
+                                       self.start + max(start, stop))
+            return [self.row(self.start + i) for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self.row(self.start + index)
+
+    def __iter__(self):
+        archive = self.archive
+        start, stop = self.start, self.stop
+        names, string = archive.type_names, archive.string
+        for day, code, amount, balance, desc_id in zip(
+                archive.dates[start:stop], archive.types[start:stop],
+                archive.amounts[start:stop], archive.balances[start:stop],
+                archive.descs[start:stop]):
+            yield (days_to_date(day), names[code], amount, string(desc_id), balance)
+
+    def __reversed__(self):
+        for i in range(self.stop - 1, self.start - 1, -1):
+            yield self.row(i)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ArchivedHistory({len(self)} transactions)"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query SmartBankr ledger archives")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="write an archive")
+    build_parser.add_argument('archive')
+    build_parser.add_argument('--data-dir', help="persistent bank directory "
+                                                 "(default: the demo sample data)")
+    build_parser.add_argument('--accounts', help="accounts export file (with --transactions)")
+    build_parser.add_argument('--transactions', help="transactions export file")
+
+    statement_parser = commands.add_parser('statement', help="print an account statement")
+    statement_parser.add_argument('archive')
+    statement_parser.add_argument('acc_num')
+    statement_parser.add_argument('-n', type=int, default=5, help="number of transactions")
+
+    report_parser = commands.add_parser('report', help="print bank-wide analytics")
+    report_parser.add_argument('archive')
+
+    args = parser.parse_args(argv)
+    t0 = time.perf_counter()
+    if args.command == 'build':
+        if args.accounts or args.transactions:
+            if not (args.accounts and args.transactions):
+                parser.error("--accounts and --transactions go together")
+            archive_files(args.accounts, args.transactions, args.archive)
+        else:
+            if args.data_dir:
+                bank = Bank.open(args.data_dir)
+            else:
+                bank = Bank()
+                bank.load_sample_data()
+            try:
+                archive_bank(bank, args.archive)
+            finally:
+                bank.close()
+        with LedgerArchive(args.archive) as archive:
+            print(f"Archived {len(archive):,} accounts, {archive.header['row_count']:,} "
+                  f"transactions in {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+    else:
+        with LedgerArchive(args.archive) as archive:
+            if args.command == 'statement':
+                if args.acc_num not in archive:
+                    parser.error(f"account {args.acc_num} is not in the archive")
+                for date_str, t_type, amount, description, balance in \
+                        archive.statement(args.acc_num, args.n):
+                    print(f"{date_str}  {t_type:<10} {format_money(amount, signed=True):>14}  "
+                          f"{format_money(balance):>14}  {description}")
+            else:
+                report = archive.report()
+                print(json.dumps({key: value for key, value in report.items()
+                                  if key not in ('by_account', 'transaction_types')},
+                                 indent=2))
+            print(f"{args.command} took {(time.perf_counter() - t0) * 1000:.1f} ms",
+                  file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1219 @@
+"""SmartBankr banking engine.
+
+This module holds all banking state and operations and has no GUI
+dependencies, so importing it never pulls in tkinter. The Tkinter front-end
+in main.py, batch jobs and benchmarks all drive the same `Bank` engine.
+
+All amounts and balances are integer cents (see money.py).
+
+A `Bank` is safe to drive from many threads. Each account has its own lock;
+a transfer holds the locks of both accounts, always taken in account-number
+order so two opposite transfers can never deadlock. There is no global lock
+on the posting path.
+"""
+import re
+import gc
+import os
+import heapq
+import threading
+from contextlib import contextmanager
+from functools import reduce
+from itertools import accumulate
+from datetime import datetime
+
+from allocator import AccountNumberAllocator
+from analytics import AccountStats, bank_report
+from graph import CounterpartyIndex
+from instrument import timed
+from ledger import Ledger
+from money import AMOUNT_PATTERN, apply_rate, parse_money
+from pins import (BULK_PIN_ITERATIONS, PIN_ITERATIONS, SALT_BYTES, PinVerifier, hash_pin,
+                  needs_rehash, strengthen_pin_hash)
+from search import AccountIndex, DescriptionIndex
+from store import StringTable, TransactionStore, date_to_days, type_code
+
+# Registration and login rules, compiled once and shared by the form,
+# login and bulk onboarding
+NAME_PATTERN = re.compile(r'^[A-Za-z\s]{3,}$')
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+PHONE_PATTERN = re.compile(r'^\d{10}$')
+ACCOUNT_PATTERN = re.compile(r'^\d{10}$')
+PIN_PATTERN = re.compile(r'^\d{4}$')
+MIN_DEPOSIT = 1000  # Smallest opening deposit, in cents
+PIN_STRENGTHEN_CHUNK = 32  # Accounts per background PIN strengthening job
+
+
+@contextmanager
+def gc_paused():
+    """Pause the cycle collector while many long-lived objects are created
+
+    Accounts and histories are acyclic and live as long as the bank, so
+    collections triggered while a bulk job allocates them only rescan
+    them; pausing skips that work. Nested pauses are fine.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class BankError(ValueError):
+    """Raised when a banking operation is rejected"""
+
+
+def parse_amount(amount, error="Please enter a valid amount"):
+    """Convert a dollar string from a form, or integer cents, into cents"""
+    if isinstance(amount, str):
+        if not AMOUNT_PATTERN.match(amount):
+            raise BankError(error)
+        return parse_money(amount)
+    if isinstance(amount, int) and not isinstance(amount, bool):
+        return amount
+    raise BankError(error)
+
+
+class StatementPage(list):
+    """A page of transactions, oldest first, with the cursor of the page before it"""
+
+    def __init__(self, transactions=(), next_cursor=None):
+        super().__init__(transactions)
+        self.next_cursor = next_cursor  # None on the oldest page
+
+
+# Custom banking module
+class BankingModule:
+    @staticmethod
+    def create_account(acc_num, name, email, phone, balance, pin, created_at=None):
+        """Create a new bank account with a balance in cents"""
+        return {
+            'acc_num': acc_num,
+            'name': name,
+            'email': email,
+            'phone': phone,
+            'balance': balance,
+            'pin': pin,
+            'created_at': created_at or datetime.now().strftime('%Y-%m-%d'),
+            'account_type': 'Savings',
+            'status': 'Active'
+        }
+
+    @staticmethod
+    def validate_transaction(amount, balance, transaction_type='withdrawal'):
+        """Validate if a transaction of amount cents can be processed"""
+        if transaction_type.lower() == 'withdrawal':
+            return 0 < amount <= balance
+        return amount > 0
+
+    @staticmethod
+    def calculate_interest(principal, rate, time):
+        """Calculate simple interest in cents, rounded half to even"""
+        return apply_rate(principal, rate, time, '0.01')
+
+    @staticmethod
+    def generate_account_statement(transactions, num_transactions=5):
+        """Generate account statement using list slicing"""
+        recent_transactions = transactions[-num_transactions:] if transactions else []
+        return recent_transactions
+
+    @staticmethod
+    @timed('analyze_transactions')
+    def analyze_transactions(transactions):
+        """Analyze transactions using functional programming concepts"""
+        if not transactions:
+            return {}
+
+        # Using map and lambda to extract amounts
+        amounts = list(map(lambda t: t[2], transactions))
+
+        # Using filter to get deposits and withdrawals
+        deposits = list(filter(lambda t: t[1] == 'Deposit', transactions))
+        withdrawals = list(filter(lambda t: t[1] == 'Withdrawal', transactions))
+        transfers = list(filter(lambda t: t[1] == 'Transfer', transactions))
+
+        # Using reduce to calculate totals
+        total_deposits = reduce(lambda x, y: x + y, [t[2] for t in deposits], 0)
+        total_withdrawals = reduce(lambda x, y: x + y, [abs(t[2]) for t in withdrawals], 0)
+
+        # Using set to get unique transaction types
+        transaction_types = set(t[1] for t in transactions)
+
+        # Using dictionary comprehension
+        type_stats = {t_type: len([t for t in transactions if t[1] == t_type])
+                     for t_type in transaction_types}
+
+        return {
+            'total_transactions': len(transactions),
+            'transaction_types': transaction_types,
+            'type_stats': type_stats,
+            'total_deposits': total_deposits,
+            'total_withdrawals': total_withdrawals,
+            'net_flow': total_deposits - total_withdrawals
+        }
+
+# Create an instance of the banking module
+banking_module = BankingModule()
+
+
+class Bank:
+    """Headless banking engine owning accounts and transaction histories"""
+
+    def __init__(self, ledger=None):
+        self.accounts = {}  # Dictionary to store account information
+        self.transactions = {}  # Dictionary of columnar transaction histories
+        self.descriptions = StringTable()  # Descriptions shared by all histories
+        self.stats = {}  # Running analytics aggregates per account
+        self.listeners = []  # Callbacks notified of postings and new accounts
+        self.ledger = ledger  # Optional durable journal (see ledger.py)
+        self.locks = {}  # Per-account posting locks
+        self.description_index = None  # Token search index, built on first search
+        self.search_indexes = {}  # Per-account description search indexes
+        self.counterparty_indexes = {}  # Per-account counterparty graph edges
+        self.next_transfer_id = 1  # Id given to the next transfer's two legs
+        self.job_progress = {}  # Resumable batch job id -> how far it has got
+        self.holds = {}  # Cents held per account for pending transfers (see hold)
+        self.held = {}  # Pending transfer id -> (account, cents) it holds
+        self.transfer_lock = threading.Lock()  # Guards next_transfer_id
+        self.allocator = AccountNumberAllocator(on_reserve=self._reserve_numbers)
+        self.registry_lock = threading.Lock()  # Guards account creation and snapshots
+        self.pin_iterations = PIN_ITERATIONS  # KDF cost of newly stored PINs
+        self.pin_verifier = PinVerifier()  # Login pool and recent-success cache
+        self.strengthen_lock = threading.Lock()  # Guards the two counters below
+        self.strengthen_jobs = 0  # Background PIN strengthening jobs not yet finished
+        self.strengthened_pins = 0  # PINs strengthened since the last of them finished
+
+    @classmethod
+    def open(cls, directory, **ledger_options):
+        """Open a persistent bank stored in directory, recovering its state"""
+        bank = cls(Ledger(directory, **ledger_options))
+        bank.ledger.recover(bank)
+        # Resume strengthening weak PIN hashes a previous run left on disk
+        bank.strengthen_pins(list(bank.accounts))
+        return bank
+
+    def subscribe(self, callback):
+        """Call callback(event, acc_num, data) after every change to the bank
+
+        Events are 'account' (data is the account dict), 'post' (data is
+        the new transaction tuple) and 'batch' (sent once per account touched
+        by post_batch or post_credits; data is the number of postings applied).
+        """
+        self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stop notifying a subscribed callback"""
+        self.listeners.remove(callback)
+
+    def _notify(self, event, acc_num, data):
+        """Call the listeners; postings from worker threads notify from those threads"""
+        for callback in self.listeners:
+            callback(event, acc_num, data)
+
+    def _record(self, *record):
+        """Append a record to the journal when the bank is persistent"""
+        if self.ledger is not None:
+            self.ledger.append(record)
+
+    def apply_record(self, record):
+        """Apply a journal record during recovery"""
+        kind = record[0]
+        if kind == 'post':
+            acc_num, transaction = record[1], tuple(record[2])
+            counterparty, transfer_id = record[3:5] if len(record) > 3 else (None, 0)
+            self._append(acc_num, transaction, counterparty, transfer_id)
+            self.accounts[acc_num]['balance'] = transaction[4]
+            self.next_transfer_id = max(self.next_transfer_id, transfer_id + 1)
+            if transfer_id in self.held:
+                # The debit leg settling a held transfer
+                self._drop_hold(transfer_id)
+        elif kind == 'transfer':
+            sender, recipient, debit, credit, transfer_id = record[1:6]
+            for acc_num, transaction, counterparty in ((sender, debit, recipient),
+                                                       (recipient, credit, sender)):
+                transaction = tuple(transaction)
+                self._append(acc_num, transaction, counterparty, transfer_id)
+                self.accounts[acc_num]['balance'] = transaction[4]
+            self.next_transfer_id = max(self.next_transfer_id, transfer_id + 1)
+        elif kind == 'batch':
+            transfers = record[2]
+            if len(record) > 3:
+                first_id = record[3]
+                self.next_transfer_id = max(self.next_transfer_id, first_id + len(transfers))
+            else:
+                first_id = self._reserve_transfer_ids(len(transfers))
+            self._apply_batch(record[1], transfers, first_id=first_id)
+        elif kind == 'credits':
+            self._apply_credits(*record[1:5])
+            if record[5] is not None:
+                job_id, position = record[5]
+                self.job_progress[job_id] = position
+        elif kind == 'hold':
+            self._add_hold(*record[1:4])
+            self.next_transfer_id = max(self.next_transfer_id, record[1] + 1)
+        elif kind == 'release':
+            self._drop_hold(record[1])
+        elif kind == 'allocator':
+            self.restore_allocator(record[1], record[2])
+        elif kind == 'pin':
+            self.accounts[record[1]]['pin'] = record[2]
+        elif kind == 'account':
+            account = record[1]
+            self.accounts[account['acc_num']] = account
+            self._add_history(account['acc_num'], (tuple(t) for t in record[2]))
+        elif kind == 'accounts':
+            self._apply_onboarding(record[1], record[2])
+        else:
+            raise ValueError(f"Unknown journal record: {kind!r}")
+
+    def _reserve_numbers(self, next_counter):
+        """Journal a new account number high-water mark before it is used"""
+        self._record('allocator', self.allocator.key, next_counter)
+
+    def restore_allocator(self, key, next_counter):
+        """Resume account number allocation from a persisted key and counter"""
+        self.allocator = AccountNumberAllocator(key, next_counter, self.allocator.block_size,
+                                                self._reserve_numbers)
+
+    def _add_history(self, acc_num, rows=()):
+        """Create an account's columnar history and its analytics aggregates"""
+        history = TransactionStore(self.descriptions, rows)
+        self.locks[acc_num] = threading.Lock()
+        self.transactions[acc_num] = history
+        self.stats[acc_num] = AccountStats(history)
+
+    def _append(self, acc_num, transaction, counterparty=None, transfer_id=0):
+        """Append a posting to an account's history and aggregates"""
+        self.transactions[acc_num].append(transaction, counterparty, transfer_id)
+        self.stats[acc_num].add(transaction)
+
+    def _reserve_transfer_ids(self, count=1, first_id=None):
+        """Reserve count consecutive transfer ids and return the first
+
+        A caller that allocates ids itself (see shards.py) passes first_id;
+        the bank's counter then only moves past the ids it was given.
+        """
+        with self.transfer_lock:
+            if first_id is None:
+                first_id = self.next_transfer_id
+            self.next_transfer_id = max(self.next_transfer_id, first_id + count)
+        return first_id
+
+    @timed('bank.checkpoint')
+    def checkpoint(self):
+        """Snapshot the bank so recovery only replays later postings"""
+        if self.ledger is None:
+            return
+        # Quiesce every account, in lock order, so the snapshot is consistent
+        with self.registry_lock, self._locked(self.locks):
+            self.ledger.snapshot(self)
+
+    def _after_post(self, *postings):
+        """Snapshot if due and notify listeners once posting locks are released"""
+        if self.ledger is not None and self.ledger.needs_snapshot():
+            self.checkpoint()
+        if self.listeners:
+            for acc_num, transaction in postings:
+                self._notify('post', acc_num, transaction)
+
+    @contextmanager
+    def _locked(self, acc_nums):
+        """Hold the locks of several accounts, taken in account-number order"""
+        # Acquired directly rather than through an ExitStack, which costs
+        # several times more per lock in batches over many accounts
+        locks = [self.locks[acc_num] for acc_num in sorted(acc_nums)]
+        acquired = 0
+        try:
+            for lock in locks:
+                lock.acquire()
+                acquired += 1
+            yield
+        finally:
+            for lock in reversed(locks[:acquired]):
+                lock.release()
+
+    def load(self, accounts, transactions=()):
+        """Bulk-load accounts and their histories from iterables
+
+        accounts yields account dicts and transactions yields
+        (acc_num, transaction) pairs, or (acc_num, transaction, counterparty,
+        transfer_id) for transfer legs, each account's rows in posting order.
+        Both are consumed one item at a time, so they can stream from files
+        of any size. A persistent bank is checkpointed once at the end
+        instead of journaling every row. Returns the number of accounts and
+        transactions loaded.
+        """
+        loaded = []
+        transaction_count = 0
+        with self.registry_lock:
+            for account in accounts:
+                acc_num = account['acc_num']
+                if acc_num in self.accounts:
+                    raise BankError(f"Account {acc_num} already exists")
+                self.accounts[acc_num] = account
+                self._add_history(acc_num)
+                loaded.append(acc_num)
+
+            last_transfer_id = 0
+            for acc_num, transaction, *transfer in transactions:
+                if acc_num not in self.transactions:
+                    raise BankError(f"Transaction for unknown account {acc_num}")
+                self._append(acc_num, transaction, *transfer)
+                if transfer and transfer[1] > last_transfer_id:
+                    last_transfer_id = transfer[1]
+                transaction_count += 1
+            self.next_transfer_id = max(self.next_transfer_id, last_transfer_id + 1)
+        self.checkpoint()
+        self.strengthen_pins(loaded)
+        return len(loaded), transaction_count
+
+    def load_histories(self, entries):
+        """Bulk-load accounts with prebuilt histories and analytics aggregates
+
+        entries yields (account, history, stats) triples whose histories
+        share self.descriptions, as built by workload.py. Like load, a
+        persistent bank is checkpointed once at the end. Returns the number
+        of accounts loaded.
+        """
+        loaded = []
+        last_transfer_id = 0
+        with self.registry_lock:
+            for account, history, stats in entries:
+                acc_num = account['acc_num']
+                if acc_num in self.accounts:
+                    raise BankError(f"Account {acc_num} already exists")
+                if history.strings is not self.descriptions:
+                    raise ValueError("Histories must use the bank's description table")
+                self.accounts[acc_num] = account
+                self.transactions[acc_num] = history
+                self.stats[acc_num] = stats
+                self.locks[acc_num] = threading.Lock()
+                if history.links:
+                    last_transfer_id = max(last_transfer_id, max(history.links))
+                loaded.append(acc_num)
+            self.next_transfer_id = max(self.next_transfer_id, last_transfer_id + 1)
+        self.checkpoint()
+        self.strengthen_pins(loaded)
+        return len(loaded)
+
+    def strengthen_pins(self, acc_nums):
+        """Raise weak PIN hashes of a persistent bank to the current cost
+
+        Hashes below pin_iterations (bulk onboarding's cheap ones, or plain
+        text from old imports) get a further KDF pass over their digest on
+        the PIN verifier's background thread, PIN_STRENGTHEN_CHUNK accounts
+        per job, each journaled as a 'pin' record. Once the last queued job
+        has finished, the bank is checkpointed so the weak hashes leave the
+        journal and snapshot. Jobs cancelled by close are queued again by
+        the next open. An in-memory bank keeps nothing on disk and skips
+        this. Returns the Future of the last job, or None.
+        """
+        if self.ledger is None or not acc_nums:
+            return None
+        chunks = [acc_nums[i:i + PIN_STRENGTHEN_CHUNK]
+                  for i in range(0, len(acc_nums), PIN_STRENGTHEN_CHUNK)]
+        with self.strengthen_lock:
+            self.strengthen_jobs += len(chunks)
+        for chunk in chunks:
+            future = self.pin_verifier.background(self._strengthen_chunk, chunk)
+            future.add_done_callback(self._strengthen_cancelled)
+        return future
+
+    def _strengthen_chunk(self, acc_nums):
+        iterations = self.pin_iterations
+        strengthened = 0
+        try:
+            for acc_num in acc_nums:
+                account = self.accounts.get(acc_num)
+                if account is None or not needs_rehash(account['pin'], iterations):
+                    continue
+                stored = account['pin']
+                pin_hash = strengthen_pin_hash(stored, iterations)
+                with self.locks[acc_num]:
+                    # A login may have re-hashed the PIN in the meantime
+                    if account['pin'] == stored:
+                        account['pin'] = pin_hash
+                        self._record('pin', acc_num, pin_hash)
+                        strengthened += 1
+        finally:
+            with self.strengthen_lock:
+                self.strengthen_jobs -= 1
+                self.strengthened_pins += strengthened
+                done = self.strengthen_jobs == 0 and self.strengthened_pins
+                if done:
+                    self.strengthened_pins = 0
+        if done:
+            self.checkpoint()
+
+    def _strengthen_cancelled(self, future):
+        if future.cancelled():
+            with self.strengthen_lock:
+                self.strengthen_jobs -= 1
+
+    def close(self):
+        """Flush outstanding journal records"""
+        self.pin_verifier.close()
+        if self.ledger is not None:
+            self.ledger.close()
+
+    def load_sample_data(self):
+        """Load the demo accounts and transactions"""
+        # Sample accounts
+        sample_accounts = {
+            '1234567890': banking_module.create_account('1234567890', 'John Doe',
+                                                       'john@email.com', '1234567890',
+                                                       500000,
+                                                       hash_pin('1234', self.pin_iterations)),
+            '0987654321': banking_module.create_account('0987654321', 'Jane Smith',
+                                                       'jane@email.com', '0987654321',
+                                                       300000,
+                                                       hash_pin('5678', self.pin_iterations))
+        }
+
+        # Sample transactions using tuples
+        sample_transactions = {
+            '1234567890': [
+                ('2023-01-15', 'Deposit', 100000, 'Initial Deposit', 100000),
+                ('2023-02-01', 'Withdrawal', 20000, 'ATM Withdrawal', 80000),
+                ('2023-02-15', 'Deposit', 50000, 'Salary', 130000),
+                ('2023-03-01', 'Transfer', 30000, 'To Jane Smith', 100000),
+            ],
+            '0987654321': [
+                ('2023-01-20', 'Deposit', 50000, 'Initial Deposit', 50000),
+                ('2023-02-05', 'Deposit', 100000, 'Salary', 150000),
+                ('2023-02-20', 'Withdrawal', 10000, 'Shopping', 140000),
+                ('2023-03-01', 'Transfer', 30000, 'From John Doe', 170000),
+            ]
+        }
+
+        self.accounts.update(sample_accounts)
+        for acc_num, rows in sample_transactions.items():
+            self._add_history(acc_num, rows)
+        for acc_num, account in sample_accounts.items():
+            self._record('account', account, sample_transactions[acc_num])
+
+    def generate_account_number(self):
+        """Issue a unique 10-digit account number in O(1) (see allocator.py)"""
+        acc_num = self.allocator.allocate()
+        while acc_num in self.accounts:
+            # Only numbers drawn at random before the allocator can collide
+            acc_num = self.allocator.allocate()
+        return acc_num
+
+    def reserve_account_numbers(self, count):
+        """Issue a block of count unique account numbers for bulk registration"""
+        numbers = [n for n in self.allocator.reserve(count) if n not in self.accounts]
+        while len(numbers) < count:
+            numbers += [n for n in self.allocator.reserve(count - len(numbers))
+                        if n not in self.accounts]
+        return numbers
+
+    def _parse_amount(self, amount, error="Please enter a valid amount"):
+        """Convert a dollar string from a form, or integer cents, into cents"""
+        return parse_amount(amount, error)
+
+    def _get_account(self, acc_num, error="Account not found"):
+        """Look up an account or raise BankError"""
+        account = self.accounts.get(acc_num)
+        if account is None:
+            raise BankError(error)
+        return account
+
+    def validate_registration(self, name, email, phone, deposit, pin):
+        """Check registration details and return the opening deposit in cents"""
+        # Validation using regular expressions
+        if not NAME_PATTERN.match(name):
+            raise BankError("Please enter a valid name")
+
+        if not EMAIL_PATTERN.match(email):
+            raise BankError("Please enter a valid email")
+
+        if not PHONE_PATTERN.match(phone):
+            raise BankError("Phone must be 10 digits")
+
+        deposit = self._parse_amount(deposit, "Deposit must be at least $10")
+        if deposit < MIN_DEPOSIT:
+            raise BankError("Deposit must be at least $10")
+
+        if not PIN_PATTERN.match(pin):
+            raise BankError("PIN must be 4 digits")
+        return deposit
+
+    @timed('bank.open_account')
+    def open_account(self, name, email, phone, deposit, pin):
+        """Validate registration details and open a new account"""
+        deposit = self.validate_registration(name, email, phone, deposit, pin)
+        pin_hash = hash_pin(pin, self.pin_iterations)
+
+        with self.registry_lock:
+            # Generate account number
+            acc_num = self.generate_account_number()
+
+            # Create account using custom module
+            account = banking_module.create_account(acc_num, name, email, phone, 0, pin_hash)
+            self._add_history(acc_num)
+            self.accounts[acc_num] = account
+            self._record('account', account, [])
+
+        # Add initial deposit transaction, which sets the opening balance
+        self.post(acc_num, 'Deposit', deposit, 'Initial Deposit')
+        if self.listeners:
+            self._notify('account', acc_num, self.accounts[acc_num])
+        return acc_num
+
+    def open_account_async(self, name, email, phone, deposit, pin):
+        """Open an account on the PIN pool, which runs the KDF; returns a Future"""
+        return self.pin_verifier.submit(self.open_account, name, email, phone, deposit, pin)
+
+    @timed('bank.open_accounts')
+    def open_accounts(self, applicants):
+        """Validate and open many accounts at once
+
+        applicants yields (name, email, phone, deposit, pin) records checked
+        by the same rules as the registration form. Valid applicants get a
+        block of account numbers and their 'Initial Deposit' in one pass,
+        journaled as a single record. PINs are stored with a cheap salted
+        hash (BULK_PIN_ITERATIONS), since a full-cost KDF would bound the
+        pipeline to a few dozen applicants per second; a persistent bank then
+        strengthens them to full cost in the background (see strengthen_pins).
+        Returns {'opened': [acc_num, ...], 'rejected': [(index, reason), ...]},
+        where index is the applicant's position in applicants.
+        """
+        name_ok, email_ok, phone_ok = NAME_PATTERN.match, EMAIL_PATTERN.match, PHONE_PATTERN.match
+        amount_ok, pin_ok = AMOUNT_PATTERN.match, PIN_PATTERN.match
+        accepted = []
+        rejected = []
+        for index, applicant in enumerate(applicants):
+            try:
+                name, email, phone, deposit, pin = applicant
+                # Fast path: well-formed text fields, checked by the shared
+                # patterns without the per-field calls of the form
+                if (name_ok(name) and email_ok(email) and phone_ok(phone)
+                        and amount_ok(deposit) and pin_ok(pin)):
+                    cents = parse_money(deposit)
+                    if cents >= MIN_DEPOSIT:
+                        accepted.append((name, email, phone, cents, pin))
+                        continue
+            except (TypeError, ValueError):
+                pass
+            # Anything else takes the form's path, which names the first
+            # rule the record breaks
+            try:
+                name, email, phone, deposit, pin = applicant
+                deposit = self.validate_registration(name, email, phone, deposit, pin)
+            except BankError as e:
+                rejected.append((index, str(e)))
+            except (TypeError, ValueError):
+                rejected.append((index, "Incomplete applicant record"))
+            else:
+                accepted.append((name, email, phone, deposit, pin))
+
+        opened = []
+        if accepted:
+            date_str = datetime.now().strftime('%Y-%m-%d')
+            create = banking_module.create_account
+            salts = os.urandom(SALT_BYTES * len(accepted))
+            pin_hashes = [hash_pin(pin, BULK_PIN_ITERATIONS, salts[i:i + SALT_BYTES])
+                          for i, (*_, pin) in zip(range(0, len(salts), SALT_BYTES), accepted)]
+            with gc_paused(), self.registry_lock:
+                opened = self.reserve_account_numbers(len(accepted))
+                accounts = [create(acc_num, name, email, phone, deposit, pin_hash, date_str)
+                            for acc_num, (name, email, phone, deposit, _), pin_hash
+                            in zip(opened, accepted, pin_hashes)]
+                self._apply_onboarding(date_str, accounts)
+                self._record('accounts', date_str, accounts)
+            if self.ledger is not None and self.ledger.needs_snapshot():
+                self.checkpoint()
+            self.strengthen_pins(opened)
+            if self.listeners:
+                for account in accounts:
+                    self._notify('account', account['acc_num'], account)
+        return {'opened': opened, 'rejected': rejected}
+
+    def _apply_onboarding(self, date_str, accounts):
+        """Register new accounts whose balance is their initial deposit"""
+        # Every history starts with the same date, type and description, so
+        # each is built from columns instead of parsing a transaction tuple
+        day, code = date_to_days(date_str), type_code('Deposit')
+        desc_id = self.descriptions.intern('Initial Deposit')
+        for account in accounts:
+            acc_num = account['acc_num']
+            deposit = account['balance']
+            history = TransactionStore(self.descriptions)
+            history.append_row(day, code, deposit, deposit, desc_id)
+            stats = AccountStats()
+            stats.add((date_str, 'Deposit', deposit))
+            self.accounts[acc_num] = account
+            self.transactions[acc_num] = history
+            self.stats[acc_num] = stats
+            self.locks[acc_num] = threading.Lock()
+
+    @timed('bank.authenticate')
+    def authenticate(self, acc_num, pin):
+        """Check login credentials and return the account number"""
+        if not ACCOUNT_PATTERN.match(acc_num):
+            raise BankError("Account number must be 10 digits")
+
+        if not PIN_PATTERN.match(pin):
+            raise BankError("PIN must be 4 digits")
+
+        # Check if account exists and PIN is correct
+        stored = self._get_account(acc_num)['pin']
+        if not self.pin_verifier.verify(pin, stored):
+            raise BankError("Invalid PIN")
+        if needs_rehash(stored, self.pin_iterations):
+            self._set_pin(acc_num, hash_pin(pin, self.pin_iterations))
+        return acc_num
+
+    def authenticate_async(self, acc_num, pin):
+        """Authenticate on the PIN verification pool
+
+        Returns a Future of the account number; its result() raises
+        BankError for rejected credentials. GUIs poll it instead of running
+        the KDF on their event thread.
+        """
+        return self.pin_verifier.submit(self.authenticate, acc_num, pin)
+
+    def _set_pin(self, acc_num, pin_hash):
+        """Replace an account's stored PIN hash"""
+        with self.locks[acc_num]:
+            self.accounts[acc_num]['pin'] = pin_hash
+            self._record('pin', acc_num, pin_hash)
+
+    @timed('bank.post')
+    def post(self, acc_num, t_type, amount, description, counterparty=None, transfer_id=0):
+        """Record a signed posting against an account and return its tuple
+
+        A single transfer leg also passes its counterparty and transfer id.
+        """
+        account = self._get_account(acc_num)
+        if transfer_id:
+            self._reserve_transfer_ids(1, transfer_id)
+        with self.locks[acc_num]:
+            transaction = self._post(acc_num, account, t_type, amount, description,
+                                     counterparty, transfer_id)
+        self._after_post((acc_num, transaction))
+        return transaction
+
+    def _post(self, acc_num, account, t_type, amount, description,
+              counterparty=None, transfer_id=0, journal=True):
+        """Apply a posting; the caller holds the account's lock
+
+        journal=False leaves the journal record to the caller, which writes
+        one record for several postings that must recover together.
+        """
+        account['balance'] += amount
+
+        # Create transaction tuple
+        transaction = (
+            datetime.now().strftime('%Y-%m-%d'),
+            t_type,
+            amount,
+            description,
+            account['balance']
+        )
+        self._append(acc_num, transaction, counterparty, transfer_id)
+        if journal:
+            if counterparty is None:
+                self._record('post', acc_num, transaction)
+            else:
+                self._record('post', acc_num, transaction, counterparty, transfer_id)
+        return transaction
+
+    def deposit(self, acc_num, amount, description='Deposit'):
+        """Deposit funds into an account"""
+        amount = self._parse_amount(amount)
+        if not banking_module.validate_transaction(amount, 0, 'deposit'):
+            raise BankError("Amount must be positive")
+        return self.post(acc_num, 'Deposit', amount, description)
+
+    @timed('bank.withdraw')
+    def withdraw(self, acc_num, amount, description='Withdrawal'):
+        """Withdraw funds from an account"""
+        amount = self._parse_amount(amount)
+        if amount <= 0:
+            raise BankError("Amount must be positive")
+
+        account = self._get_account(acc_num)
+        with self.locks[acc_num]:
+            if not banking_module.validate_transaction(amount, self._available(acc_num)):
+                raise BankError("Insufficient funds")
+            transaction = self._post(acc_num, account, 'Withdrawal', -amount, description)
+        self._after_post((acc_num, transaction))
+        return transaction
+
+    def _available(self, acc_num):
+        """Return the balance not held for pending transfers; the caller holds the lock"""
+        return self.accounts[acc_num]['balance'] - self.holds.get(acc_num, 0)
+
+    def hold(self, acc_num, amount, transfer_id):
+        """Set amount cents of an account's balance aside for a pending transfer
+
+        Held funds cannot be withdrawn or transferred until the hold is
+        released or settled. Holds are journaled under their transfer id,
+        so a restarted bank still has them and can settle or release them
+        (see shards.py).
+        """
+        self._get_account(acc_num)
+        self._reserve_transfer_ids(1, transfer_id)
+        with self.locks[acc_num]:
+            if transfer_id in self.held:
+                raise BankError("Transfer already prepared")
+            if not banking_module.validate_transaction(amount, self._available(acc_num)):
+                raise BankError("Insufficient funds")
+            self._add_hold(transfer_id, acc_num, amount)
+            self._record('hold', transfer_id, acc_num, amount)
+
+    def _add_hold(self, transfer_id, acc_num, amount):
+        self.held[transfer_id] = (acc_num, amount)
+        self.holds[acc_num] = self.holds.get(acc_num, 0) + amount
+
+    def _drop_hold(self, transfer_id):
+        """Remove a transfer's hold and return its (account, cents), or None"""
+        held = self.held.pop(transfer_id, None)
+        if held is not None:
+            acc_num, amount = held
+            remaining = self.holds.get(acc_num, 0) - amount
+            if remaining > 0:
+                self.holds[acc_num] = remaining
+            else:
+                self.holds.pop(acc_num, None)
+        return held
+
+    def release(self, transfer_id):
+        """Return a transfer's held funds to the available balance
+
+        Returns False if the transfer holds nothing, so releasing twice
+        does nothing.
+        """
+        held = self.held.get(transfer_id)
+        if held is None:
+            return False
+        with self.locks[held[0]]:
+            if self._drop_hold(transfer_id) is None:
+                return False
+            self._record('release', transfer_id)
+        return True
+
+    def settle(self, transfer_id, recipient, description=''):
+        """Post the debit leg of a held transfer and return its tuple
+
+        The held amount is debited from its account as a transfer to
+        recipient. Returns None if the transfer holds nothing, e.g. it was
+        already settled or released.
+        """
+        held = self.held.get(transfer_id)
+        if held is None:
+            return None
+        sender, amount = held
+        account = self.accounts[sender]
+        with self.locks[sender]:
+            if self._drop_hold(transfer_id) is None:
+                return None
+            transaction = self._post(sender, account, 'Transfer', -amount,
+                                     f"To {recipient}: {description}", recipient, transfer_id)
+        self._after_post((sender, transaction))
+        return transaction
+
+    def sync(self):
+        """Make every journaled change durable now rather than at the next group commit"""
+        if self.ledger is not None:
+            self.ledger.commit()
+
+    @timed('bank.transfer')
+    def transfer(self, sender, recipient, amount, description='', transfer_id=None):
+        """Transfer funds between two accounts
+
+        The legs are linked by transfer_id if given, else by a new id.
+        """
+        if not ACCOUNT_PATTERN.match(recipient):
+            raise BankError("Recipient account must be 10 digits")
+
+        if recipient not in self.accounts:
+            raise BankError("Recipient account not found")
+
+        if recipient == sender:
+            raise BankError("Cannot transfer to your own account")
+
+        amount = self._parse_amount(amount)
+        if amount <= 0:
+            raise BankError("Amount must be positive")
+
+        sender_account = self._get_account(sender)
+        recipient_account = self.accounts[recipient]
+
+        # Lock both accounts in account-number order, then check and post
+        # both legs atomically
+        first, second = sorted((sender, recipient))
+        with self.locks[first], self.locks[second]:
+            # Use custom module for validation
+            if not banking_module.validate_transaction(amount, self._available(sender)):
+                raise BankError("Insufficient funds")
+
+            # Record both legs of the transfer, linked by one transfer id
+            transfer_id = self._reserve_transfer_ids(1, transfer_id)
+            debit = self._post(sender, sender_account, 'Transfer', -amount,
+                               f"To {recipient}: {description}", recipient, transfer_id,
+                               journal=False)
+            credit = self._post(recipient, recipient_account, 'Transfer', amount,
+                                f"From {sender}: {description}", sender, transfer_id,
+                                journal=False)
+            # One record, so a group commit or a torn write never keeps one leg alone
+            self._record('transfer', sender, recipient, debit, credit, transfer_id)
+        self._after_post((sender, debit), (recipient, credit))
+        return amount
+
+    @timed('bank.post_batch')
+    def post_batch(self, records, atomic=True, first_transfer_id=None):
+        """Apply many transfers at once
+
+        records is an iterable of (sender, recipient, amount, description).
+        Records are validated in one pass, then funds are checked per account
+        while holding the locks of every account involved:
+
+        - atomic=True: each account's net position (balance plus all credits
+          minus all debits in the batch) must stay non-negative, and any
+          rejected record rejects the whole batch.
+        - atomic=False: records are checked in order against running
+          positions; failing records are rejected and the rest applied.
+
+        Every posting in the batch shares one timestamp, and the applied
+        transfers get consecutive ids from first_transfer_id if given.
+        Returns a dict with 'applied' (number of transfers) and 'rejected',
+        a list of (index, reason) pairs. With atomic=False it also has
+        'balances', the sender's balance after each applied transfer, in
+        record order.
+        """
+        accounts = self.accounts
+        rejected = []
+        valid = []
+        deltas = {}  # Net change per account over the valid records
+
+        # Single validation pass without locks
+        for index, record in enumerate(records):
+            sender, recipient, amount, description = record
+            if sender not in accounts:
+                rejected.append((index, "Account not found"))
+                continue
+            if recipient not in accounts:
+                rejected.append((index, "Recipient account not found"))
+                continue
+            if sender == recipient:
+                rejected.append((index, "Cannot transfer to your own account"))
+                continue
+            if type(amount) is not int:
+                try:
+                    amount = self._parse_amount(amount)
+                except BankError as e:
+                    rejected.append((index, str(e)))
+                    continue
+                record = (sender, recipient, amount, description)
+            if amount <= 0:
+                rejected.append((index, "Amount must be positive"))
+                continue
+            deltas[sender] = deltas.get(sender, 0) - amount
+            deltas[recipient] = deltas.get(recipient, 0) + amount
+            if not atomic:
+                record = (index,) + record
+            valid.append(record)
+
+        if atomic and rejected:
+            return {'applied': 0, 'rejected': rejected}
+
+        with self._locked(deltas):
+            if atomic:
+                overdrawn = {acc_num for acc_num, delta in deltas.items()
+                             if self._available(acc_num) + delta < 0}
+                if overdrawn:
+                    rejected = [(index, "Insufficient funds") for index, record in enumerate(valid)
+                                if record[0] in overdrawn]
+                    return {'applied': 0, 'rejected': rejected}
+                accepted = valid
+            else:
+                accepted = []
+                balances = []  # Sender's available balance after each accepted record
+                positions = {acc_num: self._available(acc_num) for acc_num in deltas}
+                for index, sender, recipient, amount, description in valid:
+                    if positions[sender] < amount:
+                        rejected.append((index, "Insufficient funds"))
+                        continue
+                    positions[sender] -= amount
+                    positions[recipient] += amount
+                    accepted.append((sender, recipient, amount, description))
+                    balances.append(positions[sender])
+                rejected.sort()
+                if self.holds:
+                    holds = self.holds
+                    balances = [balance + holds.get(record[0], 0)
+                                for balance, record in zip(balances, accepted)]
+
+            date_str = datetime.now().strftime('%Y-%m-%d')
+            first_id = self._reserve_transfer_ids(len(accepted), first_transfer_id)
+            self._apply_batch(date_str, accepted, deltas, first_id)
+            self._record('batch', date_str, accepted, first_id)
+
+        if self.ledger is not None and self.ledger.needs_snapshot():
+            self.checkpoint()
+        if self.listeners and accepted:
+            for acc_num in deltas:
+                self._notify('batch', acc_num, len(accepted))
+        if atomic:
+            return {'applied': len(accepted), 'rejected': rejected}
+        return {'applied': len(accepted), 'rejected': rejected, 'balances': balances}
+
+    def _apply_batch(self, date_str, transfers, acc_nums=None, first_id=0):
+        """Post validated transfers column-wise; the caller holds the locks
+
+        Transfers get consecutive ids starting at first_id.
+        """
+        accounts = self.accounts
+        intern = self.descriptions.intern
+        if acc_nums is None:
+            acc_nums = {t[0] for t in transfers} | {t[1] for t in transfers}
+
+        # Per account a flat [amount, description id, transfer id, ...] list;
+        # running balances are accumulated afterwards
+        columns = {acc_num: [] for acc_num in acc_nums}
+        desc_ids = {}  # Description -> ({recipient: id}, {sender: id})
+        parties = {}  # Description id -> counterparty, which the description names
+        last_description = ids = None
+
+        for transfer_id, (sender, recipient, amount, description) in enumerate(transfers, first_id):
+            if description is not last_description:
+                ids = desc_ids.get(description)
+                if ids is None:
+                    ids = desc_ids[description] = ({}, {})
+                last_description = description
+
+            desc_id = ids[0].get(recipient)
+            if desc_id is None:
+                desc_id = ids[0][recipient] = intern(f"To {recipient}: {description}")
+                parties[desc_id] = int(recipient)
+            columns[sender] += (-amount, desc_id, transfer_id)
+
+            desc_id = ids[1].get(sender)
+            if desc_id is None:
+                desc_id = ids[1][sender] = intern(f"From {sender}: {description}")
+                parties[desc_id] = int(sender)
+            columns[recipient] += (amount, desc_id, transfer_id)
+
+        day, code = date_to_days(date_str), type_code('Transfer')
+        for acc_num, flat in columns.items():
+            if not flat:
+                continue
+            account = accounts[acc_num]
+            amounts, descs = flat[0::3], flat[1::3]
+            balances = list(accumulate(amounts, initial=account['balance']))
+            del balances[0]
+            account['balance'] = balances[-1]
+            self.transactions[acc_num].extend_columns(
+                day, code, amounts, balances, descs,
+                list(map(parties.__getitem__, descs)), flat[2::3])
+            self.stats[acc_num].add_batch(date_str, 'Transfer', amounts)
+
+    @timed('bank.post_credits')
+    def post_credits(self, credits, t_type, description, date_str=None, progress=None):
+        """Post single-leg credits to many accounts at once
+
+        credits is a list of (acc_num, amount) pairs with positive cent
+        amounts, for bank-initiated postings such as interest. Like
+        post_batch, the rows are appended column-wise under the locks of
+        every account involved and journaled as one record. progress is
+        an optional (job_id, state) pair stored in job_progress in the same
+        record, so a batch job interrupted between calls resumes exactly
+        after the last credits that were posted. state is whatever
+        JSON-serializable value the job resumes from; lists come back from
+        the journal for tuples.
+        """
+        date_str = date_str or datetime.now().strftime('%Y-%m-%d')
+        for acc_num, amount in credits:
+            if acc_num not in self.accounts:
+                raise BankError(f"Account {acc_num} not found")
+            if type(amount) is not int or amount <= 0:
+                raise BankError("Amount must be positive")
+
+        with self._locked([acc_num for acc_num, _ in credits]):
+            self._apply_credits(date_str, t_type, description, credits)
+            if progress is not None:
+                job_id, position = progress
+                self.job_progress[job_id] = position
+            self._record('credits', date_str, t_type, description, credits, progress)
+
+        if self.ledger is not None and self.ledger.needs_snapshot():
+            self.checkpoint()
+        if self.listeners:
+            for acc_num, _ in credits:
+                self._notify('batch', acc_num, len(credits))
+
+    def _apply_credits(self, date_str, t_type, description, credits):
+        """Append one credit row per account; the caller holds the locks"""
+        accounts, transactions, stats = self.accounts, self.transactions, self.stats
+        day, code = date_to_days(date_str), type_code(t_type)
+        desc_id = self.descriptions.intern(description)
+        for acc_num, amount in credits:
+            account = accounts[acc_num]
+            balance = account['balance'] + amount
+            account['balance'] = balance
+            transactions[acc_num].append_row(day, code, amount, balance, desc_id)
+            stats[acc_num].add((date_str, t_type, amount))
+
+    def balance(self, acc_num):
+        """Return the current balance of an account"""
+        return self._get_account(acc_num)['balance']
+
+    def history(self, acc_num):
+        """Return the transaction history of an account, oldest first"""
+        return self.transactions.get(acc_num, [])
+
+    def _parse_day(self, date_str, error="Dates must be YYYY-MM-DD"):
+        """Convert an optional 'YYYY-MM-DD' string into days since the epoch"""
+        if date_str is None or date_str == '':
+            return None
+        try:
+            return date_to_days(date_str)
+        except (TypeError, ValueError):
+            raise BankError(error) from None
+
+    @timed('bank.history_range')
+    def history_range(self, acc_num, start=None, end=None, before=None):
+        """Return an account's transactions dated start..end, in date order
+
+        start and end are inclusive 'YYYY-MM-DD' dates and may be None. The
+        result is a read-only sequence found in O(log n) from the history's
+        date index; rows are materialized only when read.
+        """
+        history = self.transactions.get(acc_num)
+        if history is None:
+            history = TransactionStore(self.descriptions)
+        start_day, end_day = self._parse_day(start), self._parse_day(end)
+        if start_day is not None and end_day is not None and start_day > end_day:
+            raise BankError("Start date must not be after end date")
+        return history.between(start_day, end_day, before)
+
+    @timed('bank.search')
+    def search(self, acc_num, query, start=None, end=None):
+        """Return an account's transactions matching a search query, in date order
+
+        Every word of the query must prefix-match a word of the description;
+        'to:ACCOUNT', 'from:ACCOUNT' and 'party:ACCOUNT' match transfers with
+        that counterparty (see search.py). start and end limit the dates as
+        in history_range. The indexes are updated incrementally at each
+        search, so postings pay nothing for them.
+        """
+        if not query.strip():
+            return self.history_range(acc_num, start, end)
+        start_day, end_day = self._parse_day(start), self._parse_day(end)
+        history = self.transactions.get(acc_num)
+        if history is None:
+            history = TransactionStore(self.descriptions)
+
+        index = self.description_index
+        if index is None or index.strings is not self.descriptions:
+            index = self.description_index = DescriptionIndex(self.descriptions)
+        account_index = self.search_indexes.get(acc_num)
+        if account_index is None or account_index.history is not history:
+            account_index = self.search_indexes[acc_num] = AccountIndex(history)
+        rows = account_index.search(index.search(query))
+        return history.subset(rows, start_day, end_day)
+
+    def _counterparty_index(self, acc_num):
+        """Return the counterparty graph index of an account, creating it on first use"""
+        history = self.transactions.get(acc_num)
+        if history is None:
+            raise BankError("Account not found")
+        index = self.counterparty_indexes.get(acc_num)
+        if index is None or index.history is not history:
+            index = self.counterparty_indexes[acc_num] = CounterpartyIndex(history)
+        return index
+
+    def top_counterparties(self, acc_num, n=10):
+        """Return an account's n largest counterparties by transfer volume
+
+        Each entry is a dict with the counterparty 'account', number of
+        'transfers', cents 'sent' and 'received' and total 'volume'.
+        """
+        return self._counterparty_index(acc_num).top(n)
+
+    def flows(self, acc_num, counterparty, start=None, end=None):
+        """Return the legs of transfers between two accounts, in date order
+
+        The result is acc_num's side of every transfer with counterparty
+        (negative amounts were sent), dated start..end; its transfer_id(i)
+        links each leg to the counterparty's matching leg.
+        """
+        if not isinstance(counterparty, str) or not ACCOUNT_PATTERN.match(counterparty):
+            raise BankError("Account not found")
+        start_day, end_day = self._parse_day(start), self._parse_day(end)
+        edge = self._counterparty_index(acc_num).edge(counterparty)
+        rows = edge.rows if edge is not None else ()
+        return self.transactions[acc_num].subset(rows, start_day, end_day)
+
+    def top_flows(self, n=10):
+        """Return the n account pairs with the largest volume sent, largest first
+
+        Each entry is a dict with 'sender', 'recipient', number of
+        'transfers' and cents 'volume'. Costs one pass over the graph edges,
+        not the histories.
+        """
+        pairs = []
+        for acc_num in list(self.transactions):
+            index = self._counterparty_index(acc_num)
+            index.update()
+            for party, edge in index.edges.items():
+                if edge.sent:
+                    pairs.append((edge.sent, edge.sent_count, acc_num, party))
+        return [{'sender': acc_num, 'recipient': f"{party:010d}",
+                 'transfers': count, 'volume': volume}
+                for volume, count, acc_num, party in heapq.nlargest(n, pairs)]
+
+    @timed('bank.statement')
+    def statement(self, acc_num, start=None, end=None, limit=5, cursor=None):
+        """Return a page of an account's transactions in O(log n + limit)
+
+        The page holds the latest `limit` transactions dated start..end
+        (inclusive 'YYYY-MM-DD' dates, either may be None), oldest first;
+        limit=None returns all of them. With no arguments this is the last
+        five transactions, as before. When older matches remain,
+        page.next_cursor is a token that, passed back as cursor, returns
+        the page before this one.
+        """
+        before = None
+        if cursor is not None:
+            try:
+                day, _, row = cursor.partition(':')
+                before = (int(day), int(row))
+            except (AttributeError, ValueError):
+                raise BankError("Invalid statement cursor") from None
+        matches = self.history_range(acc_num, start, end, before)
+        first = 0 if limit is None else max(0, len(matches) - limit)
+        next_cursor = None
+        if first:
+            day, row = matches.key(first)
+            next_cursor = f"{day}:{row}"
+        return StatementPage(matches[first:], next_cursor)
+
+    @timed('bank.analytics')
+    def analytics(self, acc_num):
+        """Return the transaction analytics of an account in O(1)"""
+        stats = self.stats.get(acc_num)
+        return stats.summary() if stats is not None else {}
+
+    @timed('bank.report')
+    def report(self):
+        """Return bank-wide analytics with per-account and per-date rollups"""
+        return bank_report(self.transactions)
+
+    def account_stats(self, acc_num):
+        """Return the running analytics aggregates of an account"""
+        return self.stats.get(acc_num) or AccountStats()
+
+    def verify_analytics(self, acc_num=None):
+        """Recompute analytics from scratch and check the running aggregates"""
+        for acc in [acc_num] if acc_num is not None else list(self.transactions):
+            history = self.transactions[acc]
+            stats = self.stats[acc]
+            if stats != AccountStats(history):
+                raise AssertionError(f"Running aggregates of {acc} diverged from its history")
+            if stats.summary() != banking_module.analyze_transactions(history):
+                raise AssertionError(f"Analytics of {acc} differ from analyze_transactions")
@@ -0,0 +1,961 @@
+"""SmartBankr benchmarks.
+
+Run ``python bench.py <benchmark>``; see ``python bench.py --help``.
+
+``python bench.py suite`` builds fixed-seed synthetic ledgers of each size
+in --sizes and measures the main paths on each: postings per second,
+statement and analytics latency, memory per transaction row and the render
+time of the dashboard tabs in a hidden Tk window (skipped without a
+display). Any benchmark can save its results with --json and compare them
+with a saved run with --baseline: metrics ending in _per_sec are better
+higher, metrics ending in _ms, _sec, _seconds or _bytes better lower.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from fractions import Fraction
+
+import interest
+import loadtest
+import migrate
+import onboard
+import server
+import shards
+import workload
+from allocator import AccountNumberAllocator
+from archive import LedgerArchive, archive_bank
+from banking import Bank, BankError, banking_module
+from instrument import metrics
+from money import format_money
+from pins import BULK_PIN_ITERATIONS, PinVerifier
+from store import days_to_date
+
+
+def bench_money(n=1000000, seed=42, accounts=1000, repeat=3, transfers=100000):
+    """Compare float dollars with integer cents, alone and on the real posting path
+
+    Only the funds check, the balance update and the column append of a
+    posting depend on the number type. The kernel times that work on floats
+    and on cents, best of repeat. The engine figures post the same amounts
+    through Bank.post_batch and Bank.transfer, which take cents only. The
+    float share is the kernel's float advantage as a fraction of one engine
+    posting, i.e. the most that float balances could win back on that path.
+    """
+    rng = random.Random(seed)
+    # Alternating credits and debits keep balances in a realistic range
+    cents = [rng.randint(1, 50000) * (1 if i % 2 else -1) for i in range(n)]
+    dollars = [c / 100 for c in cents]
+    validate = banking_module.validate_transaction
+    results = {}
+
+    for name, amounts, start, typecode in (
+            ('float', dollars, 10000.0, 'd'),
+            ('cents', cents, 1000000, 'q')):
+        best = None
+        for _ in range(repeat):
+            balance = start
+            column = array(typecode)
+            t0 = time.perf_counter()
+            for amount in amounts:
+                if amount < 0 and not validate(-amount, balance):
+                    continue
+                balance += amount
+                column.append(balance)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {'postings_per_sec': n / best, 'final_balance': balance,
+                         'postings': len(column)}
+
+    # Drift of the float balance against the exact cents balance
+    drift = results['float']['final_balance'] * 100 - results['cents']['final_balance']
+    print(f"kernel float  {results['float']['postings_per_sec']:>12,.0f} postings/s  "
+          f"drift {drift:+.3e} cents")
+    print(f"kernel cents  {results['cents']['postings_per_sec']:>12,.0f} postings/s  "
+          f"final ${format_money(results['cents']['final_balance'])}")
+    float_gain = max(0.0, 1 / results['cents']['postings_per_sec']
+                     - 1 / results['float']['postings_per_sec'])  # Seconds per posting
+
+    # The same amounts as transfers through the engine
+    bank = Bank()
+    numbers = bank.open_accounts([('Money Bench', 'money@example.com', '5550000000',
+                                   '1000000', '0000')] * accounts)['opened']
+    records = [(rng.choice(numbers), rng.choice(numbers), abs(amount), 'Money bench')
+               for amount in cents]
+    t0 = time.perf_counter()
+    applied = sum(bank.post_batch(records[i:i + 10000], atomic=False)['applied']
+                  for i in range(0, n, 10000))
+    batch_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    sent = 0
+    for sender, recipient, amount, description in records[:transfers]:
+        try:
+            bank.transfer(sender, recipient, amount, description)
+            sent += 1
+        except BankError:
+            pass
+    transfer_time = time.perf_counter() - t0
+
+    for name, postings, elapsed in (('batch', 2 * applied, batch_time),
+                                    ('transfer', 2 * sent, transfer_time)):
+        rate = postings / elapsed
+        share = float_gain * rate
+        results[f'{name}_postings_per_sec'] = rate
+        results[f'{name}_float_share'] = share
+        print(f"{name:<8}      {rate:>12,.0f} postings/s in cents; floats could save at most "
+              f"{share:.1%}")
+    return results
+
+
+def bench_stress(n=200000, seed=42, threads=8, accounts=50):
+    """Measure random transfers hammered from many threads
+
+    Timing only: tests/test_concurrency.py checks that money is conserved
+    and no balance goes negative under the same load.
+    """
+    bank = Bank()
+    numbers = bank.open_accounts([('Stress Test', 'stress@email.com', '5550000000', '1000',
+                                   '0000')] * accounts)['opened']
+    per_thread = n // threads
+    rejected = [0] * threads
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        for _ in range(per_thread):
+            sender, recipient = rng.sample(numbers, 2)
+            try:
+                bank.transfer(sender, recipient, rng.randint(1, 20000))
+            except BankError:
+                rejected[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    t0 = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+
+    transfers = threads * per_thread - sum(rejected)
+    print(f"{threads} threads: {transfers:,} transfers ({sum(rejected):,} rejected) "
+          f"in {elapsed:.2f}s, {threads * per_thread / elapsed:,.0f} attempts/s")
+    return {'attempts_per_sec': threads * per_thread / elapsed, 'transfers': transfers}
+
+
+def bench_batch(n=500000, seed=42, accounts=10000):
+    """Measure post_batch throughput on a payroll-style batch of transfers"""
+    rng = random.Random(seed)
+    bank = Bank()
+    numbers = bank.open_accounts([('Batch Test', 'batch@email.com', '5550000000', '100000',
+                                   '0000')] * accounts)['opened']
+    records = []
+    while len(records) < n:
+        sender, recipient = rng.choice(numbers), rng.choice(numbers)
+        if sender != recipient:
+            records.append((sender, recipient, rng.randint(1, 10000), 'Payroll'))
+
+    results = {}
+    for atomic in (True, False):
+        t0 = time.perf_counter()
+        outcome = bank.post_batch(records, atomic=atomic)
+        elapsed = time.perf_counter() - t0
+        postings_per_sec = 2 * outcome['applied'] / elapsed
+        mode = 'atomic' if atomic else 'per-record'
+        results[mode] = postings_per_sec
+        print(f"{mode:<10} {outcome['applied']:,} transfers in {elapsed:.2f}s, "
+              f"{postings_per_sec:,.0f} postings/s")
+    bank.verify_analytics()
+    return results
+
+
+def bench_io(n=1000000, seed=42, accounts=1000):
+    """Measure streaming export and import throughput per file format"""
+    rng = random.Random(seed)
+    bank = Bank()
+    numbers = bank.open_accounts([('Export Test', 'export@email.com', '5550000000', '100000',
+                                   '0000')] * accounts)['opened']
+    records = []
+    while len(records) < n // 2:
+        sender, recipient = rng.sample(numbers, 2)
+        records.append((sender, recipient, rng.randint(1, 10000), 'Invoice'))
+    bank.post_batch(records, atomic=False)
+    rows = sum(len(history) for history in bank.transactions.values())
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for suffix in ('csv', 'jsonl', 'jsonl.gz'):
+            accounts_path = os.path.join(directory, 'accounts.' + suffix)
+            transactions_path = os.path.join(directory, 'transactions.' + suffix)
+            t0 = time.perf_counter()
+            migrate.export_bank(bank, accounts_path, transactions_path)
+            export_time = time.perf_counter() - t0
+
+            loaded = Bank()
+            t0 = time.perf_counter()
+            migrate.import_bank(loaded, accounts_path, transactions_path)
+            import_time = time.perf_counter() - t0
+            if loaded.transactions != bank.transactions:
+                raise AssertionError(f"{suffix} round trip changed the histories")
+
+            size = os.path.getsize(transactions_path)
+            results[suffix] = {'export_rows_per_sec': rows / export_time,
+                               'import_rows_per_sec': rows / import_time}
+            print(f"{suffix:<9} {rows:,} rows, {size / 2**20:,.0f} MiB: "
+                  f"export {rows / export_time:>10,.0f} rows/s, "
+                  f"import {rows / import_time:>10,.0f} rows/s")
+    return results
+
+
+def bench_archive(n=10000000, seed=42, accounts=100000, lookups=1000):
+    """Measure statement latency and a full report over a mapped archive"""
+    rng = random.Random(seed)
+    bank = Bank()
+    numbers = bank.open_accounts([('Archive Test', 'archive@email.com', '5550000000', '100000',
+                                   '0000')] * accounts)['opened']
+    for _ in range(max(1, n // 1000000)):
+        records = []
+        while len(records) < min(n, 1000000) // 2:
+            sender, recipient = rng.choice(numbers), rng.choice(numbers)
+            if sender != recipient:
+                records.append((sender, recipient, rng.randint(1, 10000), 'Settlement'))
+        bank.post_batch(records, atomic=False)
+    rows = sum(len(history) for history in bank.transactions.values())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ledger.arc')
+        t0 = time.perf_counter()
+        archive_bank(bank, path)
+        build_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with LedgerArchive(path) as archive:
+            first = archive.statement(numbers[0])
+            open_time = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            for acc_num in rng.sample(numbers, min(lookups, accounts)):
+                statement = archive.statement(acc_num)
+                if list(statement) != bank.statement(acc_num):
+                    raise AssertionError(f"Archived statement of {acc_num} differs")
+            statement_time = (time.perf_counter() - t0) / min(lookups, accounts)
+
+            t0 = time.perf_counter()
+            report = archive.report()
+            report_time = time.perf_counter() - t0
+            if report['total_transactions'] != rows or not len(first):
+                raise AssertionError("Archive report does not cover every row")
+        size = os.path.getsize(path)
+
+    print(f"{rows:,} rows, {size / 2**20:,.0f} MiB archive built in {build_time:.2f}s")
+    print(f"open + first statement {open_time * 1000:.2f} ms, "
+          f"statement {statement_time * 1000:.3f} ms, full report {report_time:.2f}s")
+    return {'open_ms': open_time * 1000, 'statement_ms': statement_time * 1000,
+            'report_sec': report_time}
+
+
+def bench_statement(n=1000000, seed=42, queries=1000):
+    """Compare indexed date-range statements with a linear scan"""
+    rng = random.Random(seed)
+    days = 3 * 365
+    bank = Bank()
+    account = banking_module.create_account('5550000000', 'Range Test', 'range@email.com',
+                                            '5550000000', 0, '0000')
+    balance = 0
+    rows = []
+    for i in range(n):
+        amount = rng.randint(1, 10000)
+        balance += amount
+        rows.append(('5550000000', (days_to_date(19000 + i * days // n), 'Deposit', amount,
+                                    'Salary', balance)))
+    bank.load([account], rows)
+    history = bank.history('5550000000')
+
+    months = [(days_to_date(day), days_to_date(day + 30))
+              for day in (19000 + rng.randrange(days - 30) for _ in range(queries))]
+    t0 = time.perf_counter()
+    for start, end in months:
+        page = bank.statement('5550000000', start, end, limit=50)
+    indexed = (time.perf_counter() - t0) / queries
+
+    t0 = time.perf_counter()
+    for start, end in months[:10]:
+        scan = [t for t in history if start <= t[0] <= end][-50:]
+    linear = (time.perf_counter() - t0) / 10
+    if scan != bank.statement('5550000000', start, end, limit=50):
+        raise AssertionError("Indexed statement differs from a linear scan")
+
+    print(f"{n:,} rows: indexed range statement {indexed * 1000:.3f} ms, "
+          f"linear scan {linear * 1000:,.1f} ms ({linear / indexed:,.0f}x)")
+    return {'indexed_ms': indexed * 1000, 'linear_ms': linear * 1000}
+
+
+def bench_search(n=1000000, seed=42, repeat=100):
+    """Time description searches on one large account against a linear scan"""
+    rng = random.Random(seed)
+    bank = Bank()
+    account = banking_module.create_account('5550000000', 'Search Test', 'search@email.com',
+                                            '5550000000', 0, '0000')
+    parties = [f"{rng.randrange(10**10):010d}" for _ in range(1000)]
+    texts = ['Salary', 'ATM Withdrawal', 'Coffee shop', 'Groceries', 'Rent']
+    balance = 0
+    rows = []
+    for i in range(n):
+        amount = rng.randint(1, 10000)
+        balance += amount
+        if i % 2:
+            description = f"To {rng.choice(parties)}: Invoice {rng.randrange(100)}"
+        else:
+            description = rng.choice(texts)
+        rows.append(('5550000000', ('2024-01-01', 'Transfer', amount, description, balance)))
+    bank.load([account], rows)
+    history = bank.history('5550000000')
+
+    t0 = time.perf_counter()
+    bank.search('5550000000', 'salary')
+    build = time.perf_counter() - t0
+
+    results = {'build_sec': build}
+    print(f"{n:,} rows: first search builds the index in {build:.2f}s")
+    for query in ('coffee shop', 'sal', f"to:{parties[0]}", f"to:{parties[0]} invoice 42"):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            matches = bank.search('5550000000', query)
+            newest = matches[-20:]
+        elapsed = (time.perf_counter() - t0) / repeat
+        results[query] = elapsed * 1000
+        print(f"{query!r:<32} {len(matches):>8,} matches, {elapsed * 1000:8.3f} ms "
+              f"(newest page of 20)")
+
+    t0 = time.perf_counter()
+    scan = [t for t in history if f"To {parties[0]}:" in t[3]]
+    print(f"linear scan for one counterparty: {(time.perf_counter() - t0) * 1000:,.0f} ms")
+    if scan != list(bank.search('5550000000', f"to:{parties[0]}")):
+        raise AssertionError("Search results differ from a linear scan")
+    return results
+
+
+def bench_graph(n=1000000, seed=42, accounts=1000, repeat=100):
+    """Time counterparty queries against regex-parsing the descriptions"""
+    rng = random.Random(seed)
+    bank = Bank()
+    numbers = bank.open_accounts([('Graph Test', 'graph@email.com', '5550000000', '100000',
+                                   '0000')] * accounts)['opened']
+    # A few heavy payees make the top counterparties meaningful
+    payees = numbers[:20]
+    records = []
+    while len(records) < n:
+        sender = rng.choice(numbers)
+        recipient = rng.choice(payees) if rng.random() < 0.3 else rng.choice(numbers)
+        if sender != recipient:
+            records.append((sender, recipient, rng.randint(1, 10000), 'Payment'))
+    bank.post_batch(records, atomic=False)
+    target = payees[0]
+
+    t0 = time.perf_counter()
+    bank.top_counterparties(target)
+    build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        top = bank.top_counterparties(target, 5)
+        flows = bank.flows(target, top[0]['account'])
+    indexed = (time.perf_counter() - t0) / repeat
+
+    t0 = time.perf_counter()
+    pattern = re.compile(r'(To|From) (\d{10}):')
+    volumes = {}
+    for _, _, amount, description, _ in bank.history(target):
+        match = pattern.match(description)
+        if match:
+            volumes[match.group(2)] = volumes.get(match.group(2), 0) + abs(amount)
+    scan = time.perf_counter() - t0
+    if max(volumes, key=volumes.get) != top[0]['account']:
+        raise AssertionError("Top counterparty differs from a description scan")
+
+    t0 = time.perf_counter()
+    bank.top_flows(10)
+    bank_build = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    bank.top_flows(10)
+    bank_wide = time.perf_counter() - t0
+    print(f"{len(bank.history(target)):,}-row account: index build {build * 1000:.1f} ms, "
+          f"top 5 + flows {indexed * 1000:.3f} ms ({len(flows)} legs), "
+          f"regex scan {scan * 1000:.1f} ms")
+    print(f"bank-wide top 10 flows over {2 * n:,} postings: {bank_wide * 1000:.1f} ms "
+          f"({bank_build:.2f}s to build every account's index)")
+    return {'indexed_ms': indexed * 1000, 'scan_ms': scan * 1000}
+
+
+def bench_allocator(n=1000000, seed=42):
+    """Compare random account numbers with retries against the allocator"""
+    rng = random.Random(seed)
+    taken = set()
+    retries = 0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        # The former generate_account_number: ten digits, retry on collision
+        while True:
+            acc_num = ''.join([str(rng.randint(0, 9)) for _ in range(10)])
+            if acc_num not in taken:
+                break
+            retries += 1
+        taken.add(acc_num)
+    random_time = time.perf_counter() - t0
+
+    allocator = AccountNumberAllocator(block_size=n)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        allocator.allocate()
+    single_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    numbers = allocator.reserve(n)
+    block_time = time.perf_counter() - t0
+    if len(set(numbers)) != n:
+        raise AssertionError("Allocator issued a duplicate number")
+
+    print(f"random + retry  {n / random_time:>10,.0f} numbers/s ({retries} retries)")
+    print(f"allocate()      {n / single_time:>10,.0f} numbers/s")
+    print(f"reserve({n})  {n / block_time:>10,.0f} numbers/s")
+    return {'random_per_sec': n / random_time, 'allocate_per_sec': n / single_time,
+            'reserve_per_sec': n / block_time}
+
+
+def bench_onboard(n=1000000, seed=42, reject_rate=0.01, sample=20000):
+    """Compare one-at-a-time registration against the bulk onboarding pipeline"""
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    applicants = []
+    for i in range(n):
+        if rng.random() < reject_rate:
+            # A mix of broken fields, so every rule gets exercised
+            applicants.append(rng.choice([('Al', 'al@example.com', '5550000000', '50', '1234'),
+                                          ('Ann Lee', 'ann@', '5550000000', '50', '1234'),
+                                          ('Ann Lee', 'ann@example.com', '555', '50', '1234'),
+                                          ('Ann Lee', 'ann@example.com', '5550000000', '5', '1234'),
+                                          ('Ann Lee', 'ann@example.com', '5550000000', '50', '12')]))
+            continue
+        name = ''.join(rng.choices(letters, k=6)).capitalize() + ' ' + \
+            ''.join(rng.choices(letters, k=8)).capitalize()
+        applicants.append((name, f"user{i}@example.com", f"{rng.randrange(10 ** 10):010d}",
+                           f"{rng.randint(10, 5000)}.{rng.randrange(100):02d}",
+                           f"{rng.randrange(10000):04d}"))
+
+    bank = Bank()
+    # Hash PINs at the onboarding cost on both paths, so the comparison
+    # measures validation and account creation rather than the KDF
+    bank.pin_iterations = BULK_PIN_ITERATIONS
+    sample = applicants[:min(sample, n)]
+    t0 = time.perf_counter()
+    for applicant in sample:
+        try:
+            bank.open_account(*applicant)
+        except BankError:
+            pass
+    single_time = time.perf_counter() - t0
+
+    bank = Bank()
+    t0 = time.perf_counter()
+    opened = sum(1 for _, acc_num, _ in onboard.onboard(bank, applicants) if acc_num)
+    bulk_time = time.perf_counter() - t0
+    if opened != len(bank.accounts):
+        raise AssertionError("Onboarding result rows disagree with the bank")
+
+    print(f"open_account   {len(sample) / single_time:>10,.0f} applicants/s")
+    print(f"onboard        {n / bulk_time:>10,.0f} applicants/s "
+          f"({opened:,} opened, {n - opened:,} rejected in {bulk_time:.1f}s)")
+    return {'single_per_sec': len(sample) / single_time, 'bulk_per_sec': n / bulk_time,
+            'bulk_seconds': bulk_time}
+
+
+def bench_login(n=1000000, seed=42, accounts=20, kdf_logins=200):
+    """Measure logins per second with hashed PINs, with and without the cache"""
+    rng = random.Random(seed)
+    bank = Bank()
+    pins = {}
+    for i in range(accounts):
+        pin = f"{rng.randrange(10000):04d}"
+        pins[bank.open_account(f"Customer {chr(65 + i % 26)}", f"c{i}@example.com",
+                               '5550000000', '100', pin)] = pin
+    acc_nums = list(pins)
+    logins = [rng.choice(acc_nums) for _ in range(n)]
+
+    # The former check: a plain-text comparison against the account dict
+    plain = {acc_num: {'pin': pin} for acc_num, pin in pins.items()}
+    t0 = time.perf_counter()
+    for acc_num in logins:
+        if plain[acc_num]['pin'] != pins[acc_num]:
+            raise AssertionError("Login failed")
+    plain_time = time.perf_counter() - t0
+
+    # Every login runs the KDF on the pool
+    bank.pin_verifier.close()
+    bank.pin_verifier = PinVerifier(cache_size=0)
+    t0 = time.perf_counter()
+    futures = [bank.authenticate_async(acc_num, pins[acc_num])
+               for acc_num in logins[:kdf_logins]]
+    for future in futures:
+        future.result()
+    kdf_time = time.perf_counter() - t0
+
+    # Repeat logins within the TTL are served by the cache
+    bank.pin_verifier.close()
+    bank.pin_verifier = verifier = PinVerifier()
+    t0 = time.perf_counter()
+    for acc_num in logins:
+        bank.authenticate(acc_num, pins[acc_num])
+    cached_time = time.perf_counter() - t0
+    bank.close()
+
+    print(f"plain text      {n / plain_time:>12,.0f} logins/s (before)")
+    print(f"KDF, no cache   {kdf_logins / kdf_time:>12,.0f} logins/s "
+          f"({bank.pin_verifier.workers} workers)")
+    print(f"KDF + cache     {n / cached_time:>12,.0f} logins/s "
+          f"({verifier.hits / n:.1%} cache hits)")
+    return {'plain_per_sec': n / plain_time, 'kdf_per_sec': kdf_logins / kdf_time,
+            'cached_per_sec': n / cached_time, 'hit_rate': verifier.hits / n}
+
+
+def bench_interest(n=10000000, seed=42, accounts=200000, rate='0.035'):
+    """Compare per-account interest with the vectorized accrual job"""
+    rng = random.Random(seed)
+    balances = [rng.randint(1000, 10 ** 8) for _ in range(n)]
+
+    # The former way: BankingModule.calculate_interest per principal (rate in %)
+    sample = balances[:min(n, 100000)]
+    percent = Fraction(rate) * 100
+    t0 = time.perf_counter()
+    for balance in sample:
+        banking_module.calculate_interest(balance, percent, Fraction(1, 365))
+    single_rate = len(sample) / (time.perf_counter() - t0)
+
+    daily = Fraction(rate) / 365
+    t0 = time.perf_counter()
+    interest.interest_cents(balances, daily.numerator, daily.denominator)
+    vector_time = time.perf_counter() - t0
+
+    # End to end on a bank: compute, post and journal every credit
+    bank = Bank()
+    bank.load(banking_module.create_account(f"{i:010d}", 'Saver', 's@example.com',
+                                            '5550000000', balance, '1234')
+              for i, balance in enumerate(balances[:accounts]))
+    t0 = time.perf_counter()
+    summary = interest.accrue_interest(bank, rate, '2024-01-01')
+    run_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    interest.accrue_interest(bank, rate, '2024-01-01')
+    rerun_time = time.perf_counter() - t0
+
+    print(f"calculate_interest  {single_rate:>12,.0f} accounts/s")
+    print(f"vectorized pass     {n / vector_time:>12,.0f} accounts/s ({n:,} in {vector_time:.2f}s)")
+    print(f"accrual job         {accounts / run_time:>12,.0f} accounts/s "
+          f"({summary['credited']:,} credited, ${format_money(summary['total'])})")
+    print(f"completed rerun     {rerun_time * 1000:>12.1f} ms")
+    return {'single_per_sec': single_rate, 'vector_per_sec': n / vector_time,
+            'job_per_sec': accounts / run_time}
+
+
+def bench_workload(n=10000000, seed=42, months=12):
+    """Generate a synthetic workload of about n transactions into a bank"""
+    accounts = max(2, n // (months * workload.ROWS_PER_ACCOUNT_MONTH))
+    bank = Bank()
+    t0 = time.perf_counter()
+    summary = workload.populate(bank, accounts, months, seed=seed)
+    elapsed = time.perf_counter() - t0
+    rows = summary['transactions']
+    print(f"workload            {rows / elapsed:>12,.0f} transactions/s "
+          f"({rows:,} in {elapsed:.2f}s, {accounts:,} accounts)")
+    print(f"transfers           {summary['transfers']:>12,} ({summary['bounced']:,} bounced debits)")
+    return {'generate_per_sec': rows / elapsed, 'generate_seconds': elapsed}
+
+
+def bench_instrument(n=1000000, seed=42, accounts=1000):
+    """Measure the cost of instrumentation on transfers, disabled and enabled"""
+    rng = random.Random(seed)
+    bank = Bank()
+    acc_nums = bank.open_accounts([('Customer', 'c@example.com', '5550000000', '1000000',
+                                    '1234')] * accounts)['opened']
+    pairs = [rng.sample(acc_nums, 2) for _ in range(min(n, 100000))]
+    unwrapped = Bank.transfer.__wrapped__
+
+    def run(transfer):
+        t0 = time.perf_counter()
+        for i in range(n):
+            sender, recipient = pairs[i % len(pairs)]
+            transfer(bank, sender, recipient, 1)
+        return n / (time.perf_counter() - t0)
+
+    enabled = metrics.enabled
+    try:
+        metrics.enabled = False
+        bare_rate = run(unwrapped)
+        disabled_rate = run(Bank.transfer)
+        metrics.enabled = True
+        metrics.reset()
+        enabled_rate = run(Bank.transfer)
+        summary = metrics.snapshot()['bank.transfer']
+    finally:
+        metrics.enabled = enabled
+    print(f"uninstrumented      {bare_rate:>12,.0f} transfers/s")
+    print(f"disabled            {disabled_rate:>12,.0f} transfers/s "
+          f"({bare_rate / disabled_rate - 1:+.1%} time)")
+    print(f"enabled             {enabled_rate:>12,.0f} transfers/s "
+          f"({bare_rate / enabled_rate - 1:+.1%} time)")
+    print(f"latency             p50 {summary['p50_ms'] * 1000:.1f} us, "
+          f"p99 {summary['p99_ms'] * 1000:.1f} us, max {summary['max_ms']:.2f} ms")
+    return {'bare_per_sec': bare_rate, 'disabled_per_sec': disabled_rate,
+            'enabled_per_sec': enabled_rate}
+
+
+def bench_shards(n=1000000, seed=42, accounts=100000, local_share=0.9, batch_size=20000,
+                 max_shards=8):
+    """Measure transfer posting throughput of the sharded engine by shard count
+
+    local_share of the transfers stay within one shard; the rest take the
+    two-phase path. Routing happens before the clock starts, as it would
+    in the clients of a real deployment.
+    """
+    counts = [count for count in (1, 2, 4, 8, 16) if count <= max_shards]
+    print(f"{os.cpu_count()} CPUs; {local_share:.0%} same-shard transfers")
+    results = {}
+    base = None
+    for count in counts:
+        rng = random.Random(seed)
+        with shards.ShardedBank(count) as bank:
+            acc_nums = bank.open_accounts([('Customer', 'c@example.com', '5550000000', '1000000',
+                                            '1234')] * accounts)['opened']
+            by_shard = [[] for _ in range(count)]
+            for acc_num in acc_nums:
+                by_shard[bank.shard_of(acc_num)].append(acc_num)
+            records = []
+            for _ in range(n):
+                sender = rng.choice(acc_nums)
+                home = by_shard[bank.shard_of(sender)]
+                recipient = rng.choice(home if rng.random() < local_share else acc_nums)
+                records.append((sender, recipient, rng.randint(1, 5000), 'Load test'))
+            t0 = time.perf_counter()
+            plans = [bank.route(records[i:i + batch_size]) for i in range(0, n, batch_size)]
+            route_time = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            applied = sum(bank.execute(plan)['applied'] for plan in plans)
+            elapsed = time.perf_counter() - t0
+        rate = n / elapsed
+        base = base or rate
+        print(f"{count:>2} shards  {rate:>12,.0f} transfers/s ({rate / base:.2f}x, "
+              f"{rate / base / count:.0%} of linear; {applied:,} applied, "
+              f"routing {n / route_time:,.0f}/s)"
+              + (" - more shards than CPUs, scaling not measured"
+                 if count > (os.cpu_count() or 1) else ""))
+        results[f'shards_{count}_per_sec'] = rate
+    return results
+
+
+def bench_server(n=1000000, seed=42, connections=1000, depth=8, duration=10.0, accounts=100):
+    """Measure the network service under many pipelining connections
+
+    Starts server.py in a child process and drives it from this one with
+    loadtest.run_load for duration seconds or n requests, whichever ends
+    first. The load client needs CPU too, so on a host with few cores the
+    figures understate the server alone.
+    """
+    server.raise_file_limit()
+    with socket.socket() as probe:
+        probe.bind((server.HOST, 0))
+        port = probe.getsockname()[1]
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, os.path.join(here, 'server.py'), '--port', str(port),
+                                '--pin-iterations', '1000'])
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection((server.HOST, port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("server.py did not start")
+                time.sleep(0.1)
+        summary = asyncio.run(loadtest.run_load(server.HOST, port, connections, depth, duration,
+                                                n, accounts, seed=seed))
+    finally:
+        process.terminate()
+        process.wait()
+    loadtest.print_summary(summary, sys.stdout)
+    results = {'requests_per_sec': summary['requests_per_sec'], 'errors': summary['errors'],
+               'transfers_per_batch': summary['transfers_per_batch']}
+    for name, operation in summary['operations'].items():
+        results[f'{name}_p50_ms'] = operation['p50_ms']
+        results[f'{name}_p99_ms'] = operation['p99_ms']
+    return results
+
+
+SUITE_SIZES = (1000, 100000)  # Rows; add 10000000 for the full run
+HIGHER_IS_BETTER = ('_per_sec',)
+LOWER_IS_BETTER = ('_ms', '_sec', '_seconds', '_bytes')
+
+
+def _rss_bytes():
+    """Return the resident memory of this process, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def build_ledger(rows, seed=42, batch_size=10000):
+    """Build a bank holding about rows transaction rows from fixed-seed transfers
+
+    One account per 100 rows, with 1% hot accounts receiving a fifth of
+    all transfers. Returns the bank, its account numbers and the batch
+    posting rate in postings per second.
+    """
+    rng = random.Random(seed)
+    accounts = max(10, rows // 100)
+    bank = Bank()
+    numbers = bank.open_accounts([('Suite Account', 'suite@example.com', '5550000000',
+                                   '1000000', '0000')] * accounts)['opened']
+    hot = numbers[:max(1, accounts // 100)]
+    remaining = max(0, (rows - accounts) // 2)
+    postings = 0
+    elapsed = 0.0
+    while remaining:
+        count = min(batch_size, remaining)
+        records = [(rng.choice(numbers),
+                    rng.choice(hot) if rng.random() < 0.2 else rng.choice(numbers),
+                    rng.randint(1, 50000), 'Suite transfer') for _ in range(count)]
+        t0 = time.perf_counter()
+        result = bank.post_batch(records, atomic=False)
+        elapsed += time.perf_counter() - t0
+        postings += 2 * result['applied']
+        remaining -= count
+    return bank, numbers, postings / elapsed if elapsed else None
+
+
+def render_times(bank, acc_num):
+    """Time the dashboard and its history and analytics tabs in a hidden Tk window
+
+    Returns milliseconds per view, or None when Tk cannot open a display.
+    """
+    try:
+        import tkinter as tk
+    except ImportError:
+        return None
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    from main import SmartBankr
+    root.withdraw()
+    app = SmartBankr(root, bank=bank)
+    times = {}
+    try:
+        app.current_user = acc_num
+        t0 = time.perf_counter()
+        app.create_dashboard()  # Builds the Account Info tab
+        root.update_idletasks()
+        times['render_dashboard_ms'] = (time.perf_counter() - t0) * 1000
+        # As in use, the other tabs find the data prepared in the background
+        app.prepared.result()
+        for name, index in (('transactions', 1), ('analytics', 3)):
+            t0 = time.perf_counter()
+            app.tab_control.select(index)
+            app.on_tab_changed()
+            root.update_idletasks()
+            times[f'render_{name}_ms'] = (time.perf_counter() - t0) * 1000
+    finally:
+        bank.unsubscribe(app.on_bank_event)
+        app.executor.shutdown()
+        root.destroy()
+    return times
+
+
+def suite_case(rows, seed=42, samples=1000):
+    """Measure the main paths on a synthetic ledger of about rows rows"""
+    rng = random.Random(seed)
+    rss_before = _rss_bytes()
+    bank, numbers, batch_rate = build_ledger(rows, seed)
+    rss_after = _rss_bytes()
+    total_rows = sum(len(history) for history in bank.transactions.values())
+    hot = max(numbers, key=lambda acc_num: len(bank.transactions[acc_num]))
+    metrics = {'rows': total_rows, 'accounts': len(numbers), 'batch_postings_per_sec': batch_rate}
+
+    # Memory: the columns themselves, and the whole process's growth
+    column_bytes = sum(column.itemsize * len(column) for history in bank.transactions.values()
+                       for column in (history.dates, history.types, history.amounts,
+                                      history.balances, history.parties, history.links,
+                                      history.descs))
+    metrics['columns_per_row_bytes'] = column_bytes / total_rows
+    if rss_before is not None:
+        metrics['rss_per_row_bytes'] = (rss_after - rss_before) / total_rows
+
+    # Single transfers, the path of the Transfer tab
+    count = min(samples * 10, rows)
+    pairs = [rng.sample(numbers, 2) for _ in range(count)]
+    t0 = time.perf_counter()
+    for sender, recipient in pairs:
+        bank.transfer(sender, recipient, 1, 'Suite single transfer')
+    metrics['transfer_postings_per_sec'] = 2 * count / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for _ in range(samples):
+        bank.generate_account_number()
+    metrics['account_numbers_per_sec'] = samples / (time.perf_counter() - t0)
+
+    # Statement latency over random accounts and on the busiest one
+    latencies = []
+    for acc_num in rng.choices(numbers, k=samples):
+        t0 = time.perf_counter()
+        bank.statement(acc_num)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    metrics['statement_p50_ms'] = _percentile(latencies, 0.5)
+    metrics['statement_p95_ms'] = _percentile(latencies, 0.95)
+    t0 = time.perf_counter()
+    bank.statement(hot, limit=100)
+    metrics['statement_hot_ms'] = (time.perf_counter() - t0) * 1000
+
+    # Analytics: running aggregates, the original recomputation, bank-wide report
+    t0 = time.perf_counter()
+    for acc_num in numbers[:samples]:
+        bank.analytics(acc_num)
+    metrics['analytics_ms'] = (time.perf_counter() - t0) * 1000 / min(samples, len(numbers))
+    history = list(bank.history(hot))
+    t0 = time.perf_counter()
+    banking_module.analyze_transactions(history)
+    metrics['analyze_transactions_ms'] = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    bank.report()
+    metrics['report_ms'] = (time.perf_counter() - t0) * 1000
+
+    metrics.update(render_times(bank, hot) or {})
+    return metrics
+
+
+def bench_suite(n=None, seed=42, sizes=SUITE_SIZES):
+    """Run the benchmark suite on ledgers of each size (n runs a single size)"""
+    results = {}
+    for rows in ([n] if n else sizes):
+        metrics = results[str(rows)] = suite_case(rows, seed)
+        print(f"{metrics['rows']:,} rows, {metrics['accounts']:,} accounts")
+        for name, value in metrics.items():
+            if name not in ('rows', 'accounts'):
+                print(f"  {name:<28}{value:>14,.3f}")
+    if not any('render_dashboard_ms' in metrics for metrics in results.values()):
+        print("  (render times skipped: Tk has no display)")
+    return results
+
+
+def _flatten(results, prefix=''):
+    """Flatten nested result dicts into {'a.b': value}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare_results(baseline, results, tolerance=0.1):
+    """Print each metric against a baseline and return the regressed ones"""
+    old, new = _flatten(baseline), _flatten(results)
+    regressions = []
+    for key, value in new.items():
+        before = old.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or not before:
+            continue
+        change = (value - before) / abs(before)
+        if key.endswith(HIGHER_IS_BETTER):
+            regressed = change < -tolerance
+        elif key.endswith(LOWER_IS_BETTER):
+            regressed = change > tolerance
+        else:
+            regressed = False
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<44}{before:>14,.3f}{value:>14,.3f}{change:>+9.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def environment():
+    """Describe the machine and versions a result was measured on"""
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'numpy': numpy_version,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+BENCHMARKS = {
+    'money': bench_money,
+    'stress': bench_stress,
+    'batch': bench_batch,
+    'io': bench_io,
+    'archive': bench_archive,
+    'statement': bench_statement,
+    'search': bench_search,
+    'graph': bench_graph,
+    'allocator': bench_allocator,
+    'onboard': bench_onboard,
+    'login': bench_login,
+    'interest': bench_interest,
+    'workload': bench_workload,
+    'instrument': bench_instrument,
+    'shards': bench_shards,
+    'server': bench_server,
+    'suite': bench_suite,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SmartBankr benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('-n', type=int, help="number of operations (default 1000000; "
+                                             "for the suite, a single ledger size in rows)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed")
+    parser.add_argument('--sizes', default=','.join(map(str, SUITE_SIZES)),
+                        help="suite ledger sizes in rows, comma-separated")
+    parser.add_argument('--json', help="save the results to a JSON file")
+    parser.add_argument('--baseline', help="compare with results saved by --json")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative change reported as a regression (default 0.1)")
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('benchmark') != args.benchmark:
+            parser.error(f"{args.baseline} holds results of {baseline.get('benchmark')!r}")
+
+    if args.benchmark == 'suite':
+        results = bench_suite(args.n, args.seed, [int(size) for size in args.sizes.split(',')])
+    else:
+        results = BENCHMARKS[args.benchmark](args.n or 1000000, args.seed)
+    run = {'benchmark': args.benchmark, 'seed': args.seed, 'environment': environment(),
+           'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(run, f, indent=2)
+    if baseline is not None:
+        print(f"\nAgainst {args.baseline} ({baseline['environment']['time']}):")
+        regressions = compare_results(baseline['results'], results, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
@@ -0,0 +1,268 @@
+"""Blocking client of the banking service.
+
+`RemoteBank` stands in for a `Bank` when the GUI runs as a client of a
+server started with ``python server.py`` (``python main.py --connect
+HOST:PORT``). It offers the part of the Bank interface the GUI calls, each
+method one HTTP request on a keep-alive connection of the calling thread:
+
+- `authenticate` logs in and keeps the session token, so later calls act
+  on that account; calls naming any other account are rejected.
+- `accounts` caches the logged-in account's details. The balance in it is
+  refreshed by every posting made through this client, and listeners get
+  a 'post' event for each, as with a local bank. Postings made by other
+  clients show up on the next history or analytics request.
+- `transactions`, `history_range` and `search` return `RemoteHistory`
+  sequences, which fetch a page of rows only when it is read.
+
+Transport failures raise BankError, so the GUI reports them like any
+rejected operation.
+"""
+import http.client
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from analytics import AccountStats
+from banking import BankError, StatementPage
+from server import HOST, MAX_PAGE, PORT
+
+
+class RemoteHistory:
+    """Read-only sequence of an account's transactions on the server
+
+    Its length is fetched on first use and its rows a page at a time, so
+    the GUI's virtual history view reads only the rows it shows.
+    """
+
+    def __init__(self, bank, params=None):
+        self.bank = bank
+        self.params = params or {}  # /history filter: q, start, end
+        self._length = None
+
+    def __len__(self):
+        if self._length is None:
+            self._length = self.bank._request('GET', '/history', dict(self.params, limit=0))['total']
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return self._rows(start, stop)
+            return self._rows(0, len(self))[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return self._rows(index, index + 1)[0]
+
+    def _rows(self, start, stop):
+        rows = []
+        while start < stop:
+            page = self.bank._request('GET', '/history', dict(
+                self.params, offset=start, limit=min(stop - start, MAX_PAGE)))['transactions']
+            if not page:
+                break
+            rows += map(tuple, page)
+            start += len(page)
+        return rows
+
+
+class _RemoteHistories:
+    """The `transactions` mapping of a RemoteBank: only the logged-in account's history"""
+
+    def __init__(self, bank):
+        self.bank = bank
+
+    def get(self, acc_num, default=None):
+        if acc_num is None or acc_num != self.bank.account:
+            return default
+        return RemoteHistory(self.bank)
+
+    def __getitem__(self, acc_num):
+        history = self.get(acc_num)
+        if history is None:
+            raise KeyError(acc_num)
+        return history
+
+
+class RemoteBank:
+    """The Bank methods the GUI uses, answered by a BankServer"""
+
+    def __init__(self, host=HOST, port=PORT, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.token = None  # Bearer token of the logged-in session
+        self.account = None  # Logged-in account number
+        self.accounts = {}  # Logged-in account number -> its details
+        self.transactions = _RemoteHistories(self)
+        self.listeners = []
+        self._local = threading.local()  # One connection per calling thread
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='remote')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _request(self, method, path, params=None):
+        """Send one request and return its JSON payload, raising BankError if rejected"""
+        headers = {}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        body = None
+        if method == 'GET':
+            if params:
+                path += '?' + urlencode({key: value for key, value in params.items()
+                                         if value is not None})
+        else:
+            body = json.dumps(params or {})
+            headers['Content-Type'] = 'application/json'
+        connection = self._connection()
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            payload = json.loads(response.read())
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            # Reconnect on the next call
+            connection.close()
+            self._local.connection = None
+            raise BankError(f"Bank service unavailable ({e})") from None
+        if response.status != 200:
+            raise BankError(payload.get('error', f"Bank service error {response.status}"))
+        return payload
+
+    def _session_account(self, acc_num):
+        if acc_num != self.account:
+            raise BankError("Account not found")
+        return acc_num
+
+    def subscribe(self, callback):
+        """Call callback(event, acc_num, data) after each posting made through this client"""
+        self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        self.listeners.remove(callback)
+
+    def _posted(self, acc_num, balance, transaction):
+        self.accounts[acc_num]['balance'] = balance
+        for callback in self.listeners:
+            callback('post', acc_num, transaction)
+
+    def load_sample_data(self):
+        """Nothing to do: the server loads its own demo accounts"""
+
+    def authenticate(self, acc_num, pin):
+        """Log in and return the account number"""
+        session = self._request('POST', '/login', {'account': acc_num, 'pin': pin})
+        self.token = session['token']
+        self.account = session['account']
+        details = self._request('GET', '/account')
+        self.accounts.clear()
+        self.accounts[self.account] = details
+        return self.account
+
+    def authenticate_async(self, acc_num, pin):
+        """Log in on a worker thread; returns a Future of the account number"""
+        return self._executor.submit(self.authenticate, acc_num, pin)
+
+    def open_account(self, name, email, phone, deposit, pin):
+        """Open a new account and return its number"""
+        return self._request('POST', '/accounts', {'name': name, 'email': email, 'phone': phone,
+                                                   'deposit': deposit, 'pin': pin})['account']
+
+    def open_account_async(self, name, email, phone, deposit, pin):
+        return self._executor.submit(self.open_account, name, email, phone, deposit, pin)
+
+    def balance(self, acc_num):
+        self._session_account(acc_num)
+        return self._request('GET', '/balance')['balance']
+
+    def deposit(self, acc_num, amount, description='Deposit'):
+        self._session_account(acc_num)
+        result = self._request('POST', '/deposit', {'amount': amount, 'description': description})
+        transaction = tuple(result['transaction'])
+        self._posted(acc_num, result['balance'], transaction)
+        return transaction
+
+    def withdraw(self, acc_num, amount, description='Withdrawal'):
+        self._session_account(acc_num)
+        result = self._request('POST', '/withdraw', {'amount': amount, 'description': description})
+        transaction = tuple(result['transaction'])
+        self._posted(acc_num, result['balance'], transaction)
+        return transaction
+
+    def post(self, acc_num, t_type, amount, description):
+        """Post signed cents as a deposit or a withdrawal
+
+        The service does not take arbitrary postings, so debits of any
+        type are funds-checked withdrawals.
+        """
+        if amount > 0:
+            return self.deposit(acc_num, amount, description)
+        return self.withdraw(acc_num, -amount, description)
+
+    def transfer(self, sender, recipient, amount, description=''):
+        """Transfer funds from the logged-in account and return the cents sent"""
+        self._session_account(sender)
+        result = self._request('POST', '/transfer', {'to': recipient, 'amount': amount,
+                                                     'description': description})
+        self._posted(sender, result['balance'], None)
+        return result['amount']
+
+    def history(self, acc_num):
+        self._session_account(acc_num)
+        return RemoteHistory(self)
+
+    def history_range(self, acc_num, start=None, end=None):
+        """Return the transactions dated start..end; bad dates raise at once"""
+        self._session_account(acc_num)
+        history = RemoteHistory(self, {'start': start, 'end': end})
+        len(history)
+        return history
+
+    def search(self, acc_num, query, start=None, end=None):
+        self._session_account(acc_num)
+        history = RemoteHistory(self, {'q': query, 'start': start, 'end': end})
+        len(history)
+        return history
+
+    def statement(self, acc_num, start=None, end=None, limit=5, cursor=None):
+        self._session_account(acc_num)
+        page = self._request('GET', '/statement', {'start': start, 'end': end, 'limit': limit,
+                                                   'cursor': cursor})
+        return StatementPage(map(tuple, page['transactions']), page['next_cursor'])
+
+    def account_stats(self, acc_num):
+        """Return the account's analytics aggregates, rebuilt from the server's summary"""
+        self._session_account(acc_num)
+        summary = self._request('GET', '/analytics')
+        return AccountStats.from_totals(
+            summary.get('total_transactions', 0), summary.get('type_stats', {}),
+            summary.get('total_deposits', 0), summary.get('total_withdrawals', 0),
+            summary['max_amount'], summary['recent_dates'])
+
+    def analytics(self, acc_num):
+        return self.account_stats(acc_num).summary()
+
+    def close(self):
+        """End the session and close every connection"""
+        if self.token is not None:
+            try:
+                self._request('POST', '/logout')
+            except BankError:
+                pass
+            self.token = None
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
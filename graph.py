@@ -0,0 +1,89 @@
+"""Counterparty graph over structured transfer legs.
+
+Every transfer leg records its counterparty account and the transfer id it
+shares with the other leg (see store.py). `CounterpartyIndex` groups one
+account's legs by counterparty into graph edges carrying running counts and
+volumes plus the rows of the legs, so "top counterparties by volume" costs
+O(k log n) in the account's number of counterparties and "all flows
+between A and B" is a lookup instead of a scan of the history.
+
+Like the search indexes, it catches up incrementally on the rows appended
+since it was last read, so postings pay nothing for it.
+"""
+import heapq
+import threading
+from array import array
+
+from store import NO_COUNTERPARTY
+
+
+class Edge:
+    """Transfers between an account and one counterparty"""
+
+    __slots__ = ('sent_count', 'sent', 'received_count', 'received', 'rows')
+
+    def __init__(self):
+        self.sent_count = 0
+        self.sent = 0  # Cents sent to the counterparty
+        self.received_count = 0
+        self.received = 0  # Cents received from the counterparty
+        self.rows = array('Q')  # Rows of the legs, ascending
+
+    @property
+    def volume(self):
+        return self.sent + self.received
+
+    def summary(self, counterparty):
+        return {
+            'account': f"{counterparty:010d}",
+            'transfers': self.sent_count + self.received_count,
+            'sent': self.sent,
+            'received': self.received,
+            'volume': self.volume,
+        }
+
+
+class CounterpartyIndex:
+    """Graph edges from one account to each of its counterparties"""
+
+    def __init__(self, history):
+        self.history = history
+        self.edges = {}  # Counterparty account number (int) -> Edge
+        self.indexed = 0  # Number of history rows indexed so far
+        self._lock = threading.Lock()
+
+    def update(self):
+        """Fold in the transfer legs appended since the last update"""
+        history = self.history
+        if self.indexed == len(history.descs):
+            return
+        with self._lock:
+            count = len(history.descs)
+            edges = self.edges
+            start = self.indexed
+            for row, (party, amount) in enumerate(
+                    zip(history.parties[start:count], history.amounts[start:count]), start):
+                if party == NO_COUNTERPARTY:
+                    continue
+                edge = edges.get(party)
+                if edge is None:
+                    edge = edges[party] = Edge()
+                if amount < 0:
+                    edge.sent_count += 1
+                    edge.sent -= amount
+                else:
+                    edge.received_count += 1
+                    edge.received += amount
+                edge.rows.append(row)
+            self.indexed = count
+
+    def top(self, n=10):
+        """Return the n counterparties with the largest volume, largest first"""
+        self.update()
+        best = heapq.nlargest(n, self.edges.items(), key=lambda item: item[1].volume)
+        return [edge.summary(party) for party, edge in best]
+
+    def edge(self, counterparty):
+        """Return the edge to a counterparty account, or None"""
+        self.update()
+        return self.edges.get(int(counterparty))
@@ -0,0 +1,251 @@
+"""Lightweight hot-path instrumentation.
+
+Operations such as logins, transfers and dashboard rebuilds are wrapped
+with `timed`. While `metrics.enabled` is false a wrapped call costs one
+attribute check on top of the call itself; once it is enabled every call
+adds to its operation's counters:
+
+    calls    number of completed calls
+    errors   calls that raised (a rejected transfer, a wrong PIN, ...)
+    latency  a histogram of call durations with 4 buckets per power of two
+             of nanoseconds (so within 25%), from which p50/p95/p99 are read
+
+`measure` times a block of code the same way. On demand, `Metrics` also
+captures a cProfile profile of the calling thread (the Tk thread in the
+GUI) and a tracemalloc snapshot of the largest allocation sites, kept as
+text reports. `Metrics.dump` writes the counters, percentiles and reports
+to a JSON file; the GUI shows them in its diagnostics window and dumps them
+with ``python main.py --metrics FILE``.
+"""
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+
+BUCKETS = 256  # Enough for any 64-bit nanosecond duration
+PERCENTILES = (50, 95, 99)
+REPORT_LINES = 25
+
+
+def _bucket(ns):
+    """Histogram bucket of a duration: 4 buckets per power of two"""
+    if ns < 8:
+        return max(ns, 0)
+    shift = ns.bit_length() - 3
+    return shift * 4 + (ns >> shift)
+
+
+def _bucket_bounds(index):
+    """Return the (lowest, highest) durations counted in a bucket"""
+    if index < 8:
+        return index, index
+    shift, top = divmod(index, 4)
+    shift -= 1
+    low = (top + 4) << shift
+    return low, low + (1 << shift) - 1
+
+
+class Histogram:
+    """Call counters and a latency histogram of one operation"""
+
+    __slots__ = ('calls', 'errors', 'total_ns', 'max_ns', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, ns, failed=False):
+        self.calls += 1
+        self.errors += failed
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        if ns < 8:
+            self.buckets[max(ns, 0)] += 1
+        else:
+            # _bucket inlined: this runs on every instrumented call
+            shift = ns.bit_length() - 3
+            self.buckets[shift * 4 + (ns >> shift)] += 1
+
+    def percentile(self, q):
+        """Return the duration in ns below which q percent of calls fall (bucket midpoint)"""
+        if not self.calls:
+            return 0
+        rank = max(1, -(-self.calls * q // 100))  # Nearest rank
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                low, high = _bucket_bounds(index)
+                return min((low + high) // 2, self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        """Return the counters and latencies in milliseconds"""
+        summary = {'calls': self.calls, 'errors': self.errors,
+                   'total_ms': self.total_ns / 1e6,
+                   'mean_ms': self.total_ns / self.calls / 1e6 if self.calls else 0.0}
+        for q in PERCENTILES:
+            summary[f'p{q}_ms'] = self.percentile(q) / 1e6
+        summary['max_ms'] = self.max_ns / 1e6
+        return summary
+
+
+class _Timer:
+    """Context manager timing one block into an operation"""
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.record(self.name, time.perf_counter_ns() - self.start, exc_type is not None)
+
+
+class _NullTimer:
+    """Stand-in for _Timer while instrumentation is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Registry of per-operation counters, latencies and on-demand reports"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.operations = {}  # Operation name -> Histogram
+        self.started = time.time()  # When the counters were last reset
+        self.profile_report = None  # Text of the last cProfile capture
+        self.memory_report = None  # Text of the last tracemalloc capture
+        self._profiler = None
+        self._lock = threading.Lock()
+
+    def record(self, name, ns, failed=False):
+        """Add one call of duration ns to an operation"""
+        with self._lock:
+            histogram = self.operations.get(name)
+            if histogram is None:
+                histogram = self.operations[name] = Histogram()
+            histogram.add(ns, failed)
+
+    def measure(self, name):
+        """Return a context manager timing its block as a call of name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def reset(self):
+        """Forget every operation's counters"""
+        with self._lock:
+            self.operations = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """Return {operation: summary} for every operation called so far"""
+        with self._lock:
+            operations = sorted(self.operations.items())
+            return {name: histogram.summary() for name, histogram in operations}
+
+    @property
+    def profiling(self):
+        return self._profiler is not None
+
+    def start_profile(self):
+        """Start profiling the calling thread with cProfile"""
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop_profile(self, lines=REPORT_LINES, sort='cumulative'):
+        """Stop profiling and return the report of the busiest functions"""
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return self.profile_report
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(lines)
+        self.profile_report = out.getvalue()
+        return self.profile_report
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self, frames=1):
+        """Start tracing memory allocations with tracemalloc"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop_tracing(self, lines=REPORT_LINES):
+        """Stop tracing and return the allocation sites holding the most memory"""
+        if not tracemalloc.is_tracing():
+            return self.memory_report
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = snapshot.statistics('lineno')
+        report = [f"Traced {current / 1e6:.1f} MB now, {peak / 1e6:.1f} MB at peak"]
+        report += [str(stat) for stat in stats[:lines]]
+        self.memory_report = '\n'.join(report)
+        return self.memory_report
+
+    def dump(self, path, extra=None):
+        """Write the counters, percentiles and last reports to a JSON file"""
+        data = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'since': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'enabled': self.enabled,
+            'operations': self.snapshot(),
+            'profile': self.profile_report,
+            'memory': self.memory_report,
+        }
+        if extra:
+            data.update(extra)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        return data
+
+
+metrics = Metrics()  # Process-wide registry used by `timed`
+
+
+def timed(name, registry=metrics):
+    """Decorator counting and timing calls of a function as operation name"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return fn(*args, **kwargs)
+            failed = True
+            start = time.perf_counter_ns()
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                registry.record(name, time.perf_counter_ns() - start, failed)
+        return wrapper
+    return decorate
@@ -0,0 +1,191 @@
+"""End-of-day interest accrual.
+
+`accrue_interest` credits interest to every active Savings account as an
+'Interest' posting. The interest of all accounts is computed in one
+vectorized pass per chunk of accounts: each account contributes its
+balance-days over the accrual period, either
+
+    closing  the current balance times the number of days, or
+    average  the sum of its end-of-day balances over the period, read from
+             the history's date column (average daily balance times days),
+
+and interest = balance-days * annual rate / DAYS_IN_YEAR, rounded half to
+even like `money.apply_rate`. The rate is an exact fraction, so the whole
+computation is integer arithmetic: NumPy int64 when it is installed and
+cannot overflow, plain Python ints otherwise.
+
+Credits are posted through `Bank.post_credits`, one journal record per
+chunk, and each record also stores how far through the accounts the run
+has got and how many accounts it covers (`Bank.job_progress`). The run
+covers the accounts that existed when it started, so accounts opened
+later never earn interest for that date. A run interrupted by a crash
+therefore resumes after the last chunk it posted when started again for
+the same date, and a completed run is not applied again.
+
+Run ``python interest.py --help`` for the command line.
+"""
+import argparse
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from fractions import Fraction
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional
+    np = None
+
+from banking import Bank, BankError
+from money import format_money
+from store import date_to_days
+
+DAYS_IN_YEAR = 365
+CHUNK_SIZE = 100000  # Accounts per vectorized pass and journal record
+INTEREST_TYPE = 'Interest'
+BASES = ('closing', 'average')
+INT64_LIMIT = 2 ** 63
+
+
+def interest_cents(balance_days, numerator, denominator):
+    """Return round_half_even(balance_days * numerator / denominator) per account
+
+    Negative balance-days earn nothing. Returns a list of ints.
+    """
+    if np is not None and len(balance_days):
+        values = np.maximum(np.asarray(balance_days, dtype=np.int64), 0)
+        if int(values.max()) * numerator < INT64_LIMIT and 2 * denominator < INT64_LIMIT:
+            quotient, remainder = np.divmod(values * numerator, denominator)
+            twice = remainder * 2
+            quotient += (twice > denominator) | ((twice == denominator) & (quotient % 2 == 1))
+            return quotient.tolist()
+    result = []
+    for value in balance_days:
+        quotient, remainder = divmod(max(value, 0) * numerator, denominator)
+        if remainder * 2 > denominator or (remainder * 2 == denominator and quotient % 2):
+            quotient += 1
+        result.append(quotient)
+    return result
+
+
+def balance_days(history, first_day, last_day):
+    """Sum an account's end-of-day balances over first_day..last_day inclusive"""
+    dates, balances = history.dates, history.balances
+    rows = history.date_order()
+    if rows is None:
+        rows = range(len(dates))
+    day_of = dates.__getitem__
+    # The balance carried into the period is the last one before it
+    start = bisect_left(rows, first_day, key=day_of)
+    end = bisect_right(rows, last_day, key=day_of)
+    balance = balances[rows[start - 1]] if start else 0
+    total = 0
+    day = first_day
+    for row in rows[start:end]:
+        total += balance * (dates[row] - day)
+        day = dates[row]
+        balance = balances[row]
+    return total + balance * (last_day + 1 - day)
+
+
+def accrue_interest(bank, annual_rate, date_str=None, days=1, basis='closing',
+                    chunk_size=CHUNK_SIZE, description='Interest'):
+    """Credit days of interest ending on date_str to every active Savings account
+
+    annual_rate is a decimal string or number, e.g. '0.035' for 3.5%. The
+    run is identified by its date, so calling it again for the same date
+    resumes an interrupted run or, once it has finished, does nothing
+    (summary['already_done'] is then true). Returns a summary dict.
+    """
+    if basis not in BASES:
+        raise BankError(f"Unknown interest basis: {basis}")
+    if days < 1:
+        raise BankError("Interest must accrue over at least one day")
+    date_str = date_str or datetime.now().strftime('%Y-%m-%d')
+    try:
+        last_day = date_to_days(date_str)
+    except ValueError:
+        raise BankError("Dates must be YYYY-MM-DD") from None
+    first_day = last_day - days + 1
+    try:
+        rate = Fraction(str(annual_rate)) / DAYS_IN_YEAR
+    except ValueError:
+        raise BankError("Please enter a valid interest rate") from None
+    if rate < 0:
+        raise BankError("Interest rate must not be negative")
+
+    job_id = f"interest:{date_str}"
+    accounts = bank.accounts
+    # Insertion order is preserved by snapshots and replay, so positions
+    # stay valid across a restart; accounts opened since land at the end,
+    # past the cutoff recorded with the job's progress
+    acc_nums = list(accounts)
+    progress = bank.job_progress.get(job_id)
+    if progress is None:
+        position, cutoff = 0, len(acc_nums)
+    elif isinstance(progress, int):
+        position, cutoff = progress, len(acc_nums)  # Recorded without a cutoff
+    else:
+        position, cutoff = progress
+    del acc_nums[cutoff:]
+    resumed_from = position
+    credited = total = 0
+    if progress is None and not acc_nums:
+        # Record the empty run so accounts opened later are not credited
+        bank.post_credits([], INTEREST_TYPE, description, date_str, (job_id, (0, 0)))
+    while position < len(acc_nums):
+        chunk = acc_nums[position:position + chunk_size]
+        eligible = [acc_num for acc_num in chunk
+                    if accounts[acc_num]['account_type'] == 'Savings'
+                    and accounts[acc_num]['status'] == 'Active']
+        if basis == 'closing':
+            amounts = [accounts[acc_num]['balance'] * days for acc_num in eligible]
+        else:
+            amounts = [balance_days(bank.transactions[acc_num], first_day, last_day)
+                       for acc_num in eligible]
+        amounts = interest_cents(amounts, rate.numerator, rate.denominator)
+        credits = [(acc_num, amount) for acc_num, amount in zip(eligible, amounts) if amount > 0]
+        position += len(chunk)
+        bank.post_credits(credits, INTEREST_TYPE, description, date_str,
+                          (job_id, (position, cutoff)))
+        credited += len(credits)
+        total += sum(amounts)
+    return {'date': date_str, 'accounts': len(acc_nums), 'resumed_from': resumed_from,
+            'already_done': progress is not None and resumed_from >= cutoff,
+            'credited': credited, 'total': total}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Credit end-of-day interest to Savings accounts")
+    parser.add_argument('--data-dir', required=True, help="persistent bank directory")
+    parser.add_argument('--rate', required=True, help="annual interest rate, e.g. 0.035")
+    parser.add_argument('--date', help="accrual date, YYYY-MM-DD (default: today)")
+    parser.add_argument('--days', type=int, default=1, help="days of interest to accrue")
+    parser.add_argument('--basis', choices=BASES, default='closing',
+                        help="closing balance or average daily balance from the history")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="accounts per journal record")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    bank = Bank.open(args.data_dir)
+    try:
+        summary = accrue_interest(bank, args.rate, args.date, args.days, args.basis,
+                                  args.chunk_size)
+    except BankError as e:
+        parser.error(str(e))
+    finally:
+        bank.close()
+    elapsed = time.perf_counter() - t0
+    if summary['already_done']:
+        print(f"Interest for {summary['date']} was already credited; nothing to do",
+              file=sys.stderr)
+        return
+    resumed = f", resumed at account {summary['resumed_from']:,}" if summary['resumed_from'] else ""
+    print(f"Credited ${format_money(summary['total'])} of interest for {summary['date']} to "
+          f"{summary['credited']:,} of {summary['accounts']:,} accounts in {elapsed:.2f}s{resumed}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
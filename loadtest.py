@@ -0,0 +1,290 @@
+"""Load-test client for the banking service.
+
+Drives a running ``server.py`` with many concurrent keep-alive
+connections. The test first registers --accounts accounts and logs each in
+once. Every connection then authenticates with one of their bearer tokens
+and, until --duration seconds or --requests requests have passed, sends
+--depth pipelined requests at a time and reads their responses. Of those
+requests, --transfer-share are transfers to random other test accounts;
+the rest are balance, statement and analytics reads in equal shares.
+
+Latency is measured per request, from sending its burst to reading its
+response, into the same histograms as instrument.py. Any non-200 response
+counts as an error. The server's /metrics counters show how many
+transfers its connection-level batching posted per `post_batch` call.
+
+    python server.py --pin-iterations 1000 &
+    python loadtest.py --connections 2000 --depth 8 --duration 20
+
+Registration and the first login of each account run the PIN KDF at the
+server's cost, about 50 ms each by default. Start the server with a lower
+--pin-iterations to set up thousands of accounts quickly.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from instrument import Histogram
+from server import HOST, PORT, raise_file_limit
+
+SETUP_CONNECTIONS = 8  # Connections registering and logging in the test accounts
+CONNECT_CONCURRENCY = 256  # Connection attempts in flight at once
+REQUEST_POOL = 64  # Distinct pre-encoded requests per connection
+READS = ('balance', 'statement', 'analytics')
+
+
+def encode_request(host, method, path, token=None, payload=None):
+    """Return the bytes of one HTTP/1.1 request"""
+    body = json.dumps(payload, separators=(',', ':')).encode() if payload is not None else b''
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if token:
+        head += f"Authorization: Bearer {token}\r\n"
+    if body:
+        head += "Content-Type: application/json\r\n"
+    head += f"Content-Length: {len(body)}\r\n\r\n"
+    return head.encode() + body
+
+
+async def read_response(reader):
+    """Read one response and return (status, body bytes)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head[9:12])
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line[:15].lower() == b'content-length:':
+            length = int(line[15:])
+    return status, await reader.readexactly(length)
+
+
+async def connect(host, port, attempts=5):
+    """Open a connection, retrying while the server's accept queue is full"""
+    for attempt in range(attempts):
+        try:
+            return await asyncio.open_connection(host, port)
+        except OSError:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(0.1 * 2 ** attempt)
+
+
+async def call(reader, writer, request):
+    """Send one request and return its decoded JSON payload, raising on errors"""
+    writer.write(request)
+    status, body = await read_response(reader)
+    payload = json.loads(body)
+    if status != 200:
+        raise RuntimeError(f"Setup request failed ({status}): {payload.get('error')}")
+    return payload
+
+
+async def setup_accounts(host, port, count, deposit):
+    """Register count accounts and log each in; returns [(account, token), ...]"""
+    async def worker(share):
+        reader, writer = await connect(host, port)
+        sessions = []
+        try:
+            for _ in range(share):
+                acc_num = (await call(reader, writer, encode_request(
+                    host, 'POST', '/accounts', payload={
+                        'name': 'Load Tester', 'email': 'load@example.com',
+                        'phone': '5550000000', 'deposit': deposit, 'pin': '1234'})))['account']
+                session = await call(reader, writer, encode_request(
+                    host, 'POST', '/login', payload={'account': acc_num, 'pin': '1234'}))
+                sessions.append((acc_num, session['token']))
+        finally:
+            writer.close()
+        return sessions
+
+    workers = min(SETUP_CONNECTIONS, count)
+    shares = [count // workers + (i < count % workers) for i in range(workers)]
+    results = await asyncio.gather(*(worker(share) for share in shares))
+    return [session for sessions in results for session in sessions]
+
+
+class LoadStats:
+    """Latency histograms and error counts of every operation"""
+
+    def __init__(self):
+        self.operations = {name: Histogram() for name in ('transfer',) + READS}
+        self.statuses = {}  # Non-200 status -> count
+
+    def add(self, operation, ns, status):
+        failed = status != 200
+        self.operations[operation].add(ns, failed)
+        if failed:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def request_pool(host, sessions, own, rng, transfer_share, size=REQUEST_POOL):
+    """Pre-encode a mix of (operation, request bytes) for one connection"""
+    acc_num, token = sessions[own]
+    pool = []
+    for i in range(size):
+        if rng.random() < transfer_share and len(sessions) > 1:
+            other = rng.randrange(len(sessions) - 1)
+            recipient = sessions[other + (other >= own)][0]
+            pool.append(('transfer', encode_request(host, 'POST', '/transfer', token, {
+                'to': recipient, 'amount': rng.randint(1, 5000), 'description': 'Load test'})))
+        else:
+            operation = READS[i % len(READS)]
+            path = '/statement?limit=5' if operation == 'statement' else f'/{operation}'
+            pool.append((operation, encode_request(host, 'GET', path, token)))
+    return pool
+
+
+class _Run:
+    """State shared by the connections of one run"""
+
+    def __init__(self, connections, duration, limit):
+        self.waiting = connections  # Connections still opening
+        self.opened = asyncio.Event()  # Set once every connection is open or has failed
+        self.duration = duration
+        self.deadline = None
+        self.limit = limit  # Requests to send in all
+        self.sent = 0
+
+    def connected(self):
+        self.waiting -= 1
+        if not self.waiting:
+            # The clock starts once every connection is open
+            self.deadline = time.monotonic() + self.duration
+            self.opened.set()
+
+
+async def drive(host, port, pool, depth, run, stats, rng, gate):
+    """Run one connection: send depth pipelined requests, read their responses, repeat"""
+    try:
+        async with gate:
+            reader, writer = await connect(host, port)
+    finally:
+        run.connected()
+    try:
+        await run.opened.wait()
+        while run.sent < run.limit and time.monotonic() < run.deadline:
+            burst = [rng.choice(pool) for _ in range(depth)]
+            run.sent += depth
+            sent = time.perf_counter_ns()
+            writer.write(b''.join(request for _, request in burst))
+            for operation, _ in burst:
+                status, _ = await read_response(reader)
+                stats.add(operation, time.perf_counter_ns() - sent, status)
+    finally:
+        writer.close()
+
+
+async def server_metrics(host, port):
+    reader, writer = await connect(host, port)
+    try:
+        return await call(reader, writer, encode_request(host, 'GET', '/metrics'))
+    finally:
+        writer.close()
+
+
+async def run_load(host=HOST, port=PORT, connections=1000, depth=8, duration=10.0,
+                   requests=None, accounts=100, transfer_share=0.5, seed=42,
+                   deposit='1000000'):
+    """Run a load test against a server and return its summary dict"""
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    sessions = await setup_accounts(host, port, min(accounts, connections), deposit)
+    setup_time = time.perf_counter() - t0
+    pools = [request_pool(host, sessions, i % len(sessions), rng, transfer_share)
+             for i in range(connections)]
+    before = await server_metrics(host, port)
+
+    stats = LoadStats()
+    run = _Run(connections, duration, requests or float('inf'))
+    gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    tasks = [asyncio.create_task(drive(host, port, pool, depth, run, stats,
+                                       random.Random(rng.random()), gate))
+             for pool in pools]
+    await run.opened.wait()
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    after = await server_metrics(host, port)
+
+    failures = [result for result in results if isinstance(result, Exception)]
+    histograms = stats.operations.values()
+    total = sum(histogram.calls for histogram in histograms)
+    batches = after['transfer_batches'] - before['transfer_batches']
+    batched = after['batched_transfers'] - before['batched_transfers']
+    summary = {
+        'connections': connections,
+        'depth': depth,
+        'setup_seconds': setup_time,
+        'seconds': elapsed,
+        'requests': total,
+        'requests_per_sec': total / elapsed if elapsed else 0.0,
+        'errors': sum(histogram.errors for histogram in histograms),
+        'statuses': stats.statuses,
+        'failed_connections': len(failures),
+        'transfer_batches': batches,
+        'transfers_per_batch': batched / batches if batches else 0.0,
+        'operations': {name: histogram.summary() for name, histogram in stats.operations.items()},
+    }
+    if failures:
+        summary['first_failure'] = repr(failures[0])
+    return summary
+
+
+def print_summary(summary, file=sys.stderr):
+    print(f"{summary['connections']:,} connections, depth {summary['depth']}: "
+          f"{summary['requests']:,} requests in {summary['seconds']:.1f}s "
+          f"({summary['requests_per_sec']:,.0f}/s), {summary['errors']:,} errors "
+          f"(setup {summary['setup_seconds']:.1f}s)", file=file)
+    print(f"{'operation':<10} {'calls':>10} {'errors':>8} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}", file=file)
+    for name, op in summary['operations'].items():
+        print(f"{name:<10} {op['calls']:>10,} {op['errors']:>8,} {op['p50_ms']:>9.2f} "
+              f"{op['p95_ms']:>9.2f} {op['p99_ms']:>9.2f} {op['max_ms']:>9.2f}", file=file)
+    print(f"Server posted pipelined transfers in {summary['transfer_batches']:,} batches, "
+          f"{summary['transfers_per_batch']:.1f} per batch", file=file)
+    if summary['statuses']:
+        print(f"Error statuses: {summary['statuses']}", file=file)
+    if summary['failed_connections']:
+        print(f"{summary['failed_connections']:,} connections failed, first: "
+              f"{summary['first_failure']}", file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test a running banking service")
+    parser.add_argument('--host', default=HOST, help=f"server address (default {HOST})")
+    parser.add_argument('--port', type=int, default=PORT, help=f"server port (default {PORT})")
+    parser.add_argument('-c', '--connections', type=int, default=1000,
+                        help="concurrent connections (default 1000)")
+    parser.add_argument('--depth', type=int, default=8,
+                        help="requests pipelined per connection at a time (default 8)")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to run (default 10)")
+    parser.add_argument('--requests', type=int, help="stop after this many requests")
+    parser.add_argument('--accounts', type=int, default=100,
+                        help="test accounts to register and share between connections")
+    parser.add_argument('--transfer-share', type=float, default=0.5,
+                        help="fraction of requests that are transfers (default 0.5)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed")
+    parser.add_argument('--json', help="save the summary to a JSON file")
+    args = parser.parse_args(argv)
+    if args.connections < 1 or args.depth < 1 or args.accounts < 1:
+        parser.error("--connections, --depth and --accounts must be positive")
+
+    limit = raise_file_limit()
+    if limit is not None and limit < args.connections + 64:
+        parser.error(f"{args.connections:,} connections need more than this process's "
+                     f"{limit:,} open files")
+    try:
+        summary = asyncio.run(run_load(args.host, args.port, args.connections, args.depth,
+                                       args.duration, args.requests, args.accounts,
+                                       args.transfer_share, args.seed))
+    except (OSError, RuntimeError) as e:
+        parser.exit(1, f"Load test failed: {e}\n")
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
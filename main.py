@@ -1,84 +1,225 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-import re
+from tkinter import ttk, messagebox, filedialog
+import argparse
 import random
-from functools import reduce
-from datetime import datetime
+import signal
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-# Custom banking module - defined within the same file
-class BankingModule:
-    @staticmethod
-    def create_account(acc_num, name, email, phone, balance, pin):
-        """Create a new bank account"""
-        return {
-            'acc_num': acc_num,
-            'name': name,
-            'email': email,
-            'phone': phone,
-            'balance': balance,
-            'pin': pin,
-            'created_at': datetime.now().strftime('%Y-%m-%d'),
-            'account_type': 'Savings',
-            'status': 'Active'
-        }
+from banking import Bank, BankError
+from client import RemoteBank
+from instrument import metrics, timed
+from money import format_money
+import workload
+
+class VirtualHistoryView:
+    """Treeview showing a long history newest-first, materializing only visible rows"""
     
-    @staticmethod
-    def validate_transaction(amount, balance, transaction_type='withdrawal'):
-        """Validate if a transaction can be processed"""
-        if transaction_type.lower() == 'withdrawal':
-            return 0 < amount <= balance
-        return amount > 0
-    
-    @staticmethod
-    def calculate_interest(principal, rate, time):
-        """Calculate simple interest"""
-        return principal * rate * time / 100
-    
-    @staticmethod
-    def generate_account_statement(transactions, num_transactions=5):
-        """Generate account statement using list slicing"""
-        recent_transactions = transactions[-num_transactions:] if transactions else []
-        return recent_transactions
-    
-    @staticmethod
-    def analyze_transactions(transactions):
-        """Analyze transactions using functional programming concepts"""
-        if not transactions:
-            return {}
-        
-        # Using map and lambda to extract amounts
-        amounts = list(map(lambda t: t[2], transactions))
-        
-        # Using filter to get deposits and withdrawals
-        deposits = list(filter(lambda t: t[1] == 'Deposit', transactions))
-        withdrawals = list(filter(lambda t: t[1] == 'Withdrawal', transactions))
-        transfers = list(filter(lambda t: t[1] == 'Transfer', transactions))
-        
-        # Using reduce to calculate totals
-        total_deposits = reduce(lambda x, y: x + y, [t[2] for t in deposits], 0)
-        total_withdrawals = reduce(lambda x, y: x + y, [abs(t[2]) for t in withdrawals], 0)
-        
-        # Using set to get unique transaction types
-        transaction_types = set(t[1] for t in transactions)
-        
-        # Using dictionary comprehension
-        type_stats = {t_type: len([t for t in transactions if t[1] == t_type]) 
-                     for t_type in transaction_types}
-        
-        return {
-            'total_transactions': len(transactions),
-            'transaction_types': transaction_types,
-            'type_stats': type_stats,
-            'total_deposits': total_deposits,
-            'total_withdrawals': total_withdrawals,
-            'net_flow': total_deposits - total_withdrawals
-        }
+    PAGE_SIZE = 200  # Rows fetched from the store at a time
+    MAX_PAGES = 8  # Formatted pages kept in the cache
+    
+    def __init__(self, parent, columns, get_history, format_row, height=15):
+        self.get_history = get_history  # Returns the current list-like history
+        self.format_row = format_row
+        self.offset = 0  # Newest-first index of the top visible row
+        self.visible = height
+        self.pages = OrderedDict()  # Page number -> formatted rows, oldest first
+        self.items = []  # Treeview items reused as row slots
+        
+        self.tree = ttk.Treeview(parent, columns=columns, show='headings', height=height)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=120)
+        
+        # The scrollbar drives our offset instead of the tree's own view
+        self.scrollbar = ttk.Scrollbar(parent, orient='vertical', command=self.on_scroll)
+        
+        self.tree.bind('<Configure>', self.on_resize)
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll_by(-1 if e.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda e: self.scroll_by(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_by(1, 'units'))
+        self.tree.bind('<Prior>', lambda e: self.scroll_by(-1, 'pages'))
+        self.tree.bind('<Next>', lambda e: self.scroll_by(1, 'pages'))
+    
+    def pack(self):
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+    
+    def refresh(self):
+        """Re-render after the history changed, dropping stale cached pages"""
+        self.pages.clear()
+        self.render()
+    
+    def posted(self):
+        """Show a newly appended row without disturbing a scrolled-away view"""
+        if self.offset:
+            # Newest-first indices shifted by one; keep the same rows on screen
+            self.offset += 1
+        self.render()
+    
+    def row(self, history, index):
+        """Return the formatted row at a newest-first index, fetching its page lazily"""
+        position = len(history) - 1 - index
+        page_number, slot = divmod(position, self.PAGE_SIZE)
+        page = self.pages.get(page_number)
+        if page is None or slot >= len(page):
+            start = page_number * self.PAGE_SIZE
+            page = [self.format_row(t) for t in history[start:start + self.PAGE_SIZE]]
+            self.pages[page_number] = page
+            if len(self.pages) > self.MAX_PAGES:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(page_number)
+        return page[slot]
+    
+    @timed('gui.history_render')
+    def render(self):
+        """Fill the row slots from the current offset and update the scrollbar"""
+        history = self.get_history()
+        total = len(history)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        count = min(self.visible, total - self.offset)
+        
+        # Grow or shrink the fixed pool of row slots only at its end
+        while len(self.items) < count:
+            self.items.append(self.tree.insert('', 'end'))
+        while len(self.items) > count:
+            self.tree.delete(self.items.pop())
+        
+        for slot, item in enumerate(self.items):
+            self.tree.item(item, values=self.row(history, self.offset + slot))
+        
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + count) / total)
+        else:
+            self.scrollbar.set(0, 1)
+    
+    def scroll_by(self, number, what):
+        step = self.visible if what.startswith('page') else 1
+        self.offset += int(number) * step
+        self.render()
+        return 'break'
+    
+    def on_scroll(self, action, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        if action == 'moveto':
+            self.offset = int(float(args[0]) * len(self.get_history()))
+            self.render()
+        else:
+            self.scroll_by(args[0], args[1])
+    
+    def on_resize(self, event):
+        """Match the number of row slots to the height of the tree"""
+        style = ttk.Style()
+        row_height = int(style.lookup('Treeview', 'rowheight') or 20)
+        visible = max(1, event.height // row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.render()
 
-# Create an instance of the banking module
-banking_module = BankingModule()
+class DiagnosticsPanel:
+    """Window showing the instrumentation counters, with profiling and dump controls"""
+    
+    COLUMNS = ('Operation', 'Calls', 'Errors', 'Mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms')
+    FIELDS = ('calls', 'errors', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    REFRESH_MS = 1000
+    
+    def __init__(self, app):
+        self.app = app
+        self.window = tk.Toplevel(app.root)
+        self.window.title("SmartBankr - Diagnostics")
+        self.window.geometry("820x560")
+        self.window.configure(bg='#f0f8ff')
+        
+        controls = ttk.Frame(self.window, style='TFrame')
+        controls.pack(fill='x', padx=10, pady=10)
+        self.enabled = tk.BooleanVar(value=metrics.enabled)
+        ttk.Checkbutton(controls, text="Instrumentation enabled", variable=self.enabled,
+                        command=self.toggle).pack(side='left')
+        ttk.Button(controls, text="Reset", command=self.reset).pack(side='left', padx=5)
+        self.profile_btn = ttk.Button(controls, command=self.toggle_profile, width=14)
+        self.profile_btn.pack(side='left', padx=5)
+        self.trace_btn = ttk.Button(controls, command=self.toggle_tracing, width=18)
+        self.trace_btn.pack(side='left', padx=5)
+        ttk.Button(controls, text="Dump to file...", command=self.dump).pack(side='right')
+        
+        self.tree = ttk.Treeview(self.window, columns=self.COLUMNS, show='headings', height=12)
+        for col in self.COLUMNS:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=80, anchor='e')
+        self.tree.column('Operation', width=200, anchor='w')
+        self.tree.pack(fill='x', padx=10)
+        
+        self.status = ttk.Label(self.window, background='#f0f8ff')
+        self.status.pack(anchor='w', padx=10, pady=5)
+        
+        self.report = tk.Text(self.window, height=14, font=('Courier', 9), wrap='none')
+        self.report.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+        self.refresh()
+    
+    def toggle(self):
+        metrics.enabled = self.enabled.get()
+        self.refresh_now()
+    
+    def reset(self):
+        metrics.reset()
+        self.refresh_now()
+    
+    def toggle_profile(self):
+        """Start or stop profiling the Tk thread and show the report"""
+        if metrics.profiling:
+            self.show_report(metrics.stop_profile())
+        else:
+            metrics.start_profile()
+        self.refresh_now()
+    
+    def toggle_tracing(self):
+        """Start or stop tracing allocations and show the largest sites"""
+        if metrics.tracing:
+            self.show_report(metrics.stop_tracing())
+        else:
+            metrics.start_tracing()
+        self.refresh_now()
+    
+    def show_report(self, text):
+        self.report.delete('1.0', tk.END)
+        self.report.insert('1.0', text or "")
+    
+    def dump(self):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension='.json',
+                                            filetypes=[('JSON', '*.json')])
+        if path:
+            self.app.dump_metrics(path)
+            self.status.config(text=f"Diagnostics written to {path}")
+    
+    def refresh_now(self):
+        """Redraw the table and controls from the current counters"""
+        self.profile_btn.config(text="Stop profile" if metrics.profiling else "Start profile")
+        self.trace_btn.config(text="Stop memory trace" if metrics.tracing
+                              else "Start memory trace")
+        self.tree.delete(*self.tree.get_children())
+        for name, summary in metrics.snapshot().items():
+            values = [f"{summary[field]:,}" if isinstance(summary[field], int)
+                      else f"{summary[field]:.3f}" for field in self.FIELDS]
+            self.tree.insert('', 'end', values=(name, *values))
+        state = "on" if metrics.enabled else "off"
+        parts = [f"Instrumentation {state}"]
+        verifier = getattr(self.app.bank, 'pin_verifier', None)  # None for a RemoteBank
+        if verifier is not None:
+            parts.append(f"PIN cache: {verifier.hits:,} hits, {verifier.misses:,} misses")
+        parts.append(f"{len(self.app.accounts):,} accounts")
+        self.status.config(text=" | ".join(parts))
+    
+    def refresh(self):
+        """Refresh now and again every REFRESH_MS while the window is open"""
+        if not self.window.winfo_exists():
+            return
+        self.refresh_now()
+        self.window.after(self.REFRESH_MS, self.refresh)
 
 class SmartBankr:
-    def __init__(self, root):
+    def __init__(self, root, data_dir=None, bank=None, metrics_path=None):
         self.root = root
         self.root.title("SmartBankr - Banking System")
         self.root.geometry("900x700")
@@ -98,47 +239,49 @@ class SmartBankr:
         self.style.configure('TNotebook', background='#f0f8ff')
         self.style.configure('TNotebook.Tab', font=('Arial', 12, 'bold'))
         
-        # Initialize data structures
-        self.accounts = {}  # Dictionary to store account information
-        self.transactions = {}  # Dictionary to store transaction history
+        # Initialize the headless banking engine; the GUI only calls into it.
+        # With a data directory the bank is persisted and recovered on start;
+        # benchmarks pass in a bank they have already filled, and --connect a
+        # RemoteBank answered by a bank service (see server.py).
+        if bank is None:
+            bank = Bank.open(data_dir) if data_dir else Bank()
+        self.bank = bank
+        self.accounts = self.bank.accounts
+        self.transactions = self.bank.transactions
         self.current_user = None
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+        
+        # Instrumentation window (F12) and the file dumped on exit and SIGUSR1
+        self.diagnostics = None
+        self.metrics_path = metrics_path
+        self.login_started = None
+        self.root.bind('<F12>', lambda e: self.show_diagnostics())
+        if metrics_path:
+            metrics.enabled = True
+            if hasattr(signal, 'SIGUSR1'):
+                signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump_metrics(metrics_path))
+        
+        # Dashboard widgets updated in place when the bank changes
+        self.balance_labels = []
+        self.history_view = None
+        self.history_filter = None
+        self.analytics_label = None
+        self.bank.subscribe(self.on_bank_event)
+        
+        # Worker preparing tab data off the Tk thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.prepared = None
         
         # Create some sample accounts for testing
-        self.create_sample_data()
+        if not self.accounts:
+            self.create_sample_data()
         
         # Create the main interface
         self.create_welcome_screen()
     
     def create_sample_data(self):
         """Create sample accounts and transactions for demonstration"""
-        # Sample accounts
-        sample_accounts = {
-            '1234567890': banking_module.create_account('1234567890', 'John Doe', 
-                                                       'john@email.com', '1234567890', 
-                                                       5000.00, '1234'),
-            '0987654321': banking_module.create_account('0987654321', 'Jane Smith', 
-                                                       'jane@email.com', '0987654321', 
-                                                       3000.00, '5678')
-        }
-        
-        # Sample transactions using tuples
-        sample_transactions = {
-            '1234567890': [
-                ('2023-01-15', 'Deposit', 1000.00, 'Initial Deposit', 1000.00),
-                ('2023-02-01', 'Withdrawal', 200.00, 'ATM Withdrawal', 800.00),
-                ('2023-02-15', 'Deposit', 500.00, 'Salary', 1300.00),
-                ('2023-03-01', 'Transfer', 300.00, 'To Jane Smith', 1000.00),
-            ],
-            '0987654321': [
-                ('2023-01-20', 'Deposit', 500.00, 'Initial Deposit', 500.00),
-                ('2023-02-05', 'Deposit', 1000.00, 'Salary', 1500.00),
-                ('2023-02-20', 'Withdrawal', 100.00, 'Shopping', 1400.00),
-                ('2023-03-01', 'Transfer', 300.00, 'From John Doe', 1700.00),
-            ]
-        }
-        
-        self.accounts.update(sample_accounts)
-        self.transactions.update(sample_transactions)
+        self.bank.load_sample_data()
         
     def create_welcome_screen(self):
         """Create the welcome screen with login and registration options"""
@@ -218,9 +361,9 @@ class SmartBankr:
         self.pin_entry.pack(pady=5)
         
         # Login button
-        login_btn = ttk.Button(login_frame, text="Login", 
-                              command=self.validate_login, width=20)
-        login_btn.pack(pady=20)
+        self.login_btn = ttk.Button(login_frame, text="Login", 
+                                   command=self.validate_login, width=20)
+        self.login_btn.pack(pady=20)
         
         # Demo accounts info
         demo_frame = ttk.Frame(login_frame, style='TFrame')
@@ -240,24 +383,38 @@ class SmartBankr:
         acc_num = self.acc_num_entry.get().strip()
         pin = self.pin_entry.get().strip()
         
-        # Validation using regular expressions
-        if not re.match(r'^\d{10}$', acc_num):
-            self.login_error.config(text="Account number must be 10 digits")
-            return
-        
-        if not re.match(r'^\d{4}$', pin):
-            self.login_error.config(text="PIN must be 4 digits")
+        # The PIN hash is checked on the bank's pool, keeping the UI responsive
+        self.login_btn.state(['disabled'])
+        self.login_error.config(text="")
+        self.login_started = time.perf_counter_ns() if metrics.enabled else None
+        self.when_done(self.bank.authenticate_async(acc_num, pin), self.login_done)
+    
+    def login_done(self, future):
+        """Show the dashboard or the login error once verification finishes"""
+        if not self.login_error.winfo_exists():
+            return  # The user left the login screen meanwhile
+        failed = True
+        try:
+            self.current_user = future.result()
+            failed = False
+        except BankError as e:
+            self.login_btn.state(['!disabled'])
+            self.login_error.config(text=str(e))
             return
+        finally:
+            # Click to verdict, including the time queued on the PIN pool
+            if self.login_started is not None:
+                metrics.record('gui.login', time.perf_counter_ns() - self.login_started, failed)
+                self.login_started = None
         
-        # Check if account exists and PIN is correct
-        if acc_num in self.accounts:
-            if self.accounts[acc_num]['pin'] == pin:
-                self.current_user = acc_num
-                self.create_dashboard()
-            else:
-                self.login_error.config(text="Invalid PIN")
+        self.create_dashboard()
+    
+    def when_done(self, future, callback, interval=20):
+        """Call callback(future) on the Tk thread once a worker future finishes"""
+        if future.done():
+            callback(future)
         else:
-            self.login_error.config(text="Account not found")
+            self.root.after(interval, self.when_done, future, callback, interval)
     
     def create_registration_screen(self):
         """Create the account registration screen"""
@@ -296,9 +453,9 @@ class SmartBankr:
             self.reg_entries[entry_name] = entry
         
         # Register button
-        register_btn = ttk.Button(reg_frame, text="Register Account", 
-                                 command=self.validate_registration, width=20)
-        register_btn.pack(pady=20)
+        self.register_btn = ttk.Button(reg_frame, text="Register Account", 
+                                      command=self.validate_registration, width=20)
+        self.register_btn.pack(pady=20)
         
         # Error label
         self.reg_error = ttk.Label(reg_frame, text="", 
@@ -314,47 +471,23 @@ class SmartBankr:
         deposit = self.reg_entries['deposit_entry'].get().strip()
         pin = self.reg_entries['pin_entry'].get().strip()
         
-        # Validation using regular expressions
-        if not re.match(r'^[A-Za-z\s]{3,}$', name):
-            self.reg_error.config(text="Please enter a valid name")
-            return
-        
-        if not re.match(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', email):
-            self.reg_error.config(text="Please enter a valid email")
-            return
-        
-        if not re.match(r'^\d{10}$', phone):
-            self.reg_error.config(text="Phone must be 10 digits")
-            return
-        
-        if not re.match(r'^\d+(\.\d{1,2})?$', deposit) or float(deposit) < 10:
-            self.reg_error.config(text="Deposit must be at least $10")
-            return
-        
-        if not re.match(r'^\d{4}$', pin):
-            self.reg_error.config(text="PIN must be 4 digits")
+        # Hashing the new PIN runs on the bank's pool
+        self.register_btn.state(['disabled'])
+        self.reg_error.config(text="")
+        future = self.bank.open_account_async(name, email, phone, deposit, pin)
+        self.when_done(future, self.registration_done)
+    
+    def registration_done(self, future):
+        """Report the new account number or the registration error"""
+        if not self.reg_error.winfo_exists():
+            return  # The user left the registration screen meanwhile
+        try:
+            acc_num = future.result()
+        except BankError as e:
+            self.register_btn.state(['!disabled'])
+            self.reg_error.config(text=str(e))
             return
         
-        # Generate account number
-        acc_num = self.generate_account_number()
-        
-        # Create account using custom module
-        account_data = banking_module.create_account(acc_num, name, email, phone, float(deposit), pin)
-        
-        # Store account information
-        self.accounts[acc_num] = account_data
-        self.transactions[acc_num] = []
-        
-        # Add initial deposit transaction
-        initial_transaction = (
-            datetime.now().strftime('%Y-%m-%d'),
-            'Deposit',
-            float(deposit),
-            'Initial Deposit',
-            float(deposit)
-        )
-        self.transactions[acc_num].append(initial_transaction)
-        
         # Show success message
         messagebox.showinfo("Registration Successful", 
                            f"Account created successfully!\nYour account number is: {acc_num}")
@@ -363,11 +496,9 @@ class SmartBankr:
     
     def generate_account_number(self):
         """Generate a unique 10-digit account number"""
-        while True:
-            acc_num = ''.join([str(random.randint(0, 9)) for _ in range(10)])
-            if acc_num not in self.accounts:
-                return acc_num
+        return self.bank.generate_account_number()
     
+    @timed('gui.create_dashboard')
     def create_dashboard(self):
         """Create the main dashboard after login"""
         self.clear_screen()
@@ -383,16 +514,21 @@ class SmartBankr:
         welcome_label.pack(side='left')
         
         balance_label = ttk.Label(header_frame, 
-                                 text=f"Balance: ${user_info['balance']:.2f}", 
+                                 text=f"Balance: ${format_money(user_info['balance'])}", 
                                  font=('Arial', 14, 'bold'), 
                                  background='#f0f8ff', foreground='#27ae60')
         balance_label.pack(side='right')
+        self.balance_labels.append((balance_label, "Balance: $"))
         
         # Logout button
         logout_btn = ttk.Button(header_frame, text="Logout", 
                                command=self.create_welcome_screen)
         logout_btn.pack(side='right', padx=10)
         
+        diagnostics_btn = ttk.Button(header_frame, text="Diagnostics", 
+                                    command=self.show_diagnostics)
+        diagnostics_btn.pack(side='right')
+        
         # Tab control for different features
         tab_control = ttk.Notebook(self.root)
         
@@ -414,11 +550,53 @@ class SmartBankr:
         
         tab_control.pack(expand=True, fill='both', padx=20, pady=10)
         
-        # Populate tabs
-        self.populate_account_tab(account_tab)
-        self.populate_transactions_tab(transactions_tab)
-        self.populate_transfer_tab(transfer_tab)
-        self.populate_analytics_tab(analytics_tab)
+        # Populate tabs lazily on first selection, preparing the history and
+        # analytics data in the background meanwhile
+        self.prepared = self.executor.submit(self.prepare_tab_data, self.current_user)
+        self.tab_control = tab_control
+        self.tab_builders = {
+            str(account_tab): (self.populate_account_tab, account_tab),
+            str(transactions_tab): (self.populate_transactions_tab, transactions_tab),
+            str(transfer_tab): (self.populate_transfer_tab, transfer_tab),
+            str(analytics_tab): (self.populate_analytics_tab, analytics_tab),
+        }
+        tab_control.bind('<<NotebookTabChanged>>', self.on_tab_changed)
+        self.on_tab_changed()
+    
+    @timed('gui.build_tab')
+    def on_tab_changed(self, event=None):
+        """Build the selected tab the first time it is shown"""
+        builder = self.tab_builders.pop(self.tab_control.select(), None)
+        if builder is not None:
+            populate, tab = builder
+            populate(tab)
+    
+    def prepare_tab_data(self, acc_num):
+        """Format the newest history page and analytics text (worker thread)"""
+        history = self.transactions.get(acc_num, [])
+        stats = self.bank.account_stats(acc_num)
+        length = len(history)
+        page_number = max(0, length - 1) // VirtualHistoryView.PAGE_SIZE
+        start = page_number * VirtualHistoryView.PAGE_SIZE
+        return {
+            'acc_num': acc_num,
+            'length': length,
+            'page_number': page_number,
+            'page': [self.format_transaction(t) for t in history[start:length]],
+            'count': stats.count,
+            'analytics_text': self.analytics_text(stats),
+        }
+    
+    def prepared_data(self):
+        """Return the background-prepared tab data if ready, without blocking"""
+        if self.prepared is None or not self.prepared.done():
+            return None
+        try:
+            prepared = self.prepared.result()
+        except Exception:
+            # A posting raced the worker; the tabs compute their data directly
+            return None
+        return prepared if prepared['acc_num'] == self.current_user else None
     
     def populate_account_tab(self, tab):
         """Populate the account information tab"""
@@ -461,10 +639,11 @@ class SmartBankr:
         balance_label.pack(side='left')
         
         balance_value = ttk.Label(balance_frame, 
-                                 text=f"${user_info['balance']:.2f}", 
+                                 text=f"${format_money(user_info['balance'])}", 
                                  font=('Arial', 16, 'bold'), 
                                  background='#f0f8ff', foreground='#27ae60')
         balance_value.pack(side='left', padx=10)
+        self.balance_labels.append((balance_value, "$"))
     
     def populate_transactions_tab(self, tab):
         """Populate the transactions history tab"""
@@ -481,28 +660,39 @@ class SmartBankr:
                             command=self.add_sample_transaction)
         add_btn.pack(side='right')
         
+        # Search and date range filter, answered from the description and date indexes
+        filter_frame = ttk.Frame(tab, style='TFrame')
+        filter_frame.pack(fill='x', padx=20)
+        
+        ttk.Label(filter_frame, text="Search:", background='#f0f8ff').pack(side='left')
+        self.search_entry = ttk.Entry(filter_frame, width=20)
+        self.search_entry.pack(side='left', padx=5)
+        self.search_entry.bind('<Return>', lambda e: self.apply_history_filter())
+        ttk.Label(filter_frame, text="From (YYYY-MM-DD):", background='#f0f8ff').pack(side='left')
+        self.start_date_entry = ttk.Entry(filter_frame, width=12)
+        self.start_date_entry.pack(side='left', padx=5)
+        ttk.Label(filter_frame, text="To:", background='#f0f8ff').pack(side='left')
+        self.end_date_entry = ttk.Entry(filter_frame, width=12)
+        self.end_date_entry.pack(side='left', padx=5)
+        ttk.Button(filter_frame, text="Filter", command=self.apply_history_filter).pack(side='left', padx=5)
+        ttk.Button(filter_frame, text="Show All", command=self.clear_history_filter).pack(side='left')
+        
         # Transactions list
         list_frame = ttk.Frame(tab, style='TFrame')
         list_frame.pack(fill='both', expand=True, padx=20, pady=10)
         
-        # Create a treeview for transactions
+        # Virtualized treeview: only the visible rows are materialized
         columns = ('Date', 'Type', 'Amount', 'Description', 'Balance')
-        self.transaction_tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=15)
-        
-        for col in columns:
-            self.transaction_tree.heading(col, text=col)
-            self.transaction_tree.column(col, width=120)
-        
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(list_frame, orient='vertical', 
-                                 command=self.transaction_tree.yview)
-        self.transaction_tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.transaction_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
-        
-        # Load transactions
-        self.load_transactions()
+        self.history_view = VirtualHistoryView(
+            list_frame, columns, self.filtered_history, self.format_transaction)
+        self.transaction_tree = self.history_view.tree
+        self.history_view.pack()
+        
+        # Reuse the newest page prepared in the background if still current
+        prepared = self.prepared_data()
+        if prepared and prepared['length'] == len(self.transactions.get(self.current_user, [])):
+            self.history_view.pages[prepared['page_number']] = prepared['page']
+        self.history_view.render()
     
     def add_sample_transaction(self):
         """Add sample transaction to demonstrate functionality"""
@@ -511,51 +701,58 @@ class SmartBankr:
         selected_type = random.choice(transaction_types)
         
         if selected_type == 'Deposit':
-            amount = random.randint(100, 1000)
+            amount = random.randint(100, 1000) * 100
             description = 'Sample Deposit'
         elif selected_type == 'Withdrawal':
-            amount = -random.randint(10, 200)
+            amount = -random.randint(10, 200) * 100
             description = 'Sample Withdrawal'
         else:
-            amount = -random.randint(50, 300)
+            amount = -random.randint(50, 300) * 100
             description = 'Sample Transfer'
         
-        # Update balance
-        current_balance = self.accounts[self.current_user]['balance']
-        new_balance = current_balance + amount
-        
-        # Create transaction tuple
-        transaction = (
-            datetime.now().strftime('%Y-%m-%d'),
-            selected_type,
-            amount,
-            description,
-            new_balance
-        )
-        
-        # Add to transactions list
-        self.transactions[self.current_user].append(transaction)
-        self.accounts[self.current_user]['balance'] = new_balance
+        # Record the posting through the engine; on_bank_event updates the view.
+        # A bank service funds-checks debits, so it may reject them.
+        try:
+            self.bank.post(self.current_user, selected_type, amount, description)
+        except BankError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
-        self.load_transactions()
         messagebox.showinfo("Sample Data", "Sample transaction added successfully!")
-        self.create_dashboard()  # Refresh to show updated balance
-    
-    def load_transactions(self):
-        """Load transactions into the treeview"""
-        # Clear existing items
-        for item in self.transaction_tree.get_children():
-            self.transaction_tree.delete(item)
-        
-        # List comprehension to format transactions
-        formatted_transactions = [
-            (date, t_type, f"${amount:+.2f}", desc, f"${balance:.2f}")
-            for date, t_type, amount, desc, balance in self.transactions.get(self.current_user, [])
-        ]
-        
-        # Add transactions to treeview (reverse order - newest first)
-        for transaction in reversed(formatted_transactions):
-            self.transaction_tree.insert('', 'end', values=transaction)
+    
+    def filtered_history(self):
+        """Return the current user's history, limited to the search and dates if set"""
+        if self.history_filter is None:
+            return self.transactions.get(self.current_user, [])
+        return self.bank.search(self.current_user, *self.history_filter)
+    
+    def apply_history_filter(self):
+        """Show only the transactions matching the search between the entered dates"""
+        query = self.search_entry.get().strip()
+        start = self.start_date_entry.get().strip() or None
+        end = self.end_date_entry.get().strip() or None
+        try:
+            self.bank.history_range(self.current_user, start, end)
+        except BankError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.history_filter = (query, start, end) if query or start or end else None
+        self.history_view.offset = 0
+        self.history_view.refresh()
+    
+    def clear_history_filter(self):
+        """Show the whole transaction history again"""
+        self.search_entry.delete(0, tk.END)
+        self.start_date_entry.delete(0, tk.END)
+        self.end_date_entry.delete(0, tk.END)
+        self.history_filter = None
+        self.history_view.offset = 0
+        self.history_view.refresh()
+    
+    def format_transaction(self, transaction):
+        """Format a transaction tuple for display"""
+        date, t_type, amount, desc, balance = transaction
+        return (date, t_type, f"${format_money(amount, signed=True)}", desc, f"${format_money(balance)}")
     
     def populate_transfer_tab(self, tab):
         """Populate the fund transfer tab"""
@@ -596,110 +793,73 @@ class SmartBankr:
                                        foreground='red', background='#f0f8ff')
         self.transfer_error.pack()
     
+    @timed('gui.process_transfer')
     def process_transfer(self):
         """Process a fund transfer"""
         recipient = self.recipient_entry.get().strip()
         amount_str = self.amount_entry.get().strip()
         description = self.desc_entry.get().strip()
         
-        # Validation
-        if not re.match(r'^\d{10}$', recipient):
-            self.transfer_error.config(text="Recipient account must be 10 digits")
+        try:
+            amount = self.bank.transfer(self.current_user, recipient, amount_str, description)
+        except BankError as e:
+            self.transfer_error.config(text=str(e))
             return
         
-        if recipient not in self.accounts:
-            self.transfer_error.config(text="Recipient account not found")
-            return
-        
-        if recipient == self.current_user:
-            self.transfer_error.config(text="Cannot transfer to your own account")
-            return
-        
-        if not re.match(r'^\d+(\.\d{1,2})?$', amount_str):
-            self.transfer_error.config(text="Please enter a valid amount")
-            return
-        
-        amount = float(amount_str)
-        if amount <= 0:
-            self.transfer_error.config(text="Amount must be positive")
-            return
-        
-        # Use custom module for validation
-        if not banking_module.validate_transaction(amount, self.accounts[self.current_user]['balance']):
-            self.transfer_error.config(text="Insufficient funds")
-            return
-        
-        # Process transfer
-        self.accounts[self.current_user]['balance'] -= amount
-        self.accounts[recipient]['balance'] += amount
-        
-        # Record transactions
-        current_balance = self.accounts[self.current_user]['balance']
-        recipient_balance = self.accounts[recipient]['balance']
-        
-        # Using tuple for transaction record
-        sender_transaction = (
-            datetime.now().strftime('%Y-%m-%d'),
-            'Transfer',
-            -amount,
-            f"To {recipient}: {description}",
-            current_balance
-        )
-        
-        recipient_transaction = (
-            datetime.now().strftime('%Y-%m-%d'),
-            'Transfer',
-            amount,
-            f"From {self.current_user}: {description}",
-            recipient_balance
-        )
-        
-        # Add transactions to history
-        self.transactions[self.current_user].append(sender_transaction)
-        self.transactions[recipient].append(recipient_transaction)
-        
         messagebox.showinfo("Transfer Successful", 
-                           f"${amount:.2f} transferred successfully to account {recipient}")
+                           f"${format_money(amount)} transferred successfully to account {recipient}")
         
         # Clear form
         self.recipient_entry.delete(0, 'end')
         self.amount_entry.delete(0, 'end')
         self.desc_entry.delete(0, 'end')
         self.transfer_error.config(text="")
-        
-        # Refresh dashboard to show updated balance
-        self.create_dashboard()
     
     def populate_analytics_tab(self, tab):
         """Populate the analytics tab with various data operations"""
         analytics_frame = ttk.LabelFrame(tab, text="Account Analytics", padding=20)
         analytics_frame.pack(fill='both', expand=True, padx=20, pady=20)
         
-        # Get transaction data
-        transactions = self.transactions.get(self.current_user, [])
+        self.analytics_label = ttk.Label(analytics_frame, background='#f0f8ff', 
+                                        justify='left')
+        self.analytics_label.pack(fill='both', expand=True)
         
-        if not transactions:
-            no_data_label = ttk.Label(analytics_frame, text="No transaction data available", 
-                                     font=('Arial', 14), background='#f0f8ff')
-            no_data_label.pack(pady=50)
-            return
-        
-        # Use custom module for analytics
-        analytics_data = banking_module.analyze_transactions(transactions)
+        # Reuse the text prepared in the background if still current
+        prepared = self.prepared_data()
+        if prepared and prepared['count'] == self.bank.account_stats(self.current_user).count:
+            self.show_analytics(prepared['analytics_text'])
+        else:
+            self.refresh_analytics()
+    
+    @timed('gui.refresh_analytics')
+    def refresh_analytics(self):
+        """Render the analytics summary from the running aggregates"""
+        # Running aggregates make this independent of history length
+        self.show_analytics(self.analytics_text(self.bank.account_stats(self.current_user)))
+    
+    def show_analytics(self, analytics_text):
+        if analytics_text is None:
+            self.analytics_label.config(text="No transaction data available", 
+                                        font=('Arial', 14))
+        else:
+            self.analytics_label.config(text=analytics_text, font=('Courier', 9))
+    
+    def analytics_text(self, stats):
+        """Format the analytics summary, or None when there is no data"""
+        if not stats.count:
+            return None
         
-        # Demonstration of tuple operations
-        transaction_dates = tuple(t[0] for t in transactions)  # Indexing
-        recent_dates = transaction_dates[-5:]  # Slicing
-        all_dates = transaction_dates + recent_dates  # Concatenation
-        repeated_dates = recent_dates * 2  # Repetition
+        # Same summary as banking_module.analyze_transactions
+        analytics_data = stats.summary()
+        recent_dates = tuple(stats.recent_dates)
         
         # Membership test
-        has_deposits = 'Deposit' in (t[1] for t in transactions)
-        has_large_transactions = any(t[2] > 1000 for t in transactions)
+        has_deposits = 'Deposit' in stats.type_counts
+        has_large_transactions = stats.has_large_transactions
         
         # Comparison
-        deposit_count = len([t for t in transactions if t[1] == 'Deposit'])
-        withdrawal_count = len([t for t in transactions if t[1] == 'Withdrawal'])
+        deposit_count = stats.type_counts.get('Deposit', 0)
+        withdrawal_count = stats.type_counts.get('Withdrawal', 0)
         more_deposits = deposit_count > withdrawal_count
         
         # Recursive function demonstration
@@ -720,9 +880,9 @@ class SmartBankr:
         {', '.join([f'{k}: {v}' for k, v in analytics_data['type_stats'].items()])}
         
         Financial Summary:
-        Total Deposits: ${analytics_data['total_deposits']:.2f}
-        Total Withdrawals: ${analytics_data['total_withdrawals']:.2f}
-        Net Flow: ${analytics_data['net_flow']:.2f}
+        Total Deposits: ${format_money(analytics_data['total_deposits'])}
+        Total Withdrawals: ${format_money(analytics_data['total_withdrawals'])}
+        Net Flow: ${format_money(analytics_data['net_flow'])}
         
         Additional Insights:
         Has Deposits: {'Yes' if has_deposits else 'No'}
@@ -731,22 +891,85 @@ class SmartBankr:
         
         Recent Transaction Dates: {', '.join(recent_dates)}
         
-        Fun Fact: Factorial of transaction count ({len(transactions)}) is {factorial(min(len(transactions), 10))}
+        Fun Fact: Factorial of transaction count ({stats.count}) is {factorial(min(stats.count, 10))}
         """
+        return analytics_text
+    
+    def on_bank_event(self, event, acc_num, data):
+        """Update only the dashboard widgets affected by a posting"""
+        if event not in ('post', 'batch') or acc_num != self.current_user:
+            return
         
-        # Display analytics
-        analytics_label = ttk.Label(analytics_frame, text=analytics_text, 
-                                   font=('Courier', 9), background='#f0f8ff', 
-                                   justify='left')
-        analytics_label.pack(fill='both', expand=True)
+        balance = format_money(self.accounts[acc_num]['balance'])
+        for label, prefix in self.balance_labels:
+            label.config(text=f"{prefix}{balance}")
+        if self.history_view is not None:
+            if event == 'post' and self.history_filter is None:
+                self.history_view.posted()
+            else:
+                self.history_view.refresh()
+        if self.analytics_label is not None:
+            self.refresh_analytics()
+    
+    def show_diagnostics(self):
+        """Open the diagnostics window, or raise it if already open"""
+        if self.diagnostics is not None and self.diagnostics.window.winfo_exists():
+            self.diagnostics.window.lift()
+        else:
+            self.diagnostics = DiagnosticsPanel(self)
+    
+    def dump_metrics(self, path):
+        """Write the instrumentation counters and reports to a JSON file"""
+        extra = {'accounts': len(self.accounts)}
+        verifier = getattr(self.bank, 'pin_verifier', None)  # None for a RemoteBank
+        if verifier is not None:
+            extra['pin_cache'] = {'hits': verifier.hits, 'misses': verifier.misses}
+        metrics.dump(path, extra)
+    
+    def on_close(self):
+        """Flush the ledger and close the application"""
+        if self.metrics_path:
+            self.dump_metrics(self.metrics_path)
+        self.executor.shutdown(wait=False)
+        self.bank.close()
+        self.root.destroy()
     
     def clear_screen(self):
         """Clear all widgets from the screen"""
         for widget in self.root.winfo_children():
-            widget.destroy()
+            if not isinstance(widget, tk.Toplevel):
+                widget.destroy()
+        self.balance_labels = []
+        self.history_view = None
+        self.history_filter = None
+        self.analytics_label = None
 
 # Main application
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SmartBankr banking system")
+    parser.add_argument('--data-dir', help="directory of a persistent ledger (in-memory if omitted)")
+    parser.add_argument('--generate', type=int, metavar='ACCOUNTS',
+                        help="add ACCOUNTS accounts with a year of synthetic history (see workload.py)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="enable instrumentation and dump it to FILE on exit and on SIGUSR1")
+    parser.add_argument('--connect', metavar='HOST:PORT',
+                        help="run as a client of a bank service started with server.py")
+    args = parser.parse_args()
+    
+    bank = None
+    if args.connect:
+        if args.data_dir or args.generate:
+            parser.error("--connect cannot be combined with --data-dir or --generate")
+        host, _, port = args.connect.rpartition(':')
+        if not port.isdigit():
+            parser.error("--connect takes HOST:PORT")
+        bank = RemoteBank(host or 'localhost', int(port))
+    elif args.generate:
+        bank = Bank.open(args.data_dir) if args.data_dir else Bank()
+        if not bank.accounts:
+            bank.load_sample_data()
+        workload.populate(bank, args.generate)
+    
     root = tk.Tk()
-    app = SmartBankr(root)
+    app = SmartBankr(root, data_dir=args.data_dir, bank=bank, metrics_path=args.metrics)
     root.mainloop()
@@ -0,0 +1,39 @@
+"""Fixed-point money for SmartBankr.
+
+Every amount and balance in the engine is a plain ``int`` of cents, so
+balances never drift no matter how many postings they go through and all
+arithmetic stays on fast native integers. Conversion happens only at the
+edges: `parse_money` reads dollar strings from forms and files, and
+`format_money` renders cents for display.
+
+Rounding rule: any value that does not fall on a whole cent, such as
+interest, is rounded half to even ("banker's rounding").
+"""
+import re
+from fractions import Fraction
+
+# Dollar amount as typed in the forms: digits with up to two decimals
+AMOUNT_PATTERN = re.compile(r'^\d+(\.\d{1,2})?$')
+
+
+def parse_money(text):
+    """Parse a validated dollar string such as '12.5' into integer cents"""
+    whole, _, frac = text.partition('.')
+    if frac:
+        return int(whole) * 100 + int(frac) * (10 if len(frac) == 1 else 1)
+    return int(whole) * 100
+
+
+def format_money(cents, signed=False):
+    """Format cents as a dollar string, e.g. 123456 -> '1234.56'"""
+    sign = '-' if cents < 0 else ('+' if signed else '')
+    dollars, cents = divmod(abs(cents), 100)
+    return f"{sign}{dollars}.{cents:02d}"
+
+
+def apply_rate(cents, *factors):
+    """Multiply cents by exact decimal factors and round to whole cents"""
+    value = Fraction(cents)
+    for factor in factors:
+        value *= Fraction(str(factor))
+    return round(value)
@@ -0,0 +1,103 @@
+"""Bulk account onboarding.
+
+Applicants are streamed from a CSV or JSONL file (optionally gzipped, see
+migrate.py) with the fields in APPLICANT_FIELDS, exactly as they would be
+typed into the registration form: the deposit is a dollar amount. They are
+validated by the form's own rules and opened in chunks through
+`Bank.open_accounts`, so each chunk gets one block of account numbers and
+one journal record.
+
+Every applicant gets one result row (RESULT_FIELDS): its 1-based position
+in the file and either the new account number or the reason it was
+rejected.
+
+Run ``python onboard.py --help`` for the command line.
+"""
+import argparse
+import sys
+import time
+from itertools import islice
+
+from banking import Bank, gc_paused
+from migrate import file_format, read_rows, write_rows
+
+APPLICANT_FIELDS = ('name', 'email', 'phone', 'deposit', 'pin')
+RESULT_FIELDS = ('row', 'acc_num', 'reason')
+CHUNK_SIZE = 10000
+
+
+def read_applicants(path):
+    """Yield applicant records from a file as tuples of form strings"""
+    fmt = file_format(path)
+    rows = read_rows(path, APPLICANT_FIELDS, fmt)
+    if fmt == 'csv':
+        return rows
+    # JSON numbers (a deposit of 100, a phone of 5551234567) become the text
+    # the form would have received
+    return (tuple('' if value is None else str(value) for value in row) for row in rows)
+
+
+def onboard(bank, applicants, chunk_size=CHUNK_SIZE):
+    """Open accounts for applicants and yield a result row for each
+
+    Rows are (row, acc_num, reason) with row 1-based; acc_num is None for
+    rejected applicants and reason is None for accepted ones. The cycle
+    collector is paused while each chunk is read and opened (see
+    gc_paused) and back on before its rows are yielded, so the caller's
+    code never runs with it off.
+    """
+    applicants = iter(applicants)
+    offset = 1
+    while True:
+        with gc_paused():
+            chunk = list(islice(applicants, chunk_size))
+            if not chunk:
+                return
+            result = bank.open_accounts(chunk)
+        reasons = dict(result['rejected'])
+        opened = iter(result['opened'])
+        for index in range(len(chunk)):
+            reason = reasons.get(index)
+            if reason is None:
+                yield offset + index, next(opened), None
+            else:
+                yield offset + index, None, reason
+        offset += len(chunk)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open SmartBankr accounts in bulk")
+    parser.add_argument('applicants', help="applicants file (.csv or .jsonl[.gz])")
+    parser.add_argument('--data-dir', required=True, help="persistent bank directory")
+    parser.add_argument('--results', help="file to write one result row per applicant to")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="applicants opened per journal record")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    counts = {'opened': 0, 'rejected': 0}
+
+    def counted(results):
+        for result in results:
+            counts['opened' if result[1] else 'rejected'] += 1
+            yield result
+
+    bank = Bank.open(args.data_dir)
+    try:
+        results = counted(onboard(bank, read_applicants(args.applicants), args.chunk_size))
+        if args.results:
+            write_rows(args.results, RESULT_FIELDS, results)
+        else:
+            for _ in results:
+                pass
+    finally:
+        bank.close()
+    elapsed = time.perf_counter() - t0
+    total = counts['opened'] + counts['rejected']
+    rate = total / elapsed if elapsed else float('inf')
+    print(f"Opened {counts['opened']:,} accounts, rejected {counts['rejected']:,} applicants "
+          f"in {elapsed:.2f}s ({rate:,.0f} applicants/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
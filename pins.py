@@ -0,0 +1,191 @@
+"""Salted, KDF-hashed PIN storage and verification.
+
+Account dicts store a PIN as
+
+    pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+
+never as the PIN itself. The iteration count travels with the hash, so
+the cost can be raised later: `needs_rehash` flags hashes made with fewer
+iterations (or legacy plain-text PINs from old journals and imports), and
+the bank re-hashes them at the current cost on the next successful login.
+
+A weak hash can also be raised to the current cost without its PIN:
+`strengthen_pin_hash` runs the KDF again over the stored digest and
+records both passes, as in `pbkdf2_sha256$1+100000$...`, so checking a PIN
+costs their sum. Persistent banks use it to upgrade the cheap hashes of
+bulk onboarding in the background instead of waiting for each login.
+
+A slow KDF makes every login cost tens of milliseconds of CPU. `PinVerifier`
+keeps that off the caller's thread with a small thread pool (hashlib
+releases the GIL while hashing), and remembers recent successful
+verifications in a bounded LRU with a short TTL, so repeated logins of one
+account within the TTL skip the KDF. Cache entries are keyed by the stored
+hash and a keyed digest of the PIN, so they never hold a PIN and stop
+matching as soon as the PIN changes.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+ALGORITHM = 'pbkdf2_sha256'
+PIN_ITERATIONS = 100000  # About 50 ms per hash on one core
+BULK_PIN_ITERATIONS = 1  # Bulk onboarding; strengthened to PIN_ITERATIONS in the background
+SALT_BYTES = 16
+
+
+def hash_pin(pin, iterations=PIN_ITERATIONS, salt=None):
+    """Return the storable salted hash of a PIN"""
+    if salt is None:
+        salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', pin.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def parse_pin_hash(stored):
+    """Split a stored hash into (passes, salt, digest), or None for a plain PIN
+
+    passes is a tuple of the iteration counts of each KDF pass, in order.
+    """
+    algorithm, _, rest = stored.partition('$')
+    if algorithm != ALGORITHM:
+        return None
+    passes, salt, digest = rest.split('$')
+    return tuple(map(int, passes.split('+'))), bytes.fromhex(salt), bytes.fromhex(digest)
+
+
+def check_pin(pin, stored):
+    """Check a PIN against its stored hash, running the KDF"""
+    parsed = parse_pin_hash(stored)
+    if parsed is None:
+        # Legacy plain-text PIN
+        return hmac.compare_digest(pin.encode(), stored.encode())
+    passes, salt, digest = parsed
+    key = pin.encode()
+    for iterations in passes:
+        key = hashlib.pbkdf2_hmac('sha256', key, salt, iterations)
+    return hmac.compare_digest(key, digest)
+
+
+def needs_rehash(stored, iterations=PIN_ITERATIONS):
+    """Check whether a stored PIN is plain text or hashed below the current cost"""
+    parsed = parse_pin_hash(stored)
+    return parsed is None or sum(parsed[0]) < iterations
+
+
+def strengthen_pin_hash(stored, iterations=PIN_ITERATIONS):
+    """Return stored with a further KDF pass of iterations over its digest
+
+    A legacy plain-text PIN is hashed afresh instead.
+    """
+    parsed = parse_pin_hash(stored)
+    if parsed is None:
+        return hash_pin(stored, iterations)
+    passes, salt, digest = parsed
+    digest = hashlib.pbkdf2_hmac('sha256', digest, salt, iterations)
+    return f"{ALGORITHM}${'+'.join(map(str, passes + (iterations,)))}${salt.hex()}${digest.hex()}"
+
+
+class PinVerifier:
+    """Verify PINs on a thread pool, remembering recent successes"""
+
+    def __init__(self, workers=4, cache_size=4096, ttl=30.0):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.ttl = ttl  # Seconds a successful verification is remembered
+        self.cache = OrderedDict()  # (stored hash, PIN digest) -> expiry, oldest first
+        self.hits = 0
+        self.misses = 0
+        self._secret = os.urandom(32)  # Keys the PIN digests; never leaves the process
+        self._executor = None
+        self._background = deque()  # (future, fn, args) waiting for the background thread
+        self._background_ready = None  # Condition the background thread waits on
+        self._running = None  # Future of the background job being run
+        self._lock = threading.Lock()
+
+    def _cache_key(self, pin, stored):
+        return stored, hmac.digest(self._secret, pin.encode(), 'sha256')
+
+    def verify(self, pin, stored):
+        """Check a PIN against its stored hash on the calling thread"""
+        key = self._cache_key(pin, stored)
+        now = time.monotonic()
+        with self._lock:
+            expiry = self.cache.get(key)
+            if expiry is not None:
+                if expiry > now:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    return True
+                del self.cache[key]
+            self.misses += 1
+        if not check_pin(pin, stored):
+            return False
+        with self._lock:
+            self.cache[key] = time.monotonic() + self.ttl
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return True
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the verification pool and return its Future"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='pin')
+            executor = self._executor
+        return executor.submit(fn, *args)
+
+    def background(self, fn, *args):
+        """Queue fn(*args) for the background thread and return its Future
+
+        Background jobs run one at a time, in order, on a daemon thread, so a
+        long backlog neither delays logins on the pool nor holds up exit.
+        """
+        future = Future()
+        with self._lock:
+            if self._background_ready is None:
+                self._background_ready = threading.Condition(self._lock)
+                threading.Thread(target=self._run_background, name='pin-background',
+                                 daemon=True).start()
+            self._background.append((future, fn, args))
+            self._background_ready.notify()
+        return future
+
+    def _run_background(self):
+        while True:
+            with self._lock:
+                while not self._background:
+                    self._background_ready.wait()
+                future, fn, args = self._background.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._running = future
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running = None
+
+    def close(self):
+        """Stop the verification pool once queued verifications finish
+
+        Background jobs that have not started are cancelled; a running one
+        is waited for.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            pending = [future for future, _, _ in self._background]
+            self._background.clear()
+            running = self._running
+        for future in pending:
+            future.cancel()
+        if running is not None:
+            wait([running])
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,169 @@
+"""Full-text and prefix search over transaction descriptions.
+
+Descriptions are interned once in the bank's `StringTable`, so the index is
+split in two levels:
+
+- `DescriptionIndex` maps every token to the ids of the descriptions that
+  contain it. It is shared by all accounts and tokenizes each distinct
+  description only once.
+- `AccountIndex` maps each description id to the rows of one account that
+  use it.
+
+Both are maintained incrementally: they remember how far into the string
+table or history they have indexed and catch up on the new entries at the
+next search, so postings pay nothing for the index and a search after a
+burst of postings only indexes the burst.
+
+Tokens are lowercase runs of letters and digits. Transfer descriptions
+("To 1234567890: rent", "From 1234567890: rent") also index their
+counterparty as 'to:1234567890', 'from:1234567890' and
+'party:1234567890'. Every term of a query must match and matches any token
+it is a prefix of, so "sal" finds "Salary".
+"""
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+COUNTERPARTY_PATTERN = re.compile(r'(To|From) (\d{10}):')
+
+
+def tokenize(description):
+    """Return the set of search tokens of a description"""
+    tokens = set(TOKEN_PATTERN.findall(description.lower()))
+    match = COUNTERPARTY_PATTERN.match(description)
+    if match:
+        direction, acc_num = match.groups()
+        tokens.add(f"{direction.lower()}:{acc_num}")
+        tokens.add(f"party:{acc_num}")
+    return tokens
+
+
+def query_terms(query):
+    """Split a query into lowercase terms, keeping 'to:', 'from:' and 'party:' terms"""
+    return [term for term in query.lower().split() if term]
+
+
+class DescriptionIndex:
+    """Inverted index from tokens to description ids of a StringTable"""
+
+    FILTER_THRESHOLD = 1000  # Candidates checked directly instead of intersected
+
+    def __init__(self, strings):
+        self.strings = strings
+        self.postings = {}  # Token -> array of description ids, ascending
+        self.indexed = 0  # Number of strings indexed so far
+        self._vocabulary = []  # Sorted tokens, for prefix lookups
+        self._lock = threading.Lock()
+
+    def update(self):
+        """Index the descriptions interned since the last update"""
+        strings = self.strings.strings
+        if self.indexed == len(strings):
+            return
+        with self._lock:
+            count = len(strings)
+            new_tokens = False
+            for string_id in range(self.indexed, count):
+                for token in tokenize(strings[string_id]):
+                    ids = self.postings.get(token)
+                    if ids is None:
+                        ids = self.postings[token] = array('I')
+                        new_tokens = True
+                    ids.append(string_id)
+            if new_tokens:
+                self._vocabulary = sorted(self.postings)
+            self.indexed = count
+
+    def _prefix_tokens(self, term):
+        """Return the indexed tokens a query term matches"""
+        if ':' in term:
+            # Counterparty terms match whole account numbers only
+            return [term] if term in self.postings else []
+        vocabulary = self._vocabulary
+        start = bisect_left(vocabulary, term)
+        end = start
+        while end < len(vocabulary) and vocabulary[end].startswith(term):
+            end += 1
+        return vocabulary[start:end]
+
+    def search(self, query):
+        """Return the ids of descriptions matching every term of a query"""
+        self.update()
+        postings = self.postings
+        terms = []
+        for term in query_terms(query):
+            tokens = self._prefix_tokens(term)
+            if not tokens:
+                return set()
+            terms.append((sum(len(postings[token]) for token in tokens), term, tokens))
+
+        # Start from the most selective term; once few candidates are left,
+        # checking their own tokens is cheaper than building larger sets
+        terms.sort()
+        result = None
+        for _, term, tokens in terms:
+            if result is None:
+                result = set()
+                for token in tokens:
+                    result.update(postings[token])
+            elif len(result) <= self.FILTER_THRESHOLD:
+                strings = self.strings.strings
+                result = {string_id for string_id in result
+                          if _has_token(tokenize(strings[string_id]), term)}
+            else:
+                matches = set()
+                for token in tokens:
+                    matches.update(postings[token])
+                result &= matches
+            if not result:
+                break
+        return result if result is not None else set()
+
+
+def _has_token(tokens, term):
+    """Check whether a query term matches one of a description's tokens"""
+    if ':' in term:
+        return term in tokens
+    return any(token.startswith(term) for token in tokens)
+
+
+class AccountIndex:
+    """Rows of one account's history grouped by description id"""
+
+    def __init__(self, history):
+        self.history = history
+        self.rows = {}  # Description id -> array of row indices, ascending
+        self.indexed = 0  # Number of history rows indexed so far
+        self._lock = threading.Lock()
+
+    def update(self):
+        """Index the rows appended since the last update"""
+        descs = self.history.descs
+        if self.indexed == len(descs):
+            return
+        with self._lock:
+            count = len(descs)
+            rows = self.rows
+            for row, desc_id in enumerate(descs[self.indexed:count], self.indexed):
+                column = rows.get(desc_id)
+                if column is None:
+                    column = rows[desc_id] = array('Q')
+                column.append(row)
+            self.indexed = count
+
+    def search(self, desc_ids):
+        """Return the ascending row indices that use any of desc_ids"""
+        self.update()
+        rows = self.rows
+        if len(desc_ids) > len(rows):
+            columns = [column for desc_id, column in rows.items() if desc_id in desc_ids]
+        else:
+            columns = [rows[desc_id] for desc_id in desc_ids if desc_id in rows]
+        if not columns:
+            return array('Q')
+        if len(columns) == 1:
+            return columns[0]
+        return array('Q', heapq.merge(*columns))
@@ -0,0 +1,684 @@
+"""Asyncio network service for the banking engine.
+
+`BankServer` serves one `Bank` to many concurrent clients (tellers, ATMs,
+the GUI started with ``python main.py --connect HOST:PORT``) over HTTP/1.1
+on a local TCP port. Bodies and responses are JSON. Amounts are integer
+cents, and requests may also give them as dollar strings such as "12.50".
+
+    POST /accounts   {name, email, phone, deposit, pin} -> {account}
+    POST /login      {account, pin} -> {account, token}
+    POST /logout
+    GET  /account    the account's details and balance
+    GET  /balance    -> {account, balance}
+    POST /deposit    {amount, description} -> {transaction, balance}
+    POST /withdraw   {amount, description} -> {transaction, balance}
+    POST /transfer   {to, amount, description} -> {amount, balance}
+    GET  /statement  ?start&end&limit&cursor -> {transactions, next_cursor}
+    GET  /history    ?offset&limit&q&start&end -> {total, offset, transactions}
+    GET  /analytics  the analytics summary, plus max_amount and recent_dates
+    GET  /metrics    connection and batching counters and the instrumentation
+
+A login is remembered by the connection it was made on, and its token
+authenticates the account on any connection as ``Authorization: Bearer
+<token>``. A token expires once unused for SESSION_TTL seconds, and beyond
+MAX_SESSIONS live tokens the least recently used is dropped. A rejected operation answers 400 with {"error": message}, the
+same message the GUI shows; a missing or unknown session answers 401.
+
+Connections are kept alive and may pipeline: a client can send many
+requests without waiting, and the responses come back in request order.
+Each burst of requests read from a connection is parsed at once, and a run
+of consecutive transfers in it is posted with a single non-atomic
+`Bank.post_batch`, which checks each transfer in order just as if it had
+been sent alone. A teller or ATM pipelining its transfers therefore pays
+the locking and journaling of one batch rather than one per transfer. Each
+transfer's response still carries the sender's balance right after it.
+
+The event loop thread parses requests, writes responses and answers the
+operations that only touch memory. Work that can block is handed to
+threads the loop awaits:
+
+- with a persistent bank, deposits, withdrawals and transfers run on one
+  posting thread, which pays the journal's group-commit fsyncs and the
+  snapshots the ledger takes every `snapshot_every` records (an in-memory
+  bank posts in microseconds, on the loop);
+- /history searches run on a search thread, as the first search of an
+  account builds its index (about a second for a million rows) and later
+  ones catch it up with the postings since;
+- login and registration run the PIN KDF on the bank's PIN pool.
+
+Run ``python server.py --help`` for the command line and ``python
+loadtest.py`` to drive a running server with many pipelining clients.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import secrets
+import signal
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from banking import ACCOUNT_PATTERN, Bank, BankError, parse_amount
+from instrument import metrics
+import workload
+
+HOST = '127.0.0.1'
+PORT = 8765
+BACKLOG = 4096  # Pending connections the listening socket queues
+MAX_HEADER_BYTES = 16384
+MAX_BODY_BYTES = 65536
+MAX_PIPELINE = 1024  # Requests queued per connection before it stops being read
+HISTORY_PAGE = 200  # Default rows per /history page
+MAX_PAGE = 1000  # Most rows one /history or /statement response carries
+SESSION_TTL = 1800.0  # Seconds a bearer token stays valid after its last use
+MAX_SESSIONS = 100000  # Live bearer tokens kept before the least recently used is dropped
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+           501: 'Not Implemented'}
+
+
+class HTTPError(Exception):
+    """Raised to answer a request with an error status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    """One parsed HTTP request and the session it runs in"""
+
+    __slots__ = ('method', 'path', 'query', 'headers', 'body', 'keep_alive',
+                 'connection', 'account', 'params')
+
+    def __init__(self, method, path, query, headers, body, keep_alive):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers  # Lower-case names
+        self.body = body
+        self.keep_alive = keep_alive
+        self.connection = None  # Set by the connection that read it
+        self.account = None  # Logged-in account, set before the handler runs
+        self.params = None  # Query parameters updated with the JSON body
+
+
+def parse_request(buffer, start=0):
+    """Parse the request starting at buffer[start:]
+
+    Returns (request, end offset), or None until the whole request has
+    arrived. Raises HTTPError for a request that cannot be answered.
+    """
+    end = buffer.find(b'\r\n\r\n', start)
+    if end < 0:
+        if len(buffer) - start > MAX_HEADER_BYTES:
+            raise HTTPError(431, "Request headers too large")
+        return None
+    lines = bytes(buffer[start:end]).decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, "Malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise HTTPError(501, "Chunked request bodies are not supported")
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length") from None
+    if not 0 <= length <= MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body_start = end + 4
+    if len(buffer) < body_start + length:
+        return None
+
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        keep_alive = connection != 'close'
+    else:
+        keep_alive = connection == 'keep-alive'
+    url = urlsplit(target)
+    request = Request(method, url.path, dict(parse_qsl(url.query)), headers,
+                      bytes(buffer[body_start:body_start + length]), keep_alive)
+    return request, body_start + length
+
+
+def encode_response(status, payload, keep_alive=True):
+    """Return the bytes of a JSON response"""
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n")
+    if not keep_alive:
+        head += "Connection: close\r\n"
+    return (head + "\r\n").encode() + body
+
+
+def _text(params, name):
+    """Return a parameter as a string, '' if absent"""
+    value = params.get(name)
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+def _count(params, name, default, limit):
+    """Return a non-negative whole-number parameter, at most limit"""
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise BankError(f"{name} must be a whole number") from None
+    if value < 0:
+        raise BankError(f"{name} must not be negative")
+    return min(value, limit)
+
+
+def raise_file_limit():
+    """Raise this process's open-file limit to its hard limit and return it
+
+    Every connection holds a file descriptor, and the default soft limit
+    (often 1024) is lower than the connections a load test opens.
+    """
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        return soft
+    return hard
+
+
+class _Connection(asyncio.Protocol):
+    """One client connection: reads pipelined requests and answers them in order"""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = bytearray()
+        self.pending = []  # Requests read but not answered, oldest first
+        self.task = None  # Answers pending requests while there are any
+        self.account = None  # Account logged in on this connection
+        self.closing = False  # Stop reading: the client asked to close or sent garbage
+        self.paused = False
+        self.writable = asyncio.Event()  # Cleared while the transport's buffer is full
+        self.writable.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections.add(self)
+
+    def connection_lost(self, exc):
+        self.server.connections.discard(self)
+        self.transport = None
+        self.pending = []
+        self.writable.set()
+
+    def eof_received(self):
+        # Answer what was sent before the client stopped writing, then close
+        self.closing = True
+        return self.task is not None
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    def data_received(self, data):
+        if self.closing:
+            return
+        buffer = self.buffer
+        buffer += data
+        position = 0
+        while True:
+            try:
+                parsed = parse_request(buffer, position)
+            except HTTPError as e:
+                # The stream cannot be resynchronized: answer, then close
+                self.pending.append(e)
+                self.closing = True
+                break
+            if parsed is None:
+                break
+            request, position = parsed
+            request.connection = self
+            self.pending.append(request)
+            if not request.keep_alive:
+                self.closing = True
+                break
+        del buffer[:position]
+
+        if len(self.pending) >= MAX_PIPELINE and not self.paused:
+            self.transport.pause_reading()
+            self.paused = True
+        if self.pending and self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.answer())
+
+    def write(self, responses):
+        if responses and self.transport is not None:
+            self.transport.write(b''.join(responses))
+
+    async def answer(self):
+        """Answer the pending requests in order, batching runs of transfers"""
+        server = self.server
+        try:
+            while self.pending and self.transport is not None:
+                requests, self.pending = self.pending, []
+                if self.paused:
+                    self.transport.resume_reading()
+                    self.paused = False
+                responses = []
+                index = 0
+                while index < len(requests):
+                    request = requests[index]
+                    if isinstance(request, HTTPError):
+                        responses.append(encode_response(request.status, {'error': str(request)},
+                                                          keep_alive=False))
+                        break
+                    end = index + 1
+                    if server.is_transfer(request):
+                        while end < len(requests) and server.is_transfer(requests[end]):
+                            end += 1
+                    if end - index > 1:
+                        if server.bank.ledger is not None:
+                            # Send what is ready before waiting on the posting thread
+                            self.write(responses)
+                            responses = []
+                        responses += await server.transfer_batch(requests[index:end])
+                    else:
+                        response = server.handle(request)
+                        if not isinstance(response, bytes):
+                            # Send what is ready before waiting on a worker thread
+                            self.write(responses)
+                            responses = []
+                            response = await response
+                        responses.append(response)
+                    index = end
+                self.write(responses)
+                await self.writable.wait()
+            if self.closing and self.transport is not None:
+                self.transport.close()
+        finally:
+            self.task = None
+
+
+class BankServer:
+    """HTTP/JSON front-end serving one Bank to many pipelining connections"""
+
+    ROUTES = {
+        ('POST', '/accounts'): 'register',
+        ('POST', '/login'): 'login',
+        ('POST', '/logout'): 'logout',
+        ('GET', '/account'): 'account',
+        ('GET', '/balance'): 'balance',
+        ('POST', '/deposit'): 'deposit',
+        ('POST', '/withdraw'): 'withdraw',
+        ('POST', '/transfer'): 'transfer',
+        ('GET', '/statement'): 'statement',
+        ('GET', '/history'): 'history',
+        ('GET', '/analytics'): 'analytics',
+        ('GET', '/metrics'): 'metrics_report',
+    }
+    PATHS = {path for _, path in ROUTES}
+    PUBLIC = frozenset({'register', 'login', 'metrics_report'})  # Answered without a login
+    KDF = frozenset({'register', 'login'})  # Coroutines awaiting the PIN pool
+    POSTING = frozenset({'deposit', 'withdraw', 'transfer'})  # Journaled: may fsync or snapshot
+
+    def __init__(self, bank, session_ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.bank = bank
+        self.sessions = OrderedDict()  # Bearer token -> [account, last used], oldest use first
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        # One thread each, so postings keep their order, and journal fsyncs,
+        # snapshots and index builds never run on the event loop
+        self.posting = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bank-post')
+        self.searching = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bank-search')
+        self.connections = set()
+        self.server = None
+        self.requests = 0  # Requests answered
+        self.batches = 0  # post_batch calls made for runs of pipelined transfers
+        self.batched = 0  # Transfers those calls applied
+
+    async def start(self, host=HOST, port=PORT, backlog=BACKLOG):
+        """Start listening; port 0 picks a free port (see `port`)"""
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(lambda: _Connection(self), host, port,
+                                               backlog=backlog)
+        return self
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop listening and drop every connection"""
+        self.server.close()
+        for connection in list(self.connections):
+            if connection.transport is not None:
+                connection.transport.close()
+        await self.server.wait_closed()
+        self.posting.shutdown()
+        self.searching.shutdown()
+
+    def is_transfer(self, request):
+        return request.path == '/transfer' and request.method == 'POST'
+
+    def _prepare(self, request):
+        """Resolve the handler, session and parameters of a request"""
+        name = self.ROUTES.get((request.method, request.path))
+        if name is None:
+            if request.path in self.PATHS:
+                raise HTTPError(405, f"{request.method} is not allowed on {request.path}")
+            raise HTTPError(404, f"Unknown path: {request.path}")
+        if name not in self.PUBLIC:
+            request.account = self._session(request)
+        params = dict(request.query)
+        if request.body:
+            try:
+                body = json.loads(request.body)
+            except ValueError:
+                raise HTTPError(400, "Request body must be JSON") from None
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Request body must be a JSON object")
+            params.update(body)
+        request.params = params
+        return name
+
+    def _session(self, request):
+        """Return the account a request is logged in as"""
+        authorization = request.headers.get('authorization')
+        if authorization:
+            now = time.monotonic()
+            self._expire_sessions(now)
+            scheme, _, token = authorization.partition(' ')
+            token = token.strip()
+            session = self.sessions.get(token) if scheme.lower() == 'bearer' else None
+            if session is None:
+                raise HTTPError(401, "Invalid or expired session")
+            session[1] = now
+            self.sessions.move_to_end(token)
+            return session[0]
+        if request.connection.account is None:
+            raise HTTPError(401, "Please log in first")
+        return request.connection.account
+
+    def _expire_sessions(self, now):
+        """Drop the tokens unused for longer than session_ttl
+
+        Sessions are kept in order of last use, so only expired ones are
+        looked at; every authenticated request and login runs this.
+        """
+        sessions = self.sessions
+        cutoff = now - self.session_ttl
+        while sessions:
+            token, (_, last_used) = next(iter(sessions.items()))
+            if last_used > cutoff:
+                break
+            del sessions[token]
+
+    def _error(self, request, status, error):
+        return encode_response(status, {'error': str(error)}, request.keep_alive)
+
+    def handle(self, request):
+        """Answer one request
+
+        Returns the response bytes, or for operations run off the event
+        loop a coroutine returning them once their thread has finished.
+        """
+        self.requests += 1
+        try:
+            name = self._prepare(request)
+            if name in self.KDF:
+                return self._handle_async(name, request)
+            executor = self._executor(name, request)
+            if executor is not None:
+                return self._handle_async(name, request, executor)
+            with metrics.measure(f'http.{name}'):
+                payload = getattr(self, name)(request)
+        except HTTPError as e:
+            return self._error(request, e.status, e)
+        except BankError as e:
+            return self._error(request, 400, e)
+        except Exception as e:
+            traceback.print_exc()
+            return self._error(request, 500, e)
+        return encode_response(200, payload, request.keep_alive)
+
+    def _executor(self, name, request):
+        """Return the thread pool to run a handler on, or None for the event loop"""
+        if name in self.POSTING:
+            return self.posting if self.bank.ledger is not None else None
+        if name == 'history' and _text(request.params, 'q').strip():
+            return self.searching
+        return None
+
+    async def _handle_async(self, name, request, executor=None):
+        """Answer a request whose handler is a coroutine, or runs on executor"""
+        handler = getattr(self, name)
+        try:
+            with metrics.measure(f'http.{name}'):
+                if executor is None:
+                    payload = await handler(request)
+                else:
+                    payload = await asyncio.get_running_loop().run_in_executor(
+                        executor, handler, request)
+        except HTTPError as e:
+            return self._error(request, e.status, e)
+        except BankError as e:
+            return self._error(request, 400, e)
+        except Exception as e:
+            traceback.print_exc()
+            return self._error(request, 500, e)
+        return encode_response(200, payload, request.keep_alive)
+
+    async def transfer_batch(self, requests):
+        """Answer a run of pipelined transfers with one post_batch call
+
+        A persistent bank posts the batch on the posting thread. Each
+        applied transfer is answered with the sender's balance right after
+        it, as if it had been sent alone.
+        """
+        self.requests += len(requests)
+        responses = [None] * len(requests)
+        records = []
+        slots = []  # Position in requests of each record
+        with metrics.measure('http.transfer_batch'):
+            for slot, request in enumerate(requests):
+                try:
+                    self._prepare(request)
+                    records.append(self._transfer_record(request))
+                    slots.append(slot)
+                except HTTPError as e:
+                    responses[slot] = self._error(request, e.status, e)
+                except BankError as e:
+                    responses[slot] = self._error(request, 400, e)
+            if records:
+                if self.bank.ledger is None:
+                    result = self.bank.post_batch(records, atomic=False)
+                else:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self.posting, functools.partial(self.bank.post_batch, records,
+                                                        atomic=False))
+                rejected = dict(result['rejected'])
+                balances = iter(result['balances'])
+                self.batches += 1
+                self.batched += result['applied']
+                for index, (slot, record) in enumerate(zip(slots, records)):
+                    request = requests[slot]
+                    if index in rejected:
+                        responses[slot] = self._error(request, 400, rejected[index])
+                    else:
+                        payload = {'amount': record[2], 'balance': next(balances)}
+                        responses[slot] = encode_response(200, payload, request.keep_alive)
+        return responses
+
+    def _transfer_record(self, request):
+        """Validate a transfer as Bank.transfer does and return its post_batch record"""
+        params = request.params
+        recipient = _text(params, 'to')
+        if not ACCOUNT_PATTERN.match(recipient):
+            raise BankError("Recipient account must be 10 digits")
+        if recipient == request.account:
+            raise BankError("Cannot transfer to your own account")
+        amount = parse_amount(params.get('amount', ''))
+        return request.account, recipient, amount, _text(params, 'description')
+
+    # Route handlers: each takes the prepared request and returns the payload
+
+    async def register(self, request):
+        params = request.params
+        future = self.bank.open_account_async(
+            _text(params, 'name'), _text(params, 'email'), _text(params, 'phone'),
+            params.get('deposit', ''), _text(params, 'pin'))
+        return {'account': await asyncio.wrap_future(future)}
+
+    async def login(self, request):
+        params = request.params
+        future = self.bank.authenticate_async(_text(params, 'account'), _text(params, 'pin'))
+        acc_num = await asyncio.wrap_future(future)
+        token = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        self._expire_sessions(now)
+        self.sessions[token] = [acc_num, now]
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        request.connection.account = acc_num
+        return {'account': acc_num, 'token': token}
+
+    def logout(self, request):
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        self.sessions.pop(token.strip(), None)
+        if request.connection.account == request.account:
+            request.connection.account = None
+        return {}
+
+    def account(self, request):
+        account = self.bank.accounts[request.account]
+        return {key: value for key, value in account.items() if key != 'pin'}
+
+    def balance(self, request):
+        return {'account': request.account, 'balance': self.bank.balance(request.account)}
+
+    def deposit(self, request):
+        params = request.params
+        transaction = self.bank.deposit(request.account, params.get('amount', ''),
+                                        _text(params, 'description') or 'Deposit')
+        return {'transaction': transaction, 'balance': transaction[4]}
+
+    def withdraw(self, request):
+        params = request.params
+        transaction = self.bank.withdraw(request.account, params.get('amount', ''),
+                                         _text(params, 'description') or 'Withdrawal')
+        return {'transaction': transaction, 'balance': transaction[4]}
+
+    def transfer(self, request):
+        sender, recipient, amount, description = self._transfer_record(request)
+        amount = self.bank.transfer(sender, recipient, amount, description)
+        return {'amount': amount, 'balance': self.bank.balance(sender)}
+
+    def statement(self, request):
+        params = request.params
+        page = self.bank.statement(request.account, params.get('start') or None,
+                                   params.get('end') or None,
+                                   _count(params, 'limit', 5, MAX_PAGE),
+                                   params.get('cursor') or None)
+        return {'transactions': list(page), 'next_cursor': page.next_cursor}
+
+    def history(self, request):
+        params = request.params
+        query, start, end = _text(params, 'q'), params.get('start'), params.get('end')
+        if query or start or end:
+            rows = self.bank.search(request.account, query, start or None, end or None)
+        else:
+            rows = self.bank.history(request.account)
+        offset = _count(params, 'offset', 0, len(rows))
+        limit = _count(params, 'limit', HISTORY_PAGE, MAX_PAGE)
+        return {'total': len(rows), 'offset': offset,
+                'transactions': list(rows[offset:offset + limit])}
+
+    def analytics(self, request):
+        stats = self.bank.account_stats(request.account)
+        summary = stats.summary()
+        if summary:
+            summary['transaction_types'] = sorted(summary['transaction_types'])
+        summary['max_amount'] = stats.max_amount
+        summary['recent_dates'] = list(stats.recent_dates)
+        return summary
+
+    def metrics_report(self, request):
+        return {'connections': len(self.connections), 'sessions': len(self.sessions),
+                'requests': self.requests, 'transfer_batches': self.batches,
+                'batched_transfers': self.batched, 'operations': metrics.snapshot()}
+
+
+async def serve(bank, host=HOST, port=PORT):
+    """Serve a bank until SIGINT or SIGTERM"""
+    server = await BankServer(bank).start(host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows, or not the main thread: stop with KeyboardInterrupt
+    print(f"Serving {len(bank.accounts):,} accounts on http://{host}:{server.port}",
+          file=sys.stderr)
+    try:
+        await stop.wait()
+    finally:
+        await server.close()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the banking engine over HTTP")
+    parser.add_argument('--host', default=HOST, help=f"address to listen on (default {HOST})")
+    parser.add_argument('--port', type=int, default=PORT, help=f"port (default {PORT})")
+    parser.add_argument('--data-dir', help="directory of a persistent ledger (in-memory if omitted)")
+    parser.add_argument('--generate', type=int, metavar='ACCOUNTS',
+                        help="add ACCOUNTS accounts with a year of synthetic history")
+    parser.add_argument('--pin-iterations', type=int,
+                        help="KDF cost of newly stored PINs; lower it only for load tests")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="enable instrumentation and dump it to FILE on exit")
+    args = parser.parse_args(argv)
+
+    bank = Bank.open(args.data_dir) if args.data_dir else Bank()
+    if args.pin_iterations:
+        bank.pin_iterations = args.pin_iterations
+    if not bank.accounts:
+        bank.load_sample_data()
+    if args.generate:
+        workload.populate(bank, args.generate)
+    metrics.enabled = bool(args.metrics)
+    raise_file_limit()
+    try:
+        server = asyncio.run(serve(bank, args.host, args.port))
+        if args.metrics:
+            metrics.dump(args.metrics, {'requests': server.requests,
+                                        'transfer_batches': server.batches,
+                                        'batched_transfers': server.batched})
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,699 @@
+"""Multi-process sharded engine.
+
+One `Bank` posts from one process, so the GIL caps its throughput however
+many cores the host has. `ShardedBank` partitions accounts across worker
+processes by account number, account number mod the shard count, and
+each worker owns a `ShardBank` holding only its accounts. A shard issues
+only account numbers it owns, so new accounts are spread round-robin and
+every account number routes to its shard without a lookup table.
+
+Single-account operations (deposits, withdrawals, logins, statements,
+...) go straight to the owning shard. Transfers between two accounts of
+one shard are posted by that shard as usual. Transfers across shards use
+a two-phase protocol run by the coordinator:
+
+    prepare  the sender's shard sets the amount aside with `Bank.hold`
+             (so no other debit can spend it) and the recipient's shard
+             checks that the account exists; each votes yes or no
+    commit   if both voted yes, the sender's shard settles the hold into
+             its debit leg and confirms once that is durable; only then
+             does the recipient's shard post the credit leg under the
+             same transfer id. Otherwise the sender's hold is released
+
+The coordinator allocates every transfer id, so ids stay unique across
+shards. `post_batch` sends each shard one message with its same-shard
+transfers and its cross-shard prepares, one with its debits and aborts,
+then one with its credits, and all shards work in parallel.
+
+With data_dir, each shard is a persistent bank in <data_dir>/shard-<i>
+and the shard count is fixed in shards.json. Shards journal their holds,
+and the coordinator logs each transfer it commits in decisions.log before
+settling the debit, marking it done once the credit is durable. Opening
+the bank again finishes what was left pending: a logged transfer whose
+debit was settled, or is still held, gets its credit; one whose hold was
+lost in a crash is dropped, as are holds the log does not name. A credit
+is never posted without its debit, and never twice.
+
+A shard that fails a request, whatever the exception, is reported on
+stderr. Its prepares count as no votes and any holds they placed are
+released; a failed commit or credit is sent once more, as a `resolve` or
+a checked credit, since either may have been partly applied. Transfers
+still unfinished after that are rejected and stay pending in the decision
+log, so a persistent bank finishes them when reopened; an in-memory bank
+cannot.
+
+Run ``python bench.py shards`` to measure posting throughput by shard count.
+Scaling with the shard count has so far only been measured on a single-CPU
+host, where throughput stays flat; near-linear scaling on a multi-core host
+is expected from the design but unverified.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import Future
+
+from banking import ACCOUNT_PATTERN, Bank, BankError, parse_amount
+from ledger import Ledger
+
+CONFIG_NAME = 'shards.json'
+DECISIONS_NAME = 'decisions.log'
+# Bank methods the coordinator forwards to the shard owning their first argument
+ROUTED = frozenset({'authenticate', 'deposit', 'withdraw', 'post', 'balance', 'statement',
+                    'analytics', 'search', 'top_counterparties'})
+
+
+class ShardBank(Bank):
+    """Bank holding one shard's accounts, issuing only account numbers it owns"""
+
+    def __init__(self, ledger=None, index=0, shards=1):
+        super().__init__(ledger)
+        self.index = index
+        self.shards = shards
+
+    @classmethod
+    def open(cls, directory, index=0, shards=1, **ledger_options):
+        """Open a persistent shard stored in directory, recovering its state"""
+        bank = cls(Ledger(directory, **ledger_options), index, shards)
+        bank.ledger.recover(bank)
+        return bank
+
+    def owns(self, acc_num):
+        return int(acc_num) % self.shards == self.index
+
+    def generate_account_number(self):
+        acc_num = super().generate_account_number()
+        while not self.owns(acc_num):
+            acc_num = super().generate_account_number()
+        return acc_num
+
+    def reserve_account_numbers(self, count):
+        # About one number in `shards` is ours; the rest are never issued
+        numbers = []
+        while len(numbers) < count:
+            numbers += [acc_num for acc_num in
+                        super().reserve_account_numbers((count - len(numbers)) * self.shards)
+                        if self.owns(acc_num)]
+        return numbers[:count]
+
+
+class Shard:
+    """Request handlers of a shard worker process around its ShardBank
+
+    A worker handles one request at a time, so a hold placed by prepare
+    cannot be raced by another posting before it is committed or aborted.
+    """
+
+    def __init__(self, index, shards, directory=None):
+        if directory:
+            self.bank = ShardBank.open(directory, index, shards)
+        else:
+            self.bank = ShardBank(None, index, shards)
+
+    def call(self, method, args):
+        """Run a routed Bank method"""
+        if method not in ROUTED:
+            raise BankError(f"Unknown shard operation: {method}")
+        return getattr(self.bank, method)(*args)
+
+    def open_accounts(self, applicants):
+        return self.bank.open_accounts(applicants)
+
+    def open_account(self, *fields):
+        return self.bank.open_account(*fields)
+
+    def account(self, acc_num):
+        return self.bank._get_account(acc_num)
+
+    def transfer(self, sender, recipient, amount, description, transfer_id):
+        return self.bank.transfer(sender, recipient, amount, description, transfer_id)
+
+    def prepare(self, records, first_id, debits, credits):
+        """Post same-shard transfers, then vote on cross-shard legs
+
+        debits are (transfer_id, sender, amount) and credits are
+        (transfer_id, recipient). Returns the post_batch result and one
+        vote per debit and credit: None for yes, else the reason.
+        """
+        result = {'applied': 0, 'rejected': []}
+        if records:
+            result = self.bank.post_batch(records, atomic=False, first_transfer_id=first_id)
+            del result['balances']  # Not reported by ShardedBank.post_batch
+        debit_votes = []
+        for transfer_id, sender, amount in debits:
+            try:
+                self.bank.hold(sender, amount, transfer_id)
+            except BankError as e:
+                debit_votes.append(str(e))
+                continue
+            debit_votes.append(None)
+        accounts = self.bank.accounts
+        credit_votes = [None if recipient in accounts else "Recipient account not found"
+                        for _, recipient in credits]
+        return result, debit_votes, credit_votes
+
+    def commit(self, debits, aborts):
+        """Settle the holds of committed transfers and release aborted ones
+
+        debits are (transfer_id, recipient, description); aborts are
+        transfer ids. Returns the ids whose debit leg is posted, once the
+        journal holds it. A transfer with no hold is not confirmed, so a
+        repeated commit or abort does nothing.
+        """
+        bank = self.bank
+        confirmed = [transfer_id for transfer_id, recipient, description in debits
+                     if bank.settle(transfer_id, recipient, description) is not None]
+        for transfer_id in aborts:
+            bank.release(transfer_id)
+        bank.sync()
+        return confirmed
+
+    def credit(self, credits, check=False):
+        """Post the credit legs of transfers whose debit is confirmed
+
+        credits are (transfer_id, recipient, sender, amount, description).
+        With check, legs the recipient's history already has are skipped,
+        so credits resent after a restart are posted once. Returns once
+        the journal holds them.
+        """
+        bank = self.bank
+        for transfer_id, recipient, sender, amount, description in credits:
+            if check and transfer_id in bank.transactions[recipient].links:
+                continue
+            bank.post(recipient, 'Transfer', amount, f"From {sender}: {description}",
+                      sender, transfer_id)
+        bank.sync()
+
+    def resolve(self, debits, aborts=()):
+        """Settle or confirm committed transfers whose outcome is unknown
+
+        debits are (transfer_id, sender, recipient, description). Unlike
+        commit, a debit leg already posted, e.g. by a commit whose reply was
+        lost, is confirmed too. aborts are released. Returns the ids whose
+        debit leg is posted, once the journal holds them.
+        """
+        bank = self.bank
+        confirmed = [transfer_id for transfer_id, sender, recipient, description in debits
+                     if bank.settle(transfer_id, recipient, description) is not None
+                     or transfer_id in bank.transactions[sender].links]
+        for transfer_id in aborts:
+            bank.release(transfer_id)
+        bank.sync()
+        return confirmed
+
+    def recover(self, debits):
+        """Settle the holds of transfers the coordinator committed, release the rest
+
+        debits are (transfer_id, sender, recipient, description) of every
+        transfer this shard debits that the coordinator's log still has
+        pending. Returns the ids whose debit leg is posted, including ones
+        settled before a restart.
+        """
+        committed = {transfer_id for transfer_id, *_ in debits}
+        return self.resolve(debits, [t for t in self.bank.held if t not in committed])
+
+    def next_transfer_id(self):
+        return self.bank.next_transfer_id
+
+    def counts(self):
+        bank = self.bank
+        return {'accounts': len(bank.accounts),
+                'transactions': sum(map(len, bank.transactions.values()))}
+
+    def checkpoint(self):
+        self.bank.checkpoint()
+
+    def close(self):
+        self.bank.close()
+
+
+def _serve(index, shards, directory, conn):
+    """Worker process loop: answer (request id, operation, args) messages in order"""
+    shard = Shard(index, shards, directory)
+    try:
+        while True:
+            try:
+                request_id, operation, args = conn.recv()
+            except EOFError:
+                break
+            try:
+                result = getattr(shard, operation)(*args)
+                ok = True
+            except Exception as e:
+                result, ok = e, False
+            conn.send((request_id, ok, result))
+            if operation == 'close':
+                return
+    finally:
+        conn.close()
+    shard.close()
+
+
+class _ShardClient:
+    """Coordinator end of a shard's pipe, matching responses to requests"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.pending = {}  # Request id -> Future
+        self.next_request = 0
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def submit(self, operation, *args):
+        """Send a request to the shard and return a Future of its result"""
+        future = Future()
+        with self._lock:
+            request_id = self.next_request
+            self.next_request += 1
+            self.pending[request_id] = future
+            try:
+                self.conn.send((request_id, operation, args))
+            except OSError:
+                # The worker is gone; fail the request like the ones in flight
+                del self.pending[request_id]
+                future.set_exception(BankError("Shard stopped"))
+        return future
+
+    def _read(self):
+        while True:
+            try:
+                request_id, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self.pending.pop(request_id)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        for future in list(self.pending.values()):
+            future.set_exception(BankError("Shard stopped"))
+        self.pending.clear()
+
+
+class DecisionLog:
+    """Coordinator journal of the cross-shard transfers it decided to commit
+
+    A transfer is logged, and fsynced, before its debit is settled, and
+    marked done once its credit is durable. `pending` holds the logged
+    transfers not yet done; the file starts over whenever none are.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = {}  # Transfer id -> (sender, recipient, amount, description)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    # A torn final record was never acknowledged, so it is dropped
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        kind, entries = json.loads(line)
+                    except ValueError:
+                        break
+                    if kind == 'commit':
+                        for transfer_id, *transfer in entries:
+                            self.pending[transfer_id] = tuple(transfer)
+                    else:
+                        for transfer_id in entries:
+                            self.pending.pop(transfer_id, None)
+        self._file = open(path, 'ab')
+        if not self.pending:
+            self._file.truncate(0)
+
+    def _write(self, record, sync):
+        self._file.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def commit(self, transfers):
+        """Durably log (transfer_id, sender, recipient, amount, description) tuples"""
+        if not transfers:
+            return
+        with self._lock:
+            self._write(['commit', transfers], sync=True)
+            for transfer_id, *transfer in transfers:
+                self.pending[transfer_id] = tuple(transfer)
+
+    def done(self, transfer_ids):
+        """Mark transfers as finished
+
+        Not synced: a lost mark only makes recovery resend a credit that
+        the recipient's shard then skips.
+        """
+        if not transfer_ids:
+            return
+        with self._lock:
+            for transfer_id in transfer_ids:
+                self.pending.pop(transfer_id, None)
+            if self.pending:
+                self._write(['done', transfer_ids], sync=False)
+            else:
+                self._file.truncate(0)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ShardedBank:
+    """Bank facade partitioning accounts across shard worker processes"""
+
+    def __init__(self, shards=None, data_dir=None):
+        shards = shards or os.cpu_count() or 1
+        directories = [None] * shards
+        self.decisions = None  # DecisionLog of a persistent bank
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            config_path = os.path.join(data_dir, CONFIG_NAME)
+            if os.path.exists(config_path):
+                with open(config_path) as f:
+                    stored = json.load(f)['shards']
+                if stored != shards:
+                    raise BankError(f"{data_dir} holds {stored} shards, not {shards}")
+            else:
+                with open(config_path, 'w') as f:
+                    json.dump({'shards': shards}, f)
+            directories = [os.path.join(data_dir, f"shard-{index}") for index in range(shards)]
+            self.decisions = DecisionLog(os.path.join(data_dir, DECISIONS_NAME))
+
+        # Spawned workers start clean instead of inheriting this process's threads
+        context = multiprocessing.get_context('spawn')
+        self.clients = []
+        for index, directory in enumerate(directories):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_serve, args=(index, shards, directory, child_conn),
+                                      name=f"shard-{index}", daemon=True)
+            process.start()
+            child_conn.close()
+            self.clients.append(_ShardClient(process, conn))
+        self.next_transfer_id = max(self._broadcast('next_transfer_id'))
+        self.transfer_lock = threading.Lock()  # Guards next_transfer_id and next_shard
+        self.next_shard = 0  # Shard receiving the next single new account
+        if self.decisions is not None:
+            self.recover()
+
+    @property
+    def shards(self):
+        return len(self.clients)
+
+    def shard_of(self, acc_num):
+        """Return the index of the shard owning an account number"""
+        if not isinstance(acc_num, str) or not ACCOUNT_PATTERN.match(acc_num):
+            raise BankError("Account not found")
+        return int(acc_num) % len(self.clients)
+
+    def _broadcast(self, operation, *args):
+        """Run an operation on every shard in parallel and return the results"""
+        futures = [client.submit(operation, *args) for client in self.clients]
+        return [future.result() for future in futures]
+
+    def _reserve_transfer_ids(self, count=1):
+        with self.transfer_lock:
+            first_id = self.next_transfer_id
+            self.next_transfer_id += count
+        return first_id
+
+    def _route(self, method, acc_num, *args):
+        return self.clients[self.shard_of(acc_num)].submit('call', method, (acc_num,) + args)
+
+    def __getattr__(self, method):
+        # Single-account operations: bank.deposit(acc_num, ...) and friends
+        if method not in ROUTED:
+            raise AttributeError(method)
+        return lambda acc_num, *args: self._route(method, acc_num, *args).result()
+
+    def account(self, acc_num):
+        """Return a copy of an account's record"""
+        return self.clients[self.shard_of(acc_num)].submit('account', acc_num).result()
+
+    def open_account(self, name, email, phone, deposit, pin):
+        """Open an account on the next shard in turn"""
+        with self.transfer_lock:
+            index = self.next_shard
+            self.next_shard = (index + 1) % len(self.clients)
+        return self.clients[index].submit('open_account', name, email, phone, deposit,
+                                          pin).result()
+
+    def open_accounts(self, applicants):
+        """Open accounts for applicants, spread evenly over the shards
+
+        Returns the same dict as Bank.open_accounts, in applicant order.
+        """
+        applicants = list(applicants)
+        if not applicants:
+            return {'opened': [], 'rejected': []}
+        size = -(-len(applicants) // len(self.clients))
+        chunks = [applicants[offset:offset + size] for offset in range(0, len(applicants), size)]
+        futures = [client.submit('open_accounts', chunk)
+                   for client, chunk in zip(self.clients, chunks)]
+        opened, rejected = [], []
+        for offset, future in zip(range(0, len(applicants), size), futures):
+            result = future.result()
+            opened += result['opened']
+            rejected += [(offset + index, reason) for index, reason in result['rejected']]
+        return {'opened': opened, 'rejected': rejected}
+
+    def transfer(self, sender, recipient, amount, description=''):
+        """Transfer funds between two accounts, on one shard or across two"""
+        if not isinstance(recipient, str) or not ACCOUNT_PATTERN.match(recipient):
+            raise BankError("Recipient account must be 10 digits")
+        first, second = self.shard_of(sender), self.shard_of(recipient)
+        if first == second:
+            return self.clients[first].submit('transfer', sender, recipient, amount, description,
+                                              self._reserve_transfer_ids()).result()
+        result = self.post_batch([(sender, recipient, amount, description)])
+        if result['rejected']:
+            raise BankError(result['rejected'][0][1])
+        return parse_amount(amount)
+
+    def recover(self):
+        """Finish the cross-shard transfers a previous run left pending
+
+        Every transfer in the decision log gets its credit if its debit is
+        posted or still held on the sender's shard; any other hold is
+        released. Runs when a persistent bank is opened.
+        """
+        n = len(self.clients)
+        pending = dict(self.decisions.pending)
+        if pending:
+            self.next_transfer_id = max(self.next_transfer_id, max(pending) + 1)
+        debits = [[] for _ in range(n)]
+        for transfer_id, (sender, recipient, _, description) in pending.items():
+            debits[self.shard_of(sender)].append((transfer_id, sender, recipient, description))
+        futures = [client.submit('recover', debits[i]) for i, client in enumerate(self.clients)]
+        credits = [[] for _ in range(n)]
+        for future in futures:
+            for transfer_id in future.result():
+                sender, recipient, amount, description = pending[transfer_id]
+                credits[self.shard_of(recipient)].append(
+                    (transfer_id, recipient, sender, amount, description))
+        futures = [client.submit('credit', credits[i], True)
+                   for i, client in enumerate(self.clients) if credits[i]]
+        for future in futures:
+            future.result()
+        self.decisions.done(list(pending))
+
+    def route(self, records):
+        """Split transfer records by shard for execute
+
+        Same-shard records go to their shard's post_batch; cross-shard ones
+        get the two-phase protocol. Records whose accounts or amount cannot
+        be routed are rejected here.
+        """
+        n = len(self.clients)
+        local = [[] for _ in range(n)]
+        local_index = [[] for _ in range(n)]  # Batch index of each local record
+        cross = []  # (index, sender shard, recipient shard, record)
+        rejected = []
+        for index, record in enumerate(records):
+            sender, recipient, amount, description = record
+            try:
+                first = self.shard_of(sender)
+            except BankError as e:
+                rejected.append((index, str(e)))
+                continue
+            try:
+                second = self.shard_of(recipient)
+            except BankError:
+                rejected.append((index, "Recipient account not found"))
+                continue
+            if first == second:
+                local[first].append(record)
+                local_index[first].append(index)
+                continue
+            try:
+                amount = parse_amount(amount)
+            except BankError as e:
+                rejected.append((index, str(e)))
+                continue
+            if amount <= 0:
+                rejected.append((index, "Amount must be positive"))
+                continue
+            cross.append((index, first, second, (sender, recipient, amount, description)))
+        return {'size': len(records), 'local': local, 'local_index': local_index,
+                'cross': cross, 'rejected': rejected}
+
+    def execute(self, plan):
+        """Apply a batch routed by route; returns the same dict as post_batch
+
+        Shard failures reject the transfers they leave unfinished, with the
+        shard's error as the reason (see the module docstring).
+        """
+        n = len(self.clients)
+        local, cross = plan['local'], plan['cross']
+        first_id = self._reserve_transfer_ids(sum(map(len, local)) + len(cross))
+        firsts = []
+        for records in local:
+            firsts.append(first_id)
+            first_id += len(records)
+        debits = [[] for _ in range(n)]
+        credits = [[] for _ in range(n)]
+        for transfer_id, (_, first, second, record) in enumerate(cross, first_id):
+            debits[first].append((transfer_id, record[0], record[2]))
+            credits[second].append((transfer_id, record[1]))
+
+        # Phase one: same-shard postings and votes, every shard in parallel
+        futures = [client.submit('prepare', local[i], firsts[i], debits[i], credits[i])
+                   for i, client in enumerate(self.clients)]
+        applied = 0
+        rejected = list(plan['rejected'])
+        refusals = {}  # Transfer id -> reason
+        held = set()  # Transfer ids whose debit was held
+        for i, future in enumerate(futures):
+            try:
+                result, debit_votes, credit_votes = future.result()
+            except Exception as e:
+                reason = self._shard_failed('prepare', i, [t for t, _, _ in debits[i]], e)
+                rejected += [(index, reason) for index in plan['local_index'][i]]
+                # Any hold it placed before failing is released with the aborts
+                held.update(transfer_id for transfer_id, _, _ in debits[i])
+                result = {'applied': 0, 'rejected': []}
+                debit_votes, credit_votes = [reason] * len(debits[i]), [reason] * len(credits[i])
+            applied += result['applied']
+            rejected += [(plan['local_index'][i][index], reason)
+                         for index, reason in result['rejected']]
+            for (transfer_id, _, _), vote in zip(debits[i], debit_votes):
+                if vote is None:
+                    held.add(transfer_id)
+                else:
+                    refusals[transfer_id] = vote
+            for (transfer_id, _), vote in zip(credits[i], credit_votes):
+                if vote is not None:
+                    refusals.setdefault(transfer_id, vote)
+
+        # Phase two: settle the debits of committed transfers, release the other holds
+        commits = [[] for _ in range(n)]
+        aborts = [[] for _ in range(n)]
+        decided = []
+        for transfer_id, (index, first, second, record) in enumerate(cross, first_id):
+            reason = refusals.get(transfer_id)
+            if reason is None:
+                commits[first].append((transfer_id, record[1], record[3]))
+                decided.append((transfer_id,) + record)
+            else:
+                rejected.append((index, reason))
+                if transfer_id in held:
+                    aborts[first].append(transfer_id)
+        if self.decisions is not None:
+            self.decisions.commit(decided)
+        futures = [(i, client.submit('commit', commits[i], aborts[i]))
+                   for i, client in enumerate(self.clients) if commits[i] or aborts[i]]
+        confirmed = set()
+        failed = {}  # Shard index -> why its transfers are unfinished
+        unfinished = set()  # Decided transfer ids left to recovery
+        for i, future in futures:
+            try:
+                confirmed.update(future.result())
+            except Exception as e:
+                self._shard_failed('commit', i, [t for t, _, _ in commits[i]] + aborts[i], e)
+                # Re-drive once: the commit may have settled some debits before failing
+                resolve = [(transfer_id, sender, recipient, description)
+                           for transfer_id, sender, recipient, _, description in decided
+                           if self.shard_of(sender) == i]
+                try:
+                    confirmed.update(self.clients[i].submit('resolve', resolve,
+                                                            aborts[i]).result())
+                except Exception as e:
+                    failed[i] = self._shard_failed('resolve', i, [t for t, *_ in resolve], e)
+                    unfinished.update(transfer_id for transfer_id, *_ in resolve)
+
+        # Phase three: credit only the transfers whose debit is durable
+        credits = [[] for _ in range(n)]
+        for transfer_id, (index, first, second, record) in enumerate(cross, first_id):
+            sender, recipient, amount, description = record
+            if transfer_id in confirmed:
+                credits[second].append((transfer_id, recipient, sender, amount, description))
+            elif transfer_id not in refusals:
+                rejected.append((index, failed.get(first, "Transfer could not be committed")))
+        futures = [(i, client.submit('credit', credits[i]))
+                   for i, client in enumerate(self.clients) if credits[i]]
+        for i, future in futures:
+            transfer_ids = [transfer_id for transfer_id, *_ in credits[i]]
+            try:
+                future.result()
+            except Exception as e:
+                self._shard_failed('credit', i, transfer_ids, e)
+                # Re-drive once, skipping the legs the failed request posted
+                try:
+                    self.clients[i].submit('credit', credits[i], True).result()
+                except Exception as e:
+                    reason = self._shard_failed('credit', i, transfer_ids, e)
+                    unfinished.update(transfer_ids)
+                    rejected += [(cross[transfer_id - first_id][0], reason)
+                                 for transfer_id in transfer_ids]
+                    continue
+            applied += len(transfer_ids)
+        if self.decisions is not None:
+            # Unfinished transfers stay pending, so reopening the bank finishes them
+            self.decisions.done([transfer_id for transfer_id, *_ in decided
+                                 if transfer_id not in unfinished])
+        rejected.sort()
+        return {'applied': applied, 'rejected': rejected}
+
+    def _shard_failed(self, phase, index, transfer_ids, error):
+        """Report a shard's failure during execute and return the rejection reason"""
+        print(f"Shard {index} failed to {phase} {len(transfer_ids)} transfers: {error!r}",
+              file=sys.stderr)
+        return f"Shard {index} failed: {error}"
+
+    def post_batch(self, records):
+        """Apply many transfers at once across the shards
+
+        records is an iterable of (sender, recipient, amount, description).
+        Each record is applied or rejected on its own, like
+        Bank.post_batch(atomic=False): same-shard records are checked
+        against running positions on their shard, then cross-shard ones
+        against what is left. Returns 'applied' and 'rejected' likewise.
+        """
+        return self.execute(self.route(records))
+
+    def counts(self):
+        """Return the number of accounts and transactions on each shard"""
+        return self._broadcast('counts')
+
+    def checkpoint(self):
+        """Snapshot every shard"""
+        self._broadcast('checkpoint')
+
+    def close(self):
+        """Flush and stop every shard process"""
+        if not self.clients:
+            return
+        self._broadcast('close')
+        for client in self.clients:
+            client.process.join()
+        self.clients = []
+        if self.decisions is not None:
+            self.decisions.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
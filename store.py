@@ -0,0 +1,380 @@
+"""Compact columnar storage for transaction histories.
+
+A history used to be a list of 5-tuples
+``(date_str, type_str, amount, description, balance)``, which costs a few
+hundred bytes per row. `TransactionStore` keeps the same rows in typed
+arrays instead:
+
+    dates     int64  days since 1970-01-01
+    types     uint8  index into TRANSACTION_TYPES
+    amounts   int64  cents
+    balances  int64  cents
+    parties   int64  counterparty account number of a transfer leg, or -1
+    links     uint64 transfer id shared by both legs of a transfer, or 0
+    descs     uint32 id in a shared, interned StringTable
+
+about 45 bytes per row. It behaves like the old list: rows are appended,
+iterated and sliced as 5-tuples, so the statement, analytics and GUI code
+read it unchanged; the transfer structure is read through `counterparty`
+and `transfer_id`.
+
+Postings arrive in date order, so the dates column is normally sorted and
+doubles as the time index: `between` finds a date range by bisecting it in
+O(log n). Histories imported out of date order get a sorted permutation of
+their rows instead, rebuilt lazily after rows are appended.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from functools import lru_cache
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+NO_COUNTERPARTY = -1  # parties value of rows that are not transfer legs
+
+# Transaction type names by uint8 code; unknown types are registered on use.
+# Codes are per process: snapshots save this table (see restore_types), and
+# journal records name their types, so replay registers them again.
+TRANSACTION_TYPES = ['Deposit', 'Withdrawal', 'Transfer', 'Interest']
+_type_codes = {name: code for code, name in enumerate(TRANSACTION_TYPES)}
+
+
+def type_code(t_type):
+    """Return the uint8 code of a transaction type, registering new types"""
+    code = _type_codes.get(t_type)
+    if code is None:
+        if len(TRANSACTION_TYPES) >= 256:
+            raise ValueError("Too many transaction types")
+        code = len(TRANSACTION_TYPES)
+        TRANSACTION_TYPES.append(t_type)
+        _type_codes[t_type] = code
+    return code
+
+
+def restore_types(names):
+    """Register a saved type table and return how to translate its codes
+
+    names is TRANSACTION_TYPES as saved with some type columns. Returns a
+    bytes.translate table from the saved codes to this process's, or None
+    when every saved code already means the same type here.
+    """
+    codes = [type_code(name) for name in names]
+    if codes == list(range(len(codes))):
+        return None
+    return bytes(codes) + bytes(range(len(codes), 256))
+
+
+@lru_cache(maxsize=None)
+def date_to_days(date_str):
+    """Convert a 'YYYY-MM-DD' string into days since the epoch"""
+    return date.fromisoformat(date_str).toordinal() - EPOCH_ORDINAL
+
+
+@lru_cache(maxsize=None)
+def days_to_date(days):
+    """Convert days since the epoch into a 'YYYY-MM-DD' string"""
+    return date.fromordinal(days + EPOCH_ORDINAL).isoformat()
+
+
+class StringTable:
+    """Interned strings addressed by a dense integer id"""
+
+    def __init__(self):
+        self.strings = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def intern(self, text):
+        """Return the id of text, adding it to the table if needed"""
+        string_id = self._ids.get(text)
+        if string_id is None:
+            # Only misses lock, so concurrent postings agree on new ids
+            with self._lock:
+                string_id = self._ids.get(text)
+                if string_id is None:
+                    string_id = len(self.strings)
+                    self.strings.append(text)
+                    self._ids[text] = string_id
+        return string_id
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getstate__(self):
+        # The reverse index is rebuilt on load instead of being pickled
+        return self.strings
+
+    def __setstate__(self, strings):
+        self.strings = strings
+        self._ids = {text: string_id for string_id, text in enumerate(strings)}
+        self._lock = threading.Lock()
+
+
+class TransactionStore:
+    """Append-only columnar transaction history with list-like access"""
+
+    __slots__ = ('dates', 'types', 'amounts', 'balances', 'parties', 'links', 'descs',
+                 'strings', 'in_date_order', '_date_order')
+
+    def __init__(self, strings=None, rows=()):
+        self.dates = array('q')
+        self.types = array('B')
+        self.amounts = array('q')
+        self.balances = array('q')
+        self.parties = array('q')
+        self.links = array('Q')
+        self.descs = array('I')
+        self.strings = strings if strings is not None else StringTable()
+        self.in_date_order = True  # Whether the dates column is sorted
+        self._date_order = None  # Row indices sorted by date, when it is not
+        self.extend(rows)
+
+    def append(self, transaction, counterparty=None, transfer_id=0):
+        """Append a (date, type, amount, description, balance) tuple
+
+        Transfer legs also pass the counterparty account number and the
+        transfer id linking them to the other leg.
+        """
+        date_str, t_type, amount, description, balance = transaction
+        self.append_row(date_to_days(date_str), type_code(t_type), amount, balance,
+                        self.strings.intern(description),
+                        NO_COUNTERPARTY if counterparty is None else int(counterparty),
+                        transfer_id)
+
+    def append_row(self, day, code, amount, balance, desc_id, party=NO_COUNTERPARTY, link=0):
+        """Append one row from already-encoded column values"""
+        if self.dates and day < self.dates[-1]:
+            self.in_date_order = False
+        self.dates.append(day)
+        self.types.append(code)
+        self.amounts.append(amount)
+        self.balances.append(balance)
+        self.parties.append(party)
+        self.links.append(link)
+        self.descs.append(desc_id)
+
+    def extend(self, transactions):
+        """Append several transaction tuples"""
+        for transaction in transactions:
+            self.append(transaction)
+
+    def extend_columns(self, day, code, amounts, balances, desc_ids, parties=None, links=None):
+        """Append rows sharing one date and type from per-column lists"""
+        count = len(amounts)
+        if self.dates and day < self.dates[-1]:
+            self.in_date_order = False
+        self.dates.extend(array('q', [day]) * count)
+        self.types.extend(array('B', [code]) * count)
+        self.amounts.fromlist(amounts)
+        self.balances.fromlist(balances)
+        if parties is None:
+            self.parties.extend(array('q', [NO_COUNTERPARTY]) * count)
+            self.links.extend(array('Q', [0]) * count)
+        else:
+            self.parties.fromlist(parties)
+            self.links.fromlist(links)
+        self.descs.fromlist(desc_ids)
+
+    def extend_buffers(self, dates, types, amounts, balances, descs, parties, links):
+        """Append rows from raw column buffers, e.g. slices of NumPy arrays
+
+        Each argument is a bytes-like object of the column's machine type
+        (int64 dates, uint8 types, ...); the rows must be in date order.
+        """
+        first = len(self.dates)
+        self.dates.frombytes(dates)
+        if 0 < first < len(self.dates) and self.dates[first] < self.dates[first - 1]:
+            self.in_date_order = False
+        self.types.frombytes(types)
+        self.amounts.frombytes(amounts)
+        self.balances.frombytes(balances)
+        self.parties.frombytes(parties)
+        self.links.frombytes(links)
+        self.descs.frombytes(descs)
+
+    def counterparty(self, index):
+        """Return the counterparty account number of a row, or None"""
+        party = self.parties[index]
+        return None if party == NO_COUNTERPARTY else f"{party:010d}"
+
+    def transfer_id(self, index):
+        """Return the id of the transfer a row is a leg of, or None"""
+        return self.links[index] or None
+
+    def date_order(self):
+        """Return the row indices sorted by date, or None if rows already are"""
+        if self.in_date_order:
+            return None
+        order = self._date_order
+        if order is None or len(order) != len(self.dates):
+            # Stable sort, so rows of one date stay in posting order
+            order = array('Q', sorted(range(len(self.dates)), key=self.dates.__getitem__))
+            self._date_order = order
+        return order
+
+    def between(self, start_day=None, end_day=None, before=None):
+        """Return the rows dated start_day..end_day (inclusive) in date order
+
+        Either bound may be None. before is an optional (day, row) key; only
+        rows that sort before it are included, which is how statement
+        cursors page backwards. Takes O(log n).
+        """
+        dates = self.dates
+        order = self.date_order()
+        if order is None:
+            lo = 0 if start_day is None else bisect_left(dates, start_day)
+            hi = len(dates) if end_day is None else bisect_right(dates, end_day)
+            if before is not None:
+                hi = min(hi, before[1])
+        else:
+            key = dates.__getitem__
+            lo = 0 if start_day is None else bisect_left(order, start_day, key=key)
+            hi = len(order) if end_day is None else bisect_right(order, end_day, key=key)
+            if before is not None:
+                hi = min(hi, bisect_left(order, tuple(before), key=lambda i: (dates[i], i)))
+        return HistoryRange(self, order, lo, max(lo, hi))
+
+    def subset(self, rows, start_day=None, end_day=None):
+        """Return the given ascending row indices dated start_day..end_day, in date order"""
+        dates = self.dates
+        if not self.in_date_order:
+            rows = array('Q', sorted(rows, key=lambda i: (dates[i], i)))
+        key = dates.__getitem__
+        lo = 0 if start_day is None else bisect_left(rows, start_day, key=key)
+        hi = len(rows) if end_day is None else bisect_right(rows, end_day, key=key)
+        return HistoryRange(self, rows, lo, max(lo, hi))
+
+    def row(self, index):
+        """Materialize the transaction tuple at a non-negative index"""
+        return (
+            days_to_date(self.dates[index]),
+            TRANSACTION_TYPES[self.types[index]],
+            self.amounts[index],
+            self.strings.strings[self.descs[index]],
+            self.balances[index]
+        )
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(len(self.dates)))]
+        if index < 0:
+            index += len(self.dates)
+        if not 0 <= index < len(self.dates):
+            raise IndexError("transaction index out of range")
+        return self.row(index)
+
+    def __iter__(self):
+        # Walk the columns together; descs is appended last, so a row being
+        # appended concurrently is never yielded half-written
+        strings = self.strings.strings
+        for day, code, amount, balance, desc_id in zip(self.dates, self.types, self.amounts,
+                                                        self.balances, self.descs):
+            yield (days_to_date(day), TRANSACTION_TYPES[code], amount, strings[desc_id], balance)
+
+    def __reversed__(self):
+        for i in range(len(self.dates) - 1, -1, -1):
+            yield self.row(i)
+
+    def __eq__(self, other):
+        if isinstance(other, TransactionStore):
+            return (self.dates == other.dates and self.types == other.types
+                    and self.amounts == other.amounts
+                    and self.balances == other.balances
+                    and self.parties == other.parties and self.links == other.links
+                    and list(self) == list(other))
+        try:
+            return len(self) == len(other) and all(a == tuple(b) for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"TransactionStore({len(self)} transactions)"
+
+    def remap_types(self, table):
+        """Translate the type codes with a table from restore_types"""
+        self.types = array('B', self.types.tobytes().translate(table))
+
+    @property
+    def nbytes(self):
+        """Bytes used by the column buffers"""
+        return sum(column.itemsize * len(column) for column in
+                   (self.dates, self.types, self.amounts, self.balances, self.parties,
+                    self.links, self.descs))
+
+    def __getstate__(self):
+        return (self.dates, self.types, self.amounts, self.balances, self.descs, self.strings,
+                self.in_date_order, self.parties, self.links)
+
+    def __setstate__(self, state):
+        (self.dates, self.types, self.amounts, self.balances, self.descs,
+         self.strings) = state[:6]
+        if len(state) > 6:
+            self.in_date_order = state[6]
+        else:
+            dates = self.dates
+            self.in_date_order = all(a <= b for a, b in zip(dates, dates[1:]))
+        if len(state) > 7:
+            self.parties, self.links = state[7:9]
+        else:
+            # Snapshots from before structured transfers
+            self.parties = array('q', [NO_COUNTERPARTY]) * len(self.dates)
+            self.links = array('Q', [0]) * len(self.dates)
+        self._date_order = None
+
+
+class HistoryRange:
+    """Read-only window of a TransactionStore's rows in date order"""
+
+    __slots__ = ('store', 'order', 'lo', 'hi')
+
+    def __init__(self, store, order, lo, hi):
+        self.store = store
+        self.order = order  # Row indices in date order, or None for row order
+        self.lo = lo
+        self.hi = hi
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def row_index(self, index):
+        """Return the store row index of the index-th row of the range"""
+        position = self.lo + index
+        return position if self.order is None else self.order[position]
+
+    def counterparty(self, index):
+        """Return the counterparty account of the index-th row, or None"""
+        return self.store.counterparty(self.row_index(index))
+
+    def transfer_id(self, index):
+        """Return the transfer id of the index-th row, or None"""
+        return self.store.transfer_id(self.row_index(index))
+
+    def key(self, index):
+        """Return the (day, row) sort key of the index-th row of the range"""
+        row = self.row_index(index)
+        return self.store.dates[row], row
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.row(self.row_index(i)) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self.store.row(self.row_index(index))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.store.row(self.row_index(i))
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self.store.row(self.row_index(i))
+
+    def __repr__(self):
+        return f"HistoryRange({len(self)} transactions)"
@@ -0,0 +1,475 @@
+"""Invariants of concurrent posting, journal recovery and cross-shard transfers.
+
+Run with ``python -m pytest -q`` from the repository root. The timings of
+the same workloads are in ``python bench.py stress``, ``batch`` and ``shards``.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from banking import Bank, BankError
+from ledger import Ledger
+from migrate import import_bank
+from pins import BULK_PIN_ITERATIONS
+from shards import DECISIONS_NAME, DecisionLog, Shard, ShardedBank
+
+APPLICANT = ('Test Holder', 'test@example.com', '5550000000', '1000', '1234')
+
+
+def open_bank(accounts=20, bank=None):
+    bank = bank if bank is not None else Bank()
+    return bank, bank.open_accounts([APPLICANT] * accounts)['opened']
+
+
+class FailingClient:
+    """Shard client whose next requests of one operation fail
+
+    With run, each request still reaches the shard and only its reply is
+    lost, so the shard may have applied it.
+    """
+
+    def __init__(self, client, operation, times=1, run=True):
+        self.client = client
+        self.operation = operation
+        self.times = times
+        self.run = run
+
+    def submit(self, operation, *args):
+        if operation != self.operation or not self.times:
+            return self.client.submit(operation, *args)
+        self.times -= 1
+        if self.run:
+            self.client.submit(operation, *args).result()
+        future = Future()
+        future.set_exception(RuntimeError("Injected failure"))
+        return future
+
+
+def total(bank, numbers):
+    return sum(bank.balance(acc_num) for acc_num in numbers)
+
+
+def assert_transfers_whole(bank, numbers):
+    """Every transfer has both legs, so only other postings add up to the total"""
+    legs = {}  # Transfer id -> amounts of its legs
+    outside = 0
+    for acc_num in numbers:
+        history = bank.transactions[acc_num]
+        for amount, link in zip(history.amounts, history.links):
+            if link:
+                legs.setdefault(link, []).append(amount)
+            else:
+                outside += amount
+    assert total(bank, numbers) == outside
+    assert all(len(amounts) == 2 and sum(amounts) == 0 for amounts in legs.values())
+
+
+def assert_consistent(bank, numbers, rows_non_negative=True):
+    """Every history is an unbroken running balance ending at a non-negative balance
+
+    An atomic batch only checks each account's net position, so its rows
+    may dip below zero on the way; pass rows_non_negative=False for those.
+    """
+    for acc_num in numbers:
+        balance = 0
+        for _, _, amount, _, row_balance in bank.history(acc_num):
+            balance += amount
+            assert balance == row_balance, f"torn history for {acc_num}"
+            assert balance >= 0 or not rows_non_negative, f"{acc_num} went negative"
+        assert balance == bank.balance(acc_num) >= 0
+    bank.verify_analytics()
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_transfers_conserve_money():
+    bank, numbers = open_bank()
+    before = total(bank, numbers)
+
+    def worker(index):
+        rng = random.Random(index)
+        for _ in range(3000):
+            sender, recipient = rng.sample(numbers, 2)
+            try:
+                bank.transfer(sender, recipient, rng.randint(1, 20000))
+            except BankError as e:
+                assert str(e) == "Insufficient funds"
+
+    run_threads(8, worker)
+    assert total(bank, numbers) == before
+    assert_consistent(bank, numbers)
+
+
+def test_concurrent_batches_and_withdrawals_never_overdraw():
+    bank, numbers = open_bank()
+    before = total(bank, numbers)
+
+    def worker(index):
+        rng = random.Random(index)
+        for _ in range(200):
+            if index % 3 == 2:
+                try:
+                    bank.withdraw(rng.choice(numbers), rng.randint(1, 5000))
+                except BankError as e:
+                    assert str(e) == "Insufficient funds"
+                continue
+            records = [tuple(rng.sample(numbers, 2)) + (rng.randint(1, 30000), 'Batch')
+                       for _ in range(20)]
+            bank.post_batch(records, atomic=index % 3 == 0)
+
+    run_threads(6, worker)
+    withdrawals = sum(-row[2] for acc_num in numbers for row in bank.history(acc_num)
+                      if row[1] == 'Withdrawal')
+    assert total(bank, numbers) == before - withdrawals
+    assert_consistent(bank, numbers, rows_non_negative=False)
+
+
+def test_atomic_batch_applies_all_or_nothing():
+    bank, (a, b, c) = open_bank(3)
+    lengths = [len(bank.history(acc_num)) for acc_num in (a, b, c)]
+    result = bank.post_batch([(a, b, 60000, 'ok'), (b, c, 50000, 'ok'), (a, c, 50000, 'too much')])
+    assert result['applied'] == 0
+    assert result['rejected'] == [(0, "Insufficient funds"), (2, "Insufficient funds")]
+    assert [bank.balance(acc_num) for acc_num in (a, b, c)] == [100000] * 3
+    assert [len(bank.history(acc_num)) for acc_num in (a, b, c)] == lengths
+
+    # An invalid record rejects the batch before any funds are checked
+    result = bank.post_batch([(a, b, 100, 'ok'), (a, '0000000000', 100, 'nobody')])
+    assert result == {'applied': 0, 'rejected': [(1, "Recipient account not found")]}
+    assert bank.balance(a) == 100000
+
+
+def test_non_atomic_batch_reports_each_senders_balance():
+    bank, (a, b) = open_bank(2)
+    result = bank.post_batch([(a, b, 30000, ''), (a, b, 80000, ''), (b, a, 5000, ''),
+                              (a, b, 1000, '')], atomic=False)
+    assert result['applied'] == 3
+    assert result['rejected'] == [(1, "Insufficient funds")]
+    assert result['balances'] == [70000, 125000, 74000]
+    assert bank.balance(a) == 74000
+
+
+def test_recovery_discards_a_torn_journal_record(tmp_path):
+    bank, numbers = open_bank(5, Bank.open(str(tmp_path), sync_interval=0))
+    rng = random.Random(1)
+    for _ in range(200):
+        sender, recipient = rng.sample(numbers, 2)
+        try:
+            bank.transfer(sender, recipient, rng.randint(1, 20000))
+        except BankError:
+            pass
+    balances = {acc_num: bank.balance(acc_num) for acc_num in numbers}
+    bank.close()
+
+    path = max(tmp_path.glob('journal.*.log'))
+    size = path.stat().st_size
+    with open(path, 'ab') as f:
+        f.write(b'["post","%s",["2024' % numbers[0].encode())  # Crash mid-write
+
+    bank = Bank.open(str(tmp_path), sync_interval=0)
+    assert {acc_num: bank.balance(acc_num) for acc_num in numbers} == balances
+    assert path.stat().st_size == size
+    assert_consistent(bank, numbers)
+    bank.transfer(numbers[0], numbers[1], 1)
+    bank.close()
+
+    bank = Bank.open(str(tmp_path), sync_interval=0)
+    assert bank.balance(numbers[0]) == balances[numbers[0]] - 1
+    bank.close()
+
+
+def open_crashable(directory, **ledger_options):
+    """Open a persistent bank for a test that abandons it to simulate a crash"""
+    bank = Bank(Ledger(directory, sync_interval=0, **ledger_options))
+    # No weak PINs to strengthen, so no background checkpoint outlives the crash
+    bank.pin_iterations = BULK_PIN_ITERATIONS
+    bank.ledger.recover(bank)
+    return bank
+
+
+def test_a_crash_between_group_commits_keeps_transfers_whole(tmp_path):
+    bank, (a, b) = open_bank(2, open_crashable(str(tmp_path), sync_every=2))
+    bank.ledger.commit()
+    bank.deposit(a, 100)  # Leaves one record waiting, so a transfer's legs would straddle a commit
+    bank.transfer(a, b, 500)
+    # Crash: records still buffered are lost with the process
+
+    bank = open_crashable(str(tmp_path), sync_every=2)
+    assert_transfers_whole(bank, (a, b))
+    assert_consistent(bank, (a, b))
+    bank.close()
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_random_crashes_conserve_money(tmp_path, seed):
+    rng = random.Random(seed)
+    options = {'sync_every': 3, 'snapshot_every': 40}
+    bank, numbers = open_bank(6, open_crashable(str(tmp_path), **options))
+    for _ in range(4):
+        for _ in range(rng.randint(1, 60)):
+            a, b = rng.sample(numbers, 2)
+            choice = rng.random()
+            try:
+                if choice < 0.2:
+                    bank.deposit(a, rng.randint(1, 5000))
+                elif choice < 0.35:
+                    bank.withdraw(a, rng.randint(1, 5000))
+                elif choice < 0.7:
+                    bank.transfer(a, b, rng.randint(1, 20000))
+                else:
+                    records = [tuple(rng.sample(numbers, 2)) + (rng.randint(1, 20000), 'Batch')
+                               for _ in range(rng.randint(1, 5))]
+                    bank.post_batch(records, atomic=rng.random() < 0.5)
+            except BankError:
+                pass
+        if rng.random() < 0.5:
+            # Crash mid-write: the journal ends anywhere, even inside a record
+            bank.close()
+            path = max(tmp_path.glob('journal.*.log'))
+            with open(path, 'r+b') as f:
+                f.truncate(rng.randint(0, path.stat().st_size))
+        # Otherwise crash between group commits: buffered records are lost
+        bank = open_crashable(str(tmp_path), **options)
+        assert_transfers_whole(bank, numbers)
+        assert_consistent(bank, numbers, rows_non_negative=False)
+    bank.close()
+
+
+def test_recovery_from_snapshot_and_journal(tmp_path):
+    def open_persistent():
+        bank = Bank(Ledger(str(tmp_path), sync_interval=0, snapshot_every=20))
+        bank.ledger.recover(bank)
+        return bank
+
+    bank, numbers = open_bank(5, open_persistent())
+    rng = random.Random(2)
+    for _ in range(20):
+        records = [tuple(rng.sample(numbers, 2)) + (rng.randint(1, 20000), 'Batch')
+                   for _ in range(10)]
+        bank.post_batch(records, atomic=False)
+        bank.transfer(*rng.sample(numbers, 2), 1)
+    assert os.path.exists(tmp_path / Ledger.SNAPSHOT_NAME)
+    expected = {acc_num: list(bank.history(acc_num)) for acc_num in numbers}
+    next_id = bank.next_transfer_id
+    bank.close()
+
+    bank = open_persistent()
+    assert {acc_num: list(bank.history(acc_num)) for acc_num in numbers} == expected
+    assert bank.next_transfer_id == next_id
+    bank.close()
+
+
+def test_imported_custom_types_survive_a_restart(tmp_path):
+    accounts = tmp_path / 'accounts.csv'
+    accounts.write_text('acc_num,name,email,phone,balance,pin,created_at,account_type,status\n'
+                        '1111111111,Fee Payer,fee@example.com,5550000000,9500,x,2024-01-01,'
+                        'Savings,Active\n')
+    transactions = tmp_path / 'transactions.csv'
+    transactions.write_text('acc_num,date,type,amount,description,balance,counterparty,'
+                            'transfer_id\n'
+                            '1111111111,2024-01-01,Deposit,10000,Opening,10000,,\n'
+                            '1111111111,2024-01-02,Overdraft Fee,-500,Monthly fee,9500,,\n')
+    data_dir = tmp_path / 'bank'
+    bank = Bank.open(str(data_dir))
+    import_bank(bank, str(accounts), str(transactions))
+    bank.deposit('1111111111', 100, 'After the snapshot')
+    expected = [list(row) for row in bank.history('1111111111')]
+    bank.close()
+
+    # A fresh process whose type codes differ: it registered another type first
+    script = ("import json, sys, store; store.type_code('Decoy'); from banking import Bank; "
+              "bank = Bank.open(sys.argv[1]); "
+              "print(json.dumps(list(bank.history('1111111111')))); bank.close()")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', script, str(data_dir)], cwd=root,
+                            capture_output=True, text=True, check=True).stdout
+    assert json.loads(output) == expected
+
+
+def test_custom_types_survive_snapshots_of_other_processes(tmp_path):
+    data_dir = str(tmp_path)
+    bank, (a,) = open_bank(1, Bank.open(data_dir))
+    bank.post(a, 'Wire Fee', -250, 'Before the snapshot')
+    bank.checkpoint()
+    bank.post(a, 'Wire Fee', -250, 'After the snapshot')
+    bank.post(a, 'Card Fee', -100, 'After the snapshot')
+    expected = [list(row) for row in bank.history(a)]
+    bank.close()
+
+    # Each process registers other types first, so its codes differ, then
+    # posts and snapshots again for the next one to recover from
+    script = ("import json, sys, store\n"
+              "for name in sys.argv[3:]: store.type_code(name)\n"
+              "from banking import Bank\n"
+              "bank = Bank.open(sys.argv[1])\n"
+              "before = list(bank.history(sys.argv[2]))\n"
+              "bank.post(sys.argv[2], 'Card Fee', -100, 'Later')\n"
+              "bank.checkpoint()\n"
+              "print(json.dumps([before, list(bank.history(sys.argv[2]))]))\n"
+              "bank.close()")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for decoys in (['Decoy'], ['Card Fee', 'Other', 'Wire Fee']):
+        output = subprocess.run([sys.executable, '-c', script, data_dir, a, *decoys], cwd=root,
+                                capture_output=True, text=True, check=True).stdout
+        before, after = json.loads(output)
+        assert before == expected
+        assert after[:-1] == expected
+        assert after[-1][1:] == ['Card Fee', -100, 'Later', expected[-1][4] - 100]
+        expected = after
+
+
+def test_holds_survive_a_restart(tmp_path):
+    bank, (a, b) = open_bank(2, Bank.open(str(tmp_path)))
+    bank.hold(a, 60000, 100)
+    with pytest.raises(BankError, match="Insufficient funds"):
+        bank.withdraw(a, 50000)
+    bank.close()
+
+    bank = Bank.open(str(tmp_path))
+    assert bank.held == {100: (a, 60000)}
+    with pytest.raises(BankError, match="Insufficient funds"):
+        bank.transfer(a, b, 50000)
+    bank.settle(100, b, 'Held')
+    assert bank.balance(a) == 40000 and not bank.holds
+    bank.checkpoint()
+    bank.close()
+
+    bank = Bank.open(str(tmp_path))
+    assert bank.held == {} and bank.balance(a) == 40000
+    assert bank.next_transfer_id > 100
+    bank.close()
+
+
+def test_bulk_pin_hashes_are_strengthened_on_disk(tmp_path):
+    bank = Bank.open(str(tmp_path))
+    bank.pin_iterations = 1000
+    bank, numbers = open_bank(40, bank)
+    # Background jobs run in order, so this one finishes after the last chunk
+    bank.pin_verifier.background(lambda: None).result()
+    assert all(bank.accounts[acc_num]['pin'].startswith('pbkdf2_sha256$1+1000$')
+               for acc_num in numbers)
+    assert bank.authenticate(numbers[0], '1234') == numbers[0]
+    bank.close()
+
+    for name in os.listdir(tmp_path):
+        with open(os.path.join(tmp_path, name), 'rb') as f:
+            assert b'pbkdf2_sha256$1$' not in f.read(), name
+    bank = Bank.open(str(tmp_path))
+    assert bank.authenticate(numbers[-1], '1234') == numbers[-1]
+    with pytest.raises(BankError, match="Invalid PIN"):
+        bank.authenticate(numbers[-1], '4321')
+    bank.close()
+
+
+def test_cross_shard_transfers_conserve_money():
+    rng = random.Random(3)
+    with ShardedBank(3) as bank:
+        numbers = bank.open_accounts([APPLICANT] * 30)['opened']
+        before = sum(bank.balance(acc_num) for acc_num in numbers)
+        records = [tuple(rng.sample(numbers, 2)) + (rng.randint(1, 40000), 'Sharded')
+                   for _ in range(3000)]
+        result = bank.post_batch(records)
+        assert result['applied'] + len(result['rejected']) == len(records)
+        assert {reason for _, reason in result['rejected']} <= {"Insufficient funds"}
+        assert sum(bank.balance(acc_num) for acc_num in numbers) == before
+
+        legs = {}  # Transfer id -> amounts of its legs
+        for acc_num in numbers:
+            history = bank.search(acc_num, '', None, None)
+            balance = 0
+            for index, row in enumerate(history):
+                balance += row[2]
+                assert balance >= 0
+                if row[1] == 'Transfer':
+                    legs.setdefault(history.transfer_id(index), []).append(row[2])
+        assert len(legs) == result['applied']
+        assert all(len(amounts) == 2 and sum(amounts) == 0 for amounts in legs.values())
+
+
+def test_failed_shard_replies_are_redriven(tmp_path, capsys):
+    with ShardedBank(2, str(tmp_path)) as bank:
+        numbers = bank.open_accounts([APPLICANT] * 4)['opened']
+        a = next(acc_num for acc_num in numbers if bank.shard_of(acc_num) == 0)
+        b = next(acc_num for acc_num in numbers if bank.shard_of(acc_num) == 1)
+        clients = list(bank.clients)
+        bank.clients[0] = FailingClient(clients[0], 'commit')
+        bank.clients[1] = FailingClient(clients[1], 'credit')
+        result = bank.post_batch([(a, b, 1000, 'Retried')] * 3)
+        assert result == {'applied': 3, 'rejected': []}
+        assert bank.balance(a) == 97000 and bank.balance(b) == 103000
+        assert len(bank.search(b, 'Retried', None, None)) == 3
+        assert bank.decisions.pending == {}
+
+        # A credit that keeps failing is rejected and left to recovery
+        bank.clients[1] = FailingClient(clients[1], 'credit', times=2, run=False)
+        result = bank.post_batch([(a, b, 5000, 'Recovered')])
+        assert result == {'applied': 0, 'rejected': [(0, "Shard 1 failed: Injected failure")]}
+        assert bank.balance(a) == 92000 and bank.balance(b) == 103000
+        bank.clients[:] = clients
+    assert "Shard 1 failed to credit 1 transfers" in capsys.readouterr().err
+
+    with ShardedBank(2, str(tmp_path)) as bank:
+        assert bank.balance(a) == 92000 and bank.balance(b) == 108000
+    assert os.path.getsize(os.path.join(tmp_path, DECISIONS_NAME)) == 0
+
+
+def test_credit_needs_a_confirmed_debit():
+    sender = Shard(0, 2)
+    recipient_shard = Shard(1, 2)
+    a = sender.open_accounts([APPLICANT])['opened'][0]
+    b = recipient_shard.open_accounts([APPLICANT])['opened'][0]
+    _, debit_votes, _ = sender.prepare([], 0, [(7, a, 50000)], [])
+    assert debit_votes == [None]
+
+    # A transfer whose hold is gone, e.g. lost in a restart, is not confirmed
+    assert sender.commit([(8, b, 'Lost')], []) == []
+    assert sender.commit([(7, b, 'Kept')], []) == [7]
+    assert sender.commit([(7, b, 'Kept')], []) == []  # A repeated commit posts nothing
+    assert sender.bank.balance(a) == 50000
+
+    recipient_shard.credit([(7, b, a, 50000, 'Kept')])
+    recipient_shard.credit([(7, b, a, 50000, 'Kept')], check=True)
+    assert recipient_shard.bank.balance(b) == 150000
+
+
+def test_reopening_finishes_or_drops_pending_transfers(tmp_path):
+    data_dir = str(tmp_path)
+    with ShardedBank(2, data_dir) as bank:
+        numbers = bank.open_accounts([APPLICANT] * 4)['opened']
+        a = next(acc_num for acc_num in numbers if bank.shard_of(acc_num) == 0)
+        b = next(acc_num for acc_num in numbers if bank.shard_of(acc_num) == 1)
+        first = bank._reserve_transfer_ids(4)
+
+    # A coordinator crash after logging four commits: the first debit was
+    # settled, the second and third are still held, and the fourth's hold
+    # was lost. A fifth hold was never decided.
+    shard = Shard(0, 2, os.path.join(data_dir, 'shard-0'))
+    shard.prepare([], 0, [(first, a, 1000), (first + 1, a, 2000), (first + 2, a, 3000),
+                          (first + 4, a, 4000)], [])
+    decisions = DecisionLog(os.path.join(data_dir, DECISIONS_NAME))
+    decisions.commit([(first + n, a, b, amount, 'Pending')
+                      for n, amount in ((0, 1000), (1, 2000), (2, 3000), (3, 5000))])
+    assert shard.commit([(first, b, 'Pending')], []) == [first]
+    shard.close()
+    decisions.close()
+
+    for _ in range(2):  # Recovery is idempotent
+        with ShardedBank(2, data_dir) as bank:
+            assert bank.balance(a) == 100000 - 6000
+            assert bank.balance(b) == 100000 + 6000
+            assert bank.next_transfer_id > first + 4
+            with pytest.raises(BankError, match="Insufficient funds"):
+                bank.transfer(a, b, 94001)
+    assert os.path.getsize(os.path.join(data_dir, DECISIONS_NAME)) == 0
@@ -0,0 +1,320 @@
+"""Seeded synthetic workloads for load testing.
+
+`populate` fills a bank with any number of generated accounts and months of
+realistic-looking history:
+
+    salary     one deposit a month on each account's payday, lognormally
+               distributed around $3,500
+    ATM        a Poisson number of cash withdrawals a month in round
+               amounts, at a rate that differs from account to account
+    rent       most accounts pay a fixed monthly rent to a landlord picked
+               from a small set of hot accounts
+    transfers  person-to-person payments of lognormal size; a share of them
+               go to the hot accounts, weighted by a Zipf law, so the
+               transfer graph has a few very busy nodes
+
+Every event is drawn up front with one seeded NumPy generator and the
+histories are built directly as columns. The rows are sorted into posting
+order per account, running balances come from a cumulative sum, and debits
+that would overdraw an account bounce (a bounced transfer loses both legs)
+until no balance goes negative. The finished columns are handed to
+`Bank.load_histories` in one go, so nothing is posted row by row. A year of
+history for 50,000 accounts is about ten million transactions.
+
+The same arguments always produce the same transactions, while account
+numbers come from the bank's allocator. A generated account's PIN is the
+last four digits of its account number, stored with the bulk onboarding
+hash cost and strengthened in the background when the bank is persistent
+(see Bank.strengthen_pins).
+
+Unlike the engine's vectorized paths, this module requires NumPy: a pure
+Python generator would be far too slow for production-sized data.
+
+Run ``python workload.py --help`` for the command line, which writes the
+generated bank to a ledger directory or to migration files (see migrate.py).
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:  # Required at generation time only
+    np = None
+
+from analytics import RECENT_DATES, AccountStats
+from banking import Bank, BankError, banking_module, gc_paused
+from migrate import export_bank
+from pins import BULK_PIN_ITERATIONS, SALT_BYTES, hash_pin
+from store import NO_COUNTERPARTY, TRANSACTION_TYPES, TransactionStore, date_to_days, \
+    days_to_date, type_code
+
+SALARY_MEDIAN = 350000  # Cents a month
+SALARY_SIGMA = 0.45
+ATM_PER_MONTH = 4.0  # Mean withdrawals per account and month
+ATM_AMOUNTS = (2000, 4000, 6000, 8000, 10000, 20000)
+ATM_WEIGHTS = (0.15, 0.25, 0.15, 0.10, 0.25, 0.10)
+RENT_SHARE = 0.6  # Accounts paying rent to a hot account
+RENT_RATIO = 0.3  # Rent as a share of salary
+TRANSFER_MEDIAN = 4000  # Cents
+TRANSFER_SIGMA = 1.0
+TRANSFER_MAX = 500000
+TRANSFERS_PER_MONTH = 6.0  # Mean payments sent per account and month
+HOT_FRACTION = 0.01  # Share of accounts that are hot
+HOT_SHARE = 0.3  # Share of payments sent to hot accounts
+ROWS_PER_ACCOUNT_MONTH = 18  # About what the defaults produce
+
+P2P_MEMOS = ('Dinner', 'Gift', 'Groceries', 'Tickets', 'Loan repayment')
+HOT_MEMOS = ('Invoice', 'Subscription', 'Order')
+MEMOS = P2P_MEMOS + HOT_MEMOS + ('Rent',)
+RENT_MEMO = len(MEMOS) - 1
+
+FIRST_NAMES = ('Alex', 'Maria', 'James', 'Priya', 'Chen', 'Fatima', 'John', 'Sofia',
+               'David', 'Aisha', 'Lucas', 'Emma', 'Omar', 'Grace', 'Mateo', 'Yuki')
+LAST_NAMES = ('Smith', 'Garcia', 'Patel', 'Nguyen', 'Kim', 'Okafor', 'Müller', 'Rossi',
+              'Johnson', 'Silva', 'Cohen', 'Ivanova', 'Brown', 'Haddad', 'Tanaka', 'Lee')
+
+
+def month_starts(start, months):
+    """Return the epoch days of the first of start's month and the months after it"""
+    first = date.fromisoformat(start)
+    days = []
+    for i in range(months + 1):
+        year, month = divmod(first.month - 1 + i, 12)
+        days.append(date_to_days(date(first.year + year, month + 1, 1).isoformat()))
+    return days
+
+
+def _dollars(cents):
+    """Round float cents to whole dollars, as int64 cents"""
+    return np.rint(cents / 100).astype(np.int64) * 100
+
+
+def populate(bank, accounts=1000, months=12, start='2024-01-01', seed=42,
+             transfers_per_month=TRANSFERS_PER_MONTH, hot_fraction=HOT_FRACTION,
+             hot_share=HOT_SHARE):
+    """Add accounts with months of generated history to bank
+
+    Histories start on the first of start's month with the opening
+    deposit. Returns a summary dict with the number of accounts,
+    transactions and transfers loaded and of debits that bounced.
+    """
+    if np is None:
+        raise ImportError("Workload generation requires NumPy")
+    if accounts < 2 or months < 1:
+        raise BankError("A workload needs at least two accounts and one month")
+    try:
+        bounds = np.array(month_starts(start, months), dtype=np.int64)
+    except ValueError:
+        raise BankError("Dates must be YYYY-MM-DD") from None
+    rng = np.random.default_rng(seed)
+    n = accounts
+    first_day, end_day = int(bounds[0]), int(bounds[-1])
+    month_of = np.repeat(np.arange(months), n)  # Month of each account-month
+
+    # Per-account habits
+    salary = _dollars(rng.lognormal(np.log(SALARY_MEDIAN), SALARY_SIGMA, n))
+    payday = rng.integers(0, 28, n)
+    opening = _dollars(salary * rng.uniform(0.5, 2.0, n))
+    atm_rate = rng.gamma(2.0, ATM_PER_MONTH / 2, n)
+    hot = rng.choice(n, max(1, int(n * hot_fraction)), replace=False)
+    zipf = 1.0 / np.arange(1, len(hot) + 1)
+    zipf /= zipf.sum()
+    is_hot = np.zeros(n, dtype=bool)
+    is_hot[hot] = True
+
+    # Single-account events: the opening deposit, salaries and ATM withdrawals
+    account_months = np.tile(np.arange(n), months)
+    atm_counts = rng.poisson(np.tile(atm_rate, months))
+    atm_acc = np.repeat(account_months, atm_counts)
+    atm_month = np.repeat(month_of, atm_counts)
+    atm_day = bounds[atm_month] + (rng.random(len(atm_acc)) * np.diff(bounds)[atm_month]).astype(np.int64)
+    atm_amount = -np.asarray(ATM_AMOUNTS)[rng.choice(len(ATM_AMOUNTS), len(atm_acc), p=ATM_WEIGHTS)]
+    single_acc = np.concatenate([np.arange(n), account_months, atm_acc])
+    single_day = np.concatenate([np.full(n, first_day), bounds[month_of] + payday[account_months],
+                                 atm_day])
+    single_amount = np.concatenate([opening, salary[account_months], atm_amount])
+    descs = [bank.descriptions.intern(text)
+             for text in ('Initial Deposit', 'Salary', 'ATM Withdrawal')]
+    kinds = np.repeat(np.arange(3, dtype=np.int8), [n, n * months, len(atm_acc)])
+    single_desc = np.asarray(descs, dtype=np.uint32)[kinds]
+    single_code = np.where(kinds == 2, type_code('Withdrawal'), type_code('Deposit')).astype(np.uint8)
+
+    # Transfers: monthly rent to a landlord, then payments between accounts
+    renters = np.flatnonzero((rng.random(n) < RENT_SHARE) & ~is_hot)
+    landlords = hot[rng.choice(len(hot), len(renters), p=zipf)]
+    rent_month = np.repeat(np.arange(months), len(renters))
+    count = rng.poisson(n * months * transfers_per_month)
+    to_hot = rng.random(count) < hot_share
+    sender = np.concatenate([np.tile(renters, months), rng.integers(0, n, count)])
+    recipient = np.concatenate([np.tile(landlords, months),
+                                np.where(to_hot, hot[rng.choice(len(hot), count, p=zipf)],
+                                         rng.integers(0, n, count))])
+    recipient = np.where(recipient == sender, (recipient + 1) % n, recipient)
+    t_day = np.concatenate([bounds[rent_month] + rng.integers(0, 5, len(rent_month)),
+                            rng.integers(first_day, end_day, count)])
+    t_amount = np.concatenate([
+        np.tile(_dollars(salary[renters] * RENT_RATIO), months),
+        np.clip(np.rint(rng.lognormal(np.log(TRANSFER_MEDIAN), TRANSFER_SIGMA, count)),
+                100, TRANSFER_MAX).astype(np.int64)])
+    memo = np.concatenate([np.full(len(rent_month), RENT_MEMO),
+                           np.where(to_hot, len(P2P_MEMOS) + rng.integers(0, len(HOT_MEMOS), count),
+                                    rng.integers(0, len(P2P_MEMOS), count))])
+    # Transfer ids follow the calendar
+    by_day = np.argsort(t_day, kind='stable')
+    sender, recipient, t_day, t_amount, memo = (column[by_day] for column in
+                                                (sender, recipient, t_day, t_amount, memo))
+
+    # Rows: singles, then the debit leg and the credit leg of every transfer
+    singles, transfers = len(single_acc), len(sender)
+    acc = np.concatenate([single_acc, sender, recipient])
+    day = np.concatenate([single_day, t_day, t_day])
+    amount = np.concatenate([single_amount, -t_amount, t_amount])
+    # Same-day rows post opening deposit and salary first, the rest as drawn
+    priority = np.concatenate([np.minimum(kinds, 1), np.full(2 * transfers, 1, dtype=np.int8)])
+    order = np.lexsort((priority, day, acc))
+    del priority
+
+    # Bounce overdrawing debits until every running balance is non-negative
+    acc_sorted, amount_sorted = acc[order], amount[order]
+    counts = np.bincount(acc_sorted, minlength=n)
+    group_start = np.repeat(np.cumsum(counts) - counts, counts)
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    partner = order - singles  # Transfer legs' partner rows, in sorted positions
+    is_leg = partner >= 0
+    partner = np.where(partner >= transfers, partner - transfers, partner + transfers) + singles
+    partner = np.where(is_leg, position[np.minimum(partner, len(order) - 1)], -1)
+    del position
+    active = np.ones(len(order), dtype=bool)
+    bounced = 0
+    while True:
+        signed = np.where(active, amount_sorted, 0)
+        running = np.cumsum(signed)
+        balance = running - running[group_start] + signed[group_start]
+        overdrawn = np.flatnonzero(active & (balance < 0) & (amount_sorted < 0))
+        if not len(overdrawn):
+            break
+        bounced += len(overdrawn)
+        active[overdrawn] = False
+        active[partner[overdrawn[is_leg[overdrawn]]]] = False
+    del signed, running, group_start, partner
+
+    # Final columns of the kept rows, in posting order per account
+    rows = order[active]
+    balance = balance[active]
+    del order, active, acc_sorted, amount_sorted
+    acc, day, amount = acc[rows], day[rows], amount[rows]
+    code = np.concatenate([single_code, np.full(2 * transfers, type_code('Transfer'),
+                                                dtype=np.uint8)])[rows]
+    numbers = bank.reserve_account_numbers(n)
+    leg = rows - singles
+    is_leg = leg >= 0
+    leg = leg[is_leg]
+    is_credit = leg >= transfers
+    t = np.where(is_credit, leg - transfers, leg)
+    other = np.where(is_credit, sender[t], recipient[t])
+    party = np.full(len(rows), NO_COUNTERPARTY, dtype=np.int64)
+    party[is_leg] = np.array([int(number) for number in numbers], dtype=np.int64)[other]
+    link = np.zeros(len(rows), dtype=np.uint64)
+    link[is_leg] = bank.next_transfer_id + t
+    desc = np.zeros(len(rows), dtype=np.uint32)
+    desc[~is_leg] = np.concatenate([single_desc, np.zeros(2 * transfers, dtype=np.uint32)])[
+        rows[~is_leg]]
+    # One description per distinct (counterparty, memo, direction)
+    keys, inverse = np.unique((other * len(MEMOS) + memo[t]) * 2 + is_credit,
+                              return_inverse=True)
+    texts = []
+    for key in keys.tolist():
+        rest, credit = divmod(key, 2)
+        party_index, memo_index = divmod(rest, len(MEMOS))
+        direction = 'From' if credit else 'To'
+        texts.append(f"{direction} {numbers[party_index]}: {MEMOS[memo_index]}")
+    desc[is_leg] = np.array([bank.descriptions.intern(text) for text in texts],
+                            dtype=np.uint32)[inverse]
+    del leg, is_credit, other, inverse
+
+    # Analytics aggregates per account, every one starting with its opening row
+    counts = np.bincount(acc, minlength=n)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    type_counts = np.bincount(acc * len(TRANSACTION_TYPES) + code,
+                              minlength=n * len(TRANSACTION_TYPES)).reshape(n, -1)
+    deposits = np.add.reduceat(np.where(code == type_code('Deposit'), amount, 0), starts)
+    withdrawals = np.add.reduceat(np.where(code == type_code('Withdrawal'), -amount, 0), starts)
+    largest = np.maximum.reduceat(amount, starts)
+    closing = balance[ends - 1]
+
+    def entries():
+        first = date.fromisoformat(start).replace(day=1).isoformat()
+        first_names = rng.integers(0, len(FIRST_NAMES), n).tolist()
+        last_names = rng.integers(0, len(LAST_NAMES), n).tolist()
+        phones = rng.integers(0, 10 ** 7, n).tolist()
+        salts = os.urandom(SALT_BYTES * n)
+        columns = [memoryview(np.ascontiguousarray(column)).cast('B') for column in
+                   (day, code, amount, balance, desc, party, link)]
+        sizes = [column.itemsize for column in (day, code, amount, balance, desc, party, link)]
+        dates = day.tolist()
+        for i, (acc_num, lo, hi) in enumerate(zip(numbers, starts.tolist(), ends.tolist())):
+            first_name, last_name = FIRST_NAMES[first_names[i]], LAST_NAMES[last_names[i]]
+            account = banking_module.create_account(
+                acc_num, f"{first_name} {last_name}",
+                f"{first_name}.{last_name}{i}@example.com".lower(), f"555{phones[i]:07d}",
+                int(closing[i]),
+                hash_pin(acc_num[-4:], BULK_PIN_ITERATIONS,
+                         salts[i * SALT_BYTES:(i + 1) * SALT_BYTES]),
+                first)
+            history = TransactionStore(bank.descriptions)
+            history.extend_buffers(*(column[lo * size:hi * size]
+                                     for column, size in zip(columns, sizes)))
+            stats = AccountStats.from_totals(
+                hi - lo,
+                {TRANSACTION_TYPES[c]: k for c, k in enumerate(type_counts[i].tolist()) if k},
+                int(deposits[i]), int(withdrawals[i]), int(largest[i]),
+                map(days_to_date, dates[max(lo, hi - RECENT_DATES):hi]))
+            yield account, history, stats
+
+    with gc_paused():
+        bank.load_histories(entries())
+    return {'accounts': n, 'transactions': len(rows), 'transfers': int(is_leg.sum()) // 2,
+            'bounced': bounced}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic SmartBankr workload")
+    parser.add_argument('-n', type=int, default=1000, help="number of accounts")
+    parser.add_argument('--months', type=int, default=12, help="months of history")
+    parser.add_argument('--start', default='2024-01-01', help="first month, YYYY-MM-DD")
+    parser.add_argument('--seed', type=int, default=42, help="random seed")
+    parser.add_argument('--transfers', type=float, default=TRANSFERS_PER_MONTH,
+                        help="mean payments sent per account and month")
+    parser.add_argument('--data-dir', help="persistent bank directory to generate into")
+    parser.add_argument('--accounts', help="accounts file to write (.csv or .jsonl[.gz])")
+    parser.add_argument('--transactions', help="transactions file to write")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    bank = Bank.open(args.data_dir) if args.data_dir else Bank()
+    try:
+        summary = populate(bank, args.n, args.months, args.start, args.seed, args.transfers)
+        elapsed = time.perf_counter() - t0
+        rate = summary['transactions'] / elapsed if elapsed else float('inf')
+        print(f"Generated {summary['accounts']:,} accounts and {summary['transactions']:,} "
+              f"transactions ({summary['transfers']:,} transfers, {summary['bounced']:,} "
+              f"bounced debits) in {elapsed:.2f}s ({rate:,.0f} transactions/s)",
+              file=sys.stderr)
+        if args.accounts or args.transactions:
+            t0 = time.perf_counter()
+            counts = export_bank(bank, args.accounts, args.transactions)
+            details = ', '.join(f"{count:,} {kind}" for kind, count in counts.items())
+            print(f"Wrote {details} in {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+    except BankError as e:
+        parser.error(str(e))
+    finally:
+        bank.close()
+
+
+if __name__ == "__main__":
+    main()